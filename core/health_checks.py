@@ -1,15 +1,44 @@
 import logging
-from typing import Dict, Any
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, Iterable
 from django.db import connection
-from django.core.cache import cache
 from django.conf import settings
-import redis
 import requests
 from patients.n8n_manager import N8NWorkflowManager
 import time
 
 logger = logging.getLogger('medirecord.health')
 
+# Vérifications par mode :
+# - ready : dépendances indispensables pour servir une requête (sonde readiness)
+# - deep : toutes les dépendances, y compris appels réels aux API externes
+#   (hors du chemin des sondes, résultat mis en cache plus longtemps)
+READY_CHECKS = ('database', 'redis')
+DEEP_CHECKS = ('database', 'redis', 'n8n', 'twilio', 'pinecone', 'gemini')
+CRITICAL_CHECKS = set(READY_CHECKS)
+
+# Délai maximal par vérification (secondes)
+CHECK_TIMEOUTS = {
+    'database': 2.0,
+    'redis': 1.0,
+    'n8n': 3.0,
+    'twilio': 1.0,
+    'pinecone': 3.0,
+    'gemini': 5.0,
+}
+
+# Un pool par mode : des appels deep bloqués (API externes) ne peuvent pas
+# occuper les threads des sondes readiness. Chaque vérification borne en plus
+# ses propres appels réseau (timeouts client), le thread est donc rendu.
+_executors = {
+    'ready': ThreadPoolExecutor(max_workers=4, thread_name_prefix='health-ready'),
+    'deep': ThreadPoolExecutor(max_workers=6, thread_name_prefix='health-deep'),
+}
+_cache: Dict[str, tuple] = {}
+_cache_locks = {'ready': threading.Lock(), 'deep': threading.Lock()}
+
 class HealthChecker:
     """Vérificateur de santé des services"""
     
@@ -18,6 +47,8 @@ class HealthChecker:
         """Vérifier la connexion à la base de données"""
         try:
             with connection.cursor() as cursor:
+                # Connexion propre au thread, fermée ensuite : le délai ne touche pas les requêtes
+                cursor.execute("SET statement_timeout = %s", [int(CHECK_TIMEOUTS['database'] * 1000)])
                 cursor.execute("SELECT 1")
                 result = cursor.fetchone()
             
@@ -33,22 +64,24 @@ class HealthChecker:
                 'message': f'Database connection failed: {str(e)}',
                 'details': {}
             }
+        finally:
+            # Connexion propre au thread du pool : ne pas la laisser vieillir
+            connection.close()
     
     @staticmethod
     def check_redis() -> Dict[str, Any]:
         """Vérifier la connexion à Redis"""
         try:
-            cache.set('health_check', 'test', 30)
-            value = cache.get('health_check')
+            from core.redis_client import get_redis
             
-            if value == 'test':
+            if get_redis().ping():
                 return {
                     'status': 'healthy',
                     'message': 'Redis connection OK',
                     'details': {}
                 }
             else:
-                raise Exception("Redis test value mismatch")
+                raise Exception("Redis ping failed")
                 
         except Exception as e:
             logger.error(f"Redis health check failed: {e}")
@@ -63,7 +96,7 @@ class HealthChecker:
         """Vérifier la connexion à N8N"""
         try:
             manager = N8NWorkflowManager()
-            is_connected = manager.test_connection()
+            is_connected = manager.test_connection(timeout=CHECK_TIMEOUTS['n8n'])
             
             if is_connected:
                 return {
@@ -117,7 +150,7 @@ class HealthChecker:
             
             service = PineconeService()
             # Test simple de connexion
-            stats = service.index.describe_index_stats()
+            stats = service.index.describe_index_stats(_request_timeout=CHECK_TIMEOUTS['pinecone'])
             
             return {
                 'status': 'healthy',
@@ -136,15 +169,30 @@ class HealthChecker:
                 'details': {}
             }
     
+    @staticmethod
+    def check_gemini_config() -> Dict[str, Any]:
+        """Vérifier que Gemini est configuré (sans appel à l'API)"""
+        if os.getenv('GEMINI_API_KEY'):
+            return {
+                'status': 'healthy',
+                'message': 'Gemini configuration OK',
+                'details': {}
+            }
+        return {
+            'status': 'unhealthy',
+            'message': 'GEMINI_API_KEY not configured',
+            'details': {}
+        }
+    
     @staticmethod
     def check_gemini() -> Dict[str, Any]:
-        """Vérifier la connexion à Gemini"""
+        """Vérifier la connexion à Gemini (appel réel, mode deep uniquement)"""
         try:
             from rag.services import EmbeddingService
             
             service = EmbeddingService()
             # Test avec un texte court
-            embedding = service.generate_embedding("test")
+            embedding = service.generate_embedding("test", timeout=CHECK_TIMEOUTS['gemini'])
             
             if embedding and len(embedding) > 0:
                 return {
@@ -164,22 +212,85 @@ class HealthChecker:
             }
     
     @classmethod
-    def run_all_checks(cls) -> Dict[str, Any]:
-        """Exécuter toutes les vérifications de santé"""
-        checks = {
-            'database': cls.check_database(),
-            'redis': cls.check_redis(),
-            'n8n': cls.check_n8n(),
-            'twilio': cls.check_twilio(),
-            'pinecone': cls.check_pinecone(),
-            'gemini': cls.check_gemini(),
-        }
+    def run_checks(cls, names: Iterable[str], mode: str = 'ready') -> Dict[str, Dict[str, Any]]:
+        """Exécute les vérifications en parallèle (pool du mode), chacune avec son propre délai"""
+        started = time.monotonic()
+        futures = {name: _executors[mode].submit(cls._timed_check, name) for name in names}
+        results = {}
+        for name, future in futures.items():
+            remaining = CHECK_TIMEOUTS.get(name, 2.0) - (time.monotonic() - started)
+            done, _ = wait([future], timeout=max(remaining, 0))
+            if done:
+                results[name] = future.result()
+            else:
+                logger.error(f"Health check '{name}' timed out")
+                results[name] = {
+                    'status': 'unhealthy',
+                    'message': f'Check timed out after {CHECK_TIMEOUTS.get(name, 2.0)}s',
+                    'details': {}
+                }
+        return results
+    
+    @classmethod
+    def _timed_check(cls, name: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = getattr(cls, f'check_{name}')()
+        result['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+    
+    @classmethod
+    def run_all_checks(cls, deep: bool = False) -> Dict[str, Any]:
+        """
+        Exécuter les vérifications de santé (mode ready par défaut, deep sur demande).
+        Le résultat est mis en cache HEALTH_CHECK_CACHE_TTL secondes ; une seule
+        exécution à la fois par mode. Pendant un rafraîchissement, les appels
+        concurrents reçoivent le résultat précédent (même expiré) ; seul le
+        tout premier appel attend les vérifications.
+        """
+        mode = 'deep' if deep else 'ready'
+        ttl = getattr(settings, 'HEALTH_CHECK_CACHE_TTL', {}).get(mode, 60 if deep else 10)
         
-        # Déterminer la santé globale
+        cached = _cache.get(mode)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        lock = _cache_locks[mode]
+        if cached:
+            # Rafraîchissement déjà en cours : pas d'attente derrière les délais des vérifications
+            if not lock.acquire(blocking=False):
+                return cached[1]
+        else:
+            lock.acquire()
+        try:
+            cached = _cache.get(mode)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            result = cls._check_mode(mode, deep)
+            _cache[mode] = (time.monotonic() + ttl, result)
+            return result
+        finally:
+            lock.release()
+    
+    @classmethod
+    def _check_mode(cls, mode: str, deep: bool) -> Dict[str, Any]:
+        if deep:
+            checks = cls.run_checks(DEEP_CHECKS, mode='deep')
+        else:
+            checks = cls.run_checks(READY_CHECKS, mode='ready')
+            # Configuration seule : aucun appel réseau vers les API externes
+            checks['twilio'] = cls.check_twilio()
+            checks['gemini'] = cls.check_gemini_config()
+        
+        # Santé globale : les dépendances critiques décident de la disponibilité
+        critical_ok = all(
+            check['status'] == 'healthy'
+            for name, check in checks.items() if name in CRITICAL_CHECKS
+        )
         all_healthy = all(check['status'] == 'healthy' for check in checks.values())
         
         return {
-            'overall_status': 'healthy' if all_healthy else 'unhealthy',
+            'overall_status': 'healthy' if all_healthy else 'degraded' if critical_ok else 'unhealthy',
+            'mode': mode,
             'timestamp': time.time(),
             'checks': checks
-        }
\ No newline at end of file
+        }
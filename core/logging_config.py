@@ -1,36 +1,248 @@
 import os
+import abc
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler, QueueHandler, QueueListener
 from django.conf import settings
 
+
+# ---------------------------
+# Pipeline asynchrone : le thread appelant ne fait que mettre le record en
+# file ; formatage et écriture disque sont faits par un QueueListener.
+# ---------------------------
+class AsyncHandler(QueueHandler, abc.ABC):
+    """
+    Handler non bloquant : les records passent par une file bornée vers le
+    handler cible (`_build_target`). File pleine = record perdu et compté,
+    jamais d'attente sur le chemin de la requête. Relancé après un fork.
+    """
+
+    def __init__(self, queue_size: int = 10000):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.target = self._build_target()
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self._start_listener()
+
+    @abc.abstractmethod
+    def _build_target(self) -> logging.Handler:
+        """Handler qui écrit réellement les records (côté listener)"""
+
+    def _start_listener(self):
+        self._pid = os.getpid()
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self._stop_listener)
+
+    def _stop_listener(self):
+        # Vide la file avant de s'arrêter ; sans effet si déjà arrêté
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        # Le formatage complet se fait côté listener
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Figer le message et la trace maintenant (les arguments peuvent changer),
+        # sans appliquer le formateur sur le thread appelant
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            # Processus enfant (prefork) : le thread du listener n'existe plus
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._stop_listener()
+        self.target.close()
+        super().close()
+
+
+class AsyncRotatingFileHandler(AsyncHandler):
+    def __init__(self, filename, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8', queue_size=10000):
+        self.filename = filename
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.encoding = encoding
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        super().__init__(queue_size=queue_size)
+
+    def _build_target(self):
+        return RotatingFileHandler(
+            self.filename, maxBytes=self.maxBytes, backupCount=self.backupCount,
+            encoding=self.encoding, delay=True
+        )
+
+
+class AsyncStreamHandler(AsyncHandler):
+    def _build_target(self):
+        return logging.StreamHandler(sys.stderr)
+
+
+# ---------------------------
+# Format JSON
+# ---------------------------
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'trace_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par record, avec les champs `extra` et l'identifiant de trace"""
+
+    def format(self, record):
+        payload = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        trace_id = getattr(record, 'trace_id', None) or self._current_trace_id()
+        if trace_id:
+            payload['trace_id'] = trace_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _current_trace_id():
+        try:
+            from core import tracing
+            span = tracing.current_span()
+            return span.trace_id if span is not None and span.sampled else None
+        except Exception:
+            return None
+
+    converter = time.gmtime
+
+
+class TraceContextFilter(logging.Filter):
+    """Capture l'identifiant de trace sur le thread appelant (avant la file)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'trace_id'):
+            record.trace_id = JsonFormatter._current_trace_id()
+        return True
+
+
+# ---------------------------
+# Échantillonnage et limitation de débit
+# ---------------------------
+def _rate_for(name: str, rates: dict):
+    """Taux du préfixe de logger le plus long (ex. 'messaging' couvre 'messaging.tasks')"""
+    best, best_len = None, -1
+    for prefix, rate in rates.items():
+        if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best_len:
+            best, best_len = rate, len(prefix)
+    return best
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ne garde qu'une fraction des records DEBUG/INFO des loggers configurés,
+    ex. {'messaging.whatsapp_rag_webhook': 0.1}. WARNING et au-delà passent toujours.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = _rate_for(record.name, self.rates)
+        return rate is None or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Au plus `max_per_interval` records DEBUG/INFO par ligne d'appel
+    (logger, fichier, ligne) et par fenêtre de `interval` secondes : les
+    messages sont des f-strings, le texte varie à chaque appel. Le nombre de
+    records supprimés est rapporté sur le premier record de la fenêtre
+    suivante. Une instance par handler (les compteurs ne sont pas partagés).
+    """
+
+    def __init__(self, max_per_interval=100, interval=60):
+        super().__init__()
+        self.max_per_interval = max_per_interval
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                if suppressed:
+                    record.suppressed = suppressed
+                start, count, suppressed = now, 0, 0
+            count += 1
+            if count > self.max_per_interval:
+                self._windows[key] = (start, count, suppressed + 1)
+                return False
+            self._windows[key] = (start, count, suppressed)
+        return True
+
+
 def setup_logging():
     """Configuration centralisée du logging pour MediRecord"""
-    
+
     # Créer le dossier de logs
     log_dir = os.path.join(settings.BASE_DIR, 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
+
     # Configuration du format
-    formatter = logging.Formatter(
-        '%(asctime)s [%(levelname)s] %(name)s: %(message)s '
-        '[%(filename)s:%(lineno)d] [PID:%(process)d]'
-    )
-    
+    formatter = JsonFormatter()
+
     # Logger principal MediRecord
     logger = logging.getLogger('medirecord')
     logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
-    
-    # Handler pour fichier général (rotation par taille)
-    general_handler = RotatingFileHandler(
+
+    # Handler pour fichier général (rotation par taille, écriture hors du thread appelant)
+    general_handler = AsyncRotatingFileHandler(
         os.path.join(log_dir, 'medirecord.log'),
         maxBytes=10*1024*1024,  # 10MB
         backupCount=5
     )
     general_handler.setFormatter(formatter)
     general_handler.setLevel(logging.INFO)
+    general_handler.addFilter(TraceContextFilter())
     logger.addHandler(general_handler)
-    
-    # Handler pour erreurs (rotation quotidienne)
+
+    # Handler pour erreurs (rotation quotidienne, volume faible : synchrone)
     error_handler = TimedRotatingFileHandler(
         os.path.join(log_dir, 'errors.log'),
         when='midnight',
@@ -40,56 +252,31 @@ def setup_logging():
     error_handler.setFormatter(formatter)
     error_handler.setLevel(logging.ERROR)
     logger.addHandler(error_handler)
-    
+
     # Logger spécialisés
     setup_specialized_loggers(log_dir, formatter)
-    
+
     # Console handler pour le développement
     if settings.DEBUG:
-        console_handler = logging.StreamHandler()
+        console_handler = AsyncStreamHandler()
         console_handler.setFormatter(formatter)
         console_handler.setLevel(logging.DEBUG)
         logger.addHandler(console_handler)
 
 def setup_specialized_loggers(log_dir, formatter):
     """Configuration des loggers spécialisés"""
-    
-    # Logger RAG
-    rag_logger = logging.getLogger('medirecord.rag')
-    rag_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'rag.log'),
-        maxBytes=5*1024*1024,
-        backupCount=3
-    )
-    rag_handler.setFormatter(formatter)
-    rag_logger.addHandler(rag_handler)
-    
-    # Logger WhatsApp
-    whatsapp_logger = logging.getLogger('medirecord.whatsapp')
-    whatsapp_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'whatsapp.log'),
-        maxBytes=5*1024*1024,
-        backupCount=3
-    )
-    whatsapp_handler.setFormatter(formatter)
-    whatsapp_logger.addHandler(whatsapp_handler)
-    
-    # Logger N8N
-    n8n_logger = logging.getLogger('medirecord.n8n')
-    n8n_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'n8n.log'),
-        maxBytes=5*1024*1024,
-        backupCount=3
-    )
-    n8n_handler.setFormatter(formatter)
-    n8n_logger.addHandler(n8n_handler)
-    
-    # Logger Celery
-    celery_logger = logging.getLogger('medirecord.celery')
-    celery_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'celery.log'),
-        maxBytes=5*1024*1024,
-        backupCount=3
-    )
-    celery_handler.setFormatter(formatter)
-    celery_logger.addHandler(celery_handler)
+
+    for name, file_name in (
+        ('medirecord.rag', 'rag.log'),
+        ('medirecord.whatsapp', 'whatsapp.log'),
+        ('medirecord.n8n', 'n8n.log'),
+        ('medirecord.celery', 'celery.log'),
+    ):
+        handler = AsyncRotatingFileHandler(
+            os.path.join(log_dir, file_name),
+            maxBytes=5*1024*1024,
+            backupCount=3
+        )
+        handler.setFormatter(formatter)
+        handler.addFilter(TraceContextFilter())
+        logging.getLogger(name).addHandler(handler)
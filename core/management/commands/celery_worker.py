@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mediServe.worker_profiles import WORKER_PROFILES, worker_argv
+
+
+class Command(BaseCommand):
+    help = "Lance un worker Celery selon un profil (cpu, io, realtime, maintenance)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', required=True, choices=sorted(WORKER_PROFILES))
+        parser.add_argument('--loglevel', default='info')
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Afficher la commande sans lancer le worker")
+
+    def handle(self, *args, **options):
+        argv = worker_argv(options['profile'], options['loglevel'])
+
+        if options['dry_run']:
+            self.stdout.write('celery -A mediServe ' + ' '.join(argv))
+            return
+
+        from mediServe.celery import app
+        try:
+            app.worker_main(argv)
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            raise CommandError(f"Échec du worker '{options['profile']}': {e}")
@@ -0,0 +1,132 @@
+import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from rag.reindex import Checkpoint, live_queue_depth, pool_initializer, run_patient
+
+
+class Command(BaseCommand):
+    help = ("Réindexe les stores patients (blue/green) : construction en parallèle, "
+            "bascule atomique par patient, reprise via --run-id")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run-id', help="Reprendre une réindexation (sinon un nouvel identifiant est créé)")
+        parser.add_argument('--embedder', default=None,
+                            help="Modèle d'embedding cible (défaut : RAG_SETTINGS['EMBEDDING_MODEL'])")
+        parser.add_argument('--patients', nargs='*', type=int, help="Limiter à ces patients")
+        parser.add_argument('--workers', type=int, default=2, help="Patients construits en parallèle")
+        parser.add_argument('--celery', action='store_true',
+                            help="Construire sur les workers Celery (queue cpu) au lieu d'un pool local")
+        parser.add_argument('--max-queue-depth', type=int, default=10,
+                            help="Pause tant que les queues cpu/realtime dépassent ce nombre de messages")
+        parser.add_argument('--throttle-sleep', type=float, default=5.0)
+        parser.add_argument('--retry-failed', action='store_true', help="Reprendre aussi les patients en échec")
+
+    def handle(self, *args, **options):
+        from documents.models import DocumentUpload
+
+        run_id = options['run_id'] or timezone.now().strftime('%Y%m%d%H%M%S')
+        embedder = options['embedder'] or settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
+        checkpoint = Checkpoint(run_id)
+
+        patients = DocumentUpload.objects.filter(upload_status='indexed')
+        if options['patients']:
+            patients = patients.filter(patient_id__in=options['patients'])
+        patient_ids = sorted(set(patients.values_list('patient_id', flat=True)))
+
+        statuses = checkpoint.statuses()
+        pending = [
+            patient_id for patient_id in patient_ids
+            if statuses.get(patient_id) != 'done'
+            and (options['retry_failed'] or not statuses.get(patient_id, '').startswith('failed'))
+        ]
+        self.stdout.write(
+            f"Réindexation {run_id} ({embedder}) : {len(pending)} patients à traiter, "
+            f"{len(patient_ids) - len(pending)} déjà faits ou en échec"
+        )
+        if not pending:
+            return
+
+        self._ok = self._failed = 0
+        self._total = len(pending)
+        if options['celery']:
+            self._run_celery(pending, run_id, embedder, options)
+        else:
+            self._run_pool(pending, run_id, embedder, options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Terminé : {self._ok} réindexés, {self._failed} en échec. "
+            f"Reprise : manage.py reindex --run-id {run_id} --retry-failed"
+        ))
+
+    def _throttle(self, options):
+        """Attendre que le trafic en direct (indexation, réponses) se résorbe"""
+        while True:
+            try:
+                depth = live_queue_depth()
+            except Exception as e:
+                self.stderr.write(f"Profondeur des queues illisible ({e}), pas de régulation")
+                return
+            if depth <= options['max_queue_depth']:
+                return
+            self.stdout.write(f"  ⏸ {depth} messages en attente, pause {options['throttle_sleep']}s")
+            time.sleep(options['throttle_sleep'])
+
+    def _report(self, patient_id, status):
+        if status == 'done':
+            self._ok += 1
+        else:
+            self._failed += 1
+            self.stderr.write(f"  ❌ patient {patient_id}: {status}")
+        self.stdout.write(f"  [{self._ok + self._failed}/{self._total}] patient {patient_id}: {status}")
+
+    def _run_pool(self, pending, run_id, embedder, options):
+        # Pas de connexion héritée par les processus forkés
+        connections.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=pool_initializer,
+            initargs=(embedder,)
+        )
+        in_flight = {}
+        queue = list(pending)
+        try:
+            while queue or in_flight:
+                while queue and len(in_flight) < options['workers']:
+                    self._throttle(options)
+                    patient_id = queue.pop(0)
+                    in_flight[executor.submit(run_patient, patient_id, run_id, embedder)] = patient_id
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    patient_id = in_flight.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        status = f"failed:{e}"
+                    self._report(patient_id, status)
+        except KeyboardInterrupt:
+            raise CommandError(f"Interrompu : relancer avec --run-id {run_id} pour reprendre")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run_celery(self, pending, run_id, embedder, options):
+        from celery import group
+        from rag.tasks import reindex_patient_task
+
+        # Par vagues de --workers patients : la vague suivante part quand les queues sont calmes
+        for start in range(0, len(pending), options['workers']):
+            wave = pending[start:start + options['workers']]
+            self._throttle(options)
+            result = group(reindex_patient_task.s(patient_id, run_id, embedder) for patient_id in wave).apply_async()
+            try:
+                statuses = result.join(propagate=False)
+            except KeyboardInterrupt:
+                raise CommandError(f"Interrompu : relancer avec --run-id {run_id} pour reprendre")
+            for patient_id, status in zip(wave, statuses):
+                self._report(patient_id, status if isinstance(status, str) else f"failed:{status}")
@@ -0,0 +1,31 @@
+import logging
+import threading
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+_client_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """Retourne le client Redis partagé du processus (pool de connexions unique)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                url = getattr(settings, 'REDIS_URL', None) or settings.CELERY_BROKER_URL
+                _client = redis.from_url(url, socket_timeout=5, socket_connect_timeout=2)
+    return _client
+
+
+def redis_available() -> bool:
+    """Vérifie rapidement que Redis répond"""
+    try:
+        return bool(get_redis().ping())
+    except Exception as e:
+        logger.warning(f"Redis indisponible: {e}")
+        return False
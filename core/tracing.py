@@ -0,0 +1,351 @@
+# core/tracing.py
+"""
+Traçage léger du cycle de vie des requêtes RAG et de l'indexation.
+
+Spans imbriqués (contextvars) avec durée et attributs, échantillonnés à la
+racine : une trace non retenue ne coûte qu'un tirage aléatoire et quelques
+objets. Les spans terminés sont exportés par lots en arrière-plan, soit
+dans un fichier JSONL, soit vers un collecteur OTLP/HTTP (JSON).
+
+Sans dépendance Django : configuration par variables d'environnement
+(TRACING_EXPORTER = none | jsonl | otlp, TRACING_SAMPLE_RATE,
+TRACING_JSONL_PATH, TRACING_OTLP_ENDPOINT, TRACING_SERVICE_NAME).
+
+Usage:
+    with tracing.span('retriever.retrieve', top_k=5) as s:
+        ...
+        s.set_attribute('candidates', len(items))
+"""
+import os
+import abc
+import json
+import time
+import random
+import atexit
+import logging
+import threading
+import functools
+import contextvars
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_ENV = 'TRACEPARENT'
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id(n_bytes: int) -> str:
+    return random.getrandbits(n_bytes * 8).to_bytes(n_bytes, 'big').hex()
+
+
+class Span:
+    """Span enregistré (trace échantillonnée)"""
+    sampled = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.status = 'ok'
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _UnsampledSpan:
+    """Span d'une trace non échantillonnée : propage la décision, n'enregistre rien"""
+    sampled = False
+    attributes: Dict[str, Any] = {}
+
+    def __init__(self, trace_id: str, span_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id or _new_id(8)
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+
+class _RemoteParent:
+    """Parent reçu d'un autre processus (variable TRACEPARENT)"""
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+# ---------------------------
+# Export
+# ---------------------------
+class BatchExporter(abc.ABC):
+    """Accumule les spans terminés et les exporte par lots depuis un thread"""
+
+    def __init__(self, max_queue: int = 10000, flush_interval: float = 2.0):
+        self._spans = deque(maxlen=max_queue)
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        self._thread = None
+        self._pid = None
+
+    def submit(self, span: Span):
+        self._spans.append(span)
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='tracing-export', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while self._spans:
+            try:
+                batch.append(self._spans.popleft())
+            except IndexError:
+                break
+        if batch:
+            try:
+                self.export(batch)
+            except Exception as e:
+                logger.warning(f"Export de {len(batch)} spans échoué: {e}")
+
+    @abc.abstractmethod
+    def export(self, spans):
+        """Envoie un lot de spans terminés (appelé depuis le thread d'export)"""
+
+
+class JsonlExporter(BatchExporter):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str, ensure_ascii=False) + '\n')
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpHttpExporter(BatchExporter):
+    """Export OTLP/HTTP en JSON (POST <endpoint>/v1/traces)"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def _span_payload(self, span: Span) -> Dict[str, Any]:
+        payload = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+            'status': {'code': 2 if span.status == 'error' else 1},
+        }
+        if span.parent_id:
+            payload['parentSpanId'] = span.parent_id
+        return payload
+
+    def export(self, spans):
+        body = {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'mediServe.tracing'},
+                    'spans': [self._span_payload(span) for span in spans],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(body, default=str).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# ---------------------------
+# Configuration
+# ---------------------------
+_config = {
+    'sample_rate': float(os.getenv('TRACING_SAMPLE_RATE', '0.1')),
+    'exporter': None,
+}
+_config_lock = threading.Lock()
+_configured = False
+
+
+def configure(exporter: Optional[str] = None, sample_rate: Optional[float] = None,
+              jsonl_path: Optional[str] = None, otlp_endpoint: Optional[str] = None,
+              service_name: Optional[str] = None):
+    """Configure le traçage (par défaut depuis l'environnement au premier span)"""
+    global _configured
+    exporter = exporter or os.getenv('TRACING_EXPORTER', 'none')
+    service_name = service_name or os.getenv('TRACING_SERVICE_NAME', 'mediServe')
+
+    with _config_lock:
+        if sample_rate is not None:
+            _config['sample_rate'] = float(sample_rate)
+        if exporter == 'jsonl':
+            _config['exporter'] = JsonlExporter(
+                jsonl_path or os.getenv('TRACING_JSONL_PATH', 'logs/traces.jsonl')
+            )
+        elif exporter == 'otlp':
+            _config['exporter'] = OtlpHttpExporter(
+                otlp_endpoint or os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318'),
+                service_name
+            )
+        else:
+            _config['exporter'] = None
+        if _config['exporter'] is not None:
+            atexit.register(_config['exporter'].flush)
+        _configured = True
+
+
+def enabled() -> bool:
+    if not _configured:
+        configure()
+    return _config['exporter'] is not None and _config['sample_rate'] > 0
+
+
+# ---------------------------
+# API
+# ---------------------------
+def current_span():
+    """Span courant (None hors trace) — pour ajouter des attributs depuis un appelé"""
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any):
+    span_ = _current_span.get()
+    if span_ is not None:
+        span_.set_attribute(key, value)
+
+
+@contextmanager
+def span(name: str, parent=None, **attributes):
+    parent = parent or _current_span.get()
+
+    if parent is None:
+        trace_id = _new_id(16)
+        sampled = enabled() and random.random() < _config['sample_rate']
+    else:
+        trace_id = parent.trace_id
+        sampled = parent.sampled and enabled()
+
+    if not sampled:
+        unsampled = _UnsampledSpan(trace_id)
+        token = _current_span.set(unsampled)
+        try:
+            yield unsampled
+        finally:
+            _current_span.reset(token)
+        return
+
+    new_span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = 'error'
+        new_span.set_attribute('error', f"{e.__class__.__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.finish()
+        exporter = _config['exporter']
+        if exporter is not None:
+            exporter.submit(new_span)
+
+
+def traced(name: Optional[str] = None):
+    """Décorateur : exécute la fonction dans un span"""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traceparent() -> Optional[str]:
+    """En-tête W3C du span courant, pour poursuivre la trace dans un autre processus"""
+    span_ = _current_span.get()
+    if span_ is None:
+        return None
+    return f"00-{span_.trace_id}-{span_.span_id}-{'01' if span_.sampled else '00'}"
+
+
+def parent_from_traceparent(value: Optional[str]):
+    """Parent distant à partir d'un en-tête W3C (ou de la variable TRACEPARENT)"""
+    value = value or os.getenv(TRACEPARENT_ENV)
+    if not value:
+        return None
+    try:
+        _version, trace_id, span_id, flags = value.split('-')
+        return _RemoteParent(trace_id, span_id, flags == '01')
+    except ValueError:
+        return None
@@ -5,15 +5,32 @@ from .health_checks import HealthChecker
 
 class HealthCheckView(views.APIView):
     """
-    GET /api/health/
+    GET /api/health/          readiness (base + Redis, résultat en cache)
+    GET /api/health/?deep=1   toutes les dépendances, appels réels aux API externes
+                              (administrateurs uniquement)
     Endpoint de vérification de santé du système
     """
     permission_classes = [AllowAny]
     
     def get(self, request):
-        health_status = HealthChecker.run_all_checks()
+        deep = request.GET.get('deep') in ('1', 'true', 'yes')
+        if deep and not request.user.is_staff:
+            # Le mode deep appelle Gemini, Pinecone et n8n : pas d'accès anonyme
+            return Response({'detail': 'Le mode deep est réservé aux administrateurs.'}, status=403)
+        health_status = HealthChecker.run_all_checks(deep=deep)
         
-        # Status HTTP basé sur la santé globale
-        status_code = 200 if health_status['overall_status'] == 'healthy' else 503
+        # Status HTTP basé sur les dépendances critiques (dégradé = toujours disponible)
+        status_code = 503 if health_status['overall_status'] == 'unhealthy' else 200
         
         return Response(health_status, status=status_code)
+
+class LivenessView(views.APIView):
+    """
+    GET /api/health/live/
+    Sonde liveness : le processus répond, aucune dépendance vérifiée
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    
+    def get(self, request):
+        return Response({'status': 'alive'})
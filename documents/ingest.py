@@ -0,0 +1,94 @@
+# documents/ingest.py
+"""
+Ingestion groupée de documents.
+
+Les fichiers reçus sont déjà sur disque (TemporaryFileUploadHandler, écrit
+par morceaux) : la sauvegarde dans le stockage est un simple déplacement.
+Les lignes DocumentUpload sont insérées en un bulk_create, puis un seul
+`group` Celery est envoyé avec une tâche par lot de documents d'un même
+patient : le store du patient est écrit une fois par lot et non une fois
+par fichier.
+"""
+import uuid
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from celery import group
+from django.conf import settings
+from django.db import transaction
+
+from .models import DocumentUpload
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TYPES = ('pdf', 'jpg', 'jpeg', 'png', 'tiff', 'bmp')
+
+
+def _file_type(name: str) -> str:
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def create_uploads(patient, files: Iterable) -> Tuple[List[DocumentUpload], List[Dict]]:
+    """
+    Crée les DocumentUpload d'un patient en une insertion.
+    Retourne (documents créés, fichiers rejetés avec la raison).
+    """
+    max_size = settings.RAG_SETTINGS.get('MAX_FILE_SIZE', 50 * 1024 * 1024)
+    documents, rejected = [], []
+
+    for file in files:
+        file_type = _file_type(file.name)
+        if file_type not in SUPPORTED_TYPES:
+            rejected.append({'filename': file.name, 'status': 'error', 'error': f"Type non supporté: {file_type or '?'}"})
+            continue
+        if file.size > max_size:
+            rejected.append({'filename': file.name, 'status': 'error', 'error': "Fichier trop volumineux"})
+            continue
+        documents.append(DocumentUpload(
+            patient=patient,
+            file=file,
+            original_filename=file.name,
+            file_size=file.size,
+            file_type=file_type,
+        ))
+
+    if documents:
+        # Le pre_save du FileField range chaque fichier dans le stockage pendant l'insertion
+        documents = DocumentUpload.objects.bulk_create(documents)
+    return documents, rejected
+
+
+def dispatch_indexing(documents: List[DocumentUpload]) -> Dict[int, str]:
+    """
+    Envoie un group Celery : une tâche process_document_batch par lot de
+    DOCUMENT_BATCH_SIZE documents d'un même patient. Les identifiants de
+    tâche sont enregistrés avant l'envoi (pas de course avec le worker).
+    Retourne {document_id: task_id}.
+    """
+    from .tasks import process_document_batch
+
+    batch_size = getattr(settings, 'DOCUMENT_BATCH_SIZE', 20)
+    by_patient = defaultdict(list)
+    for doc in documents:
+        by_patient[doc.patient_id].append(doc)
+
+    signatures = []
+    for patient_id, patient_docs in by_patient.items():
+        for start in range(0, len(patient_docs), batch_size):
+            batch = patient_docs[start:start + batch_size]
+            task_id = str(uuid.uuid4())
+            for doc in batch:
+                doc.celery_task_id = task_id
+            signatures.append(
+                process_document_batch.s(patient_id, [doc.id for doc in batch]).set(task_id=task_id)
+            )
+
+    if not signatures:
+        return {}
+
+    DocumentUpload.objects.bulk_update(documents, ['celery_task_id'])
+    # Envoi après le commit : le worker doit voir les lignes
+    transaction.on_commit(lambda: group(signatures).apply_async())
+    logger.info(f"📦 {len(documents)} documents envoyés en {len(signatures)} lots ({len(by_patient)} patients)")
+    return {doc.id: doc.celery_task_id for doc in documents}
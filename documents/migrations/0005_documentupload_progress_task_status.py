@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_remove_documentupload_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentupload',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Progression du traitement (0-100)'),
+        ),
+        migrations.AddField(
+            model_name='documentupload',
+            name='task_status',
+            field=models.CharField(blank=True, help_text='Dernière étape rapportée par la tâche', max_length=255),
+        ),
+    ]
@@ -30,6 +30,9 @@ class DocumentUpload(models.Model):
     file_size = models.IntegerField()
     upload_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     error_message = models.TextField(blank=True)
+    # Copie de la progression Celery : les documents terminés ne sont plus lus dans Redis
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Progression du traitement (0-100)")
+    task_status = models.CharField(max_length=255, blank=True, help_text="Dernière étape rapportée par la tâche")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
 
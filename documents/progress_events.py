@@ -0,0 +1,191 @@
+# documents/progress_events.py
+"""
+Diffusion en direct de la progression d'indexation.
+
+process_document_async publie chaque étape sur le canal Redis du patient
+(PUBLISH indexing:patient:<id>). Le flux SSE
+GET /api/patients/<id>/indexing-events/ est une vue Django asynchrone
+(middlewares appliqués, servie sous ASGI) : elle s'abonne à ce canal, envoie
+d'abord l'état courant des documents puis relaie chaque événement dès sa
+publication. Le flux se termine quand tous les documents sont indexés ou en
+échec ; EventSource se reconnecte de lui-même après SSE_MAX_DURATION.
+
+Un seul client Redis asynchrone et une seule connexion pub/sub par
+processus (ProgressBroker) : les flux ouverts reçoivent leurs événements
+dans une file asyncio, sans connexion Redis propre.
+"""
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Set
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'indexing:patient:'
+FINISHED_STATUSES = ('indexed', 'failed')
+
+
+def channel_for_patient(patient_id) -> str:
+    return f'{CHANNEL_PREFIX}{patient_id}'
+
+
+def _event_payload(doc) -> Dict:
+    return {
+        'document_id': doc.id,
+        'status': doc.upload_status,
+        'progress': doc.progress,
+        'task_status': doc.task_status,
+        'error': doc.error_message or None,
+    }
+
+
+def publish_progress(doc_upload):
+    """Publie l'état courant d'un document (jamais bloquant pour la tâche)"""
+    try:
+        from core.redis_client import get_redis
+        get_redis().publish(
+            channel_for_patient(doc_upload.patient_id),
+            json.dumps(_event_payload(doc_upload), ensure_ascii=False)
+        )
+    except Exception as e:
+        logger.debug(f"Publication de la progression impossible: {e}")
+
+
+# ---------------------------
+# Flux SSE (vue Django asynchrone)
+# ---------------------------
+class ProgressBroker:
+    """
+    Abonnements pub/sub du processus : une connexion Redis pour tous les flux,
+    canaux (dés)abonnés à la demande, messages répartis dans les files des flux.
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._listeners: Dict[str, Set[asyncio.Queue]] = {}
+        self._client = None
+        self._pubsub = None
+        self._reader = None
+        self._lock = None
+
+    async def subscribe(self, patient_id) -> asyncio.Queue:
+        channel = channel_for_patient(patient_id)
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pubsub is None:
+                import redis.asyncio as aioredis
+                url = getattr(settings, 'REDIS_URL', None) or settings.CELERY_BROKER_URL
+                self._client = aioredis.from_url(url)
+                self._pubsub = self._client.pubsub()
+            if channel not in self._listeners:
+                await self._pubsub.subscribe(channel)
+                self._listeners[channel] = set()
+            self._listeners[channel].add(queue)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.ensure_future(self._read())
+        return queue
+
+    async def unsubscribe(self, patient_id, queue: asyncio.Queue):
+        channel = channel_for_patient(patient_id)
+        async with self._lock:
+            listeners = self._listeners.get(channel)
+            if listeners is None:
+                return
+            listeners.discard(queue)
+            if not listeners:
+                del self._listeners[channel]
+                try:
+                    await self._pubsub.unsubscribe(channel)
+                except Exception as e:
+                    logger.debug(f"Désabonnement {channel} impossible: {e}")
+
+    async def _read(self):
+        while self._listeners:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                logger.warning(f"Lecture pub/sub de la progression interrompue: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode('utf-8')
+            data = json.loads(message['data'])
+            for queue in list(self._listeners.get(channel, ())):
+                try:
+                    queue.put_nowait(data)
+                except asyncio.QueueFull:
+                    logger.debug(f"Flux SSE trop lent, événement ignoré ({channel})")
+
+
+_broker = ProgressBroker()
+
+
+def _format_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode('utf-8')
+
+
+async def _event_stream(patient_id: int, queue: asyncio.Queue, documents: List[Dict]):
+    keepalive = getattr(settings, 'SSE_KEEPALIVE_SECONDS', 15)
+    max_duration = getattr(settings, 'SSE_MAX_DURATION', 600)
+    try:
+        yield _format_event('snapshot', documents)
+
+        statuses = {doc['document_id']: doc['status'] for doc in documents}
+        deadline = time.monotonic() + max_duration
+        while time.monotonic() < deadline:
+            if statuses and all(s in FINISHED_STATUSES for s in statuses.values()):
+                yield _format_event('complete', {'patient_id': patient_id})
+                break
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            statuses[data['document_id']] = data['status']
+            yield _format_event('progress', data)
+    finally:
+        # Fin du flux ou déconnexion du client (itérateur annulé par Django)
+        await _broker.unsubscribe(patient_id, queue)
+
+
+@require_GET
+async def indexing_events(request, patient_id: int):
+    """
+    GET /api/patients/{patient_id}/indexing-events/
+    Flux SSE de la progression d'indexation (mêmes accès que indexing-status)
+    """
+    from asgiref.sync import sync_to_async
+    from patients.models import Patient
+
+    exists = await sync_to_async(Patient.objects.filter(id=patient_id).exists, thread_sensitive=False)()
+    if not exists:
+        return JsonResponse({'error': 'Patient non trouvé'}, status=404)
+
+    # S'abonner avant de lire l'état initial : aucun événement perdu entre les deux
+    try:
+        queue = await _broker.subscribe(patient_id)
+    except Exception as e:
+        logger.error(f"Flux SSE d'indexation indisponible (patient {patient_id}): {e}")
+        return JsonResponse({'error': 'Flux de progression indisponible'}, status=503)
+    try:
+        documents = await sync_to_async(_snapshot, thread_sensitive=False)(patient_id)
+    except Exception:
+        await _broker.unsubscribe(patient_id, queue)
+        raise
+
+    response = StreamingHttpResponse(
+        _event_stream(patient_id, queue, documents), content_type='text/event-stream; charset=utf-8'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Pas de mise en tampon côté nginx
+    return response
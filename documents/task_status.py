@@ -0,0 +1,68 @@
+# documents/task_status.py
+"""
+Lecture groupée de l'état des tâches Celery d'indexation.
+
+Les métadonnées de toutes les tâches en cours sont lues en un seul MGET
+sur le backend de résultats (au lieu d'un AsyncResult par document). Les
+documents terminés (indexed / failed) ne sont pas lus : leur progression
+est recopiée dans DocumentUpload par la tâche elle-même.
+"""
+import logging
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('indexed', 'failed')
+
+
+def fetch_task_metas(task_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Retourne {task_id: meta} ({'status', 'result', ...}) pour les tâches
+    connues du backend. Un seul aller-retour avec un backend clé/valeur
+    (Redis) ; repli sur AsyncResult sinon.
+    """
+    task_ids = [task_id for task_id in dict.fromkeys(task_ids) if task_id]
+    if not task_ids:
+        return {}
+
+    from celery import current_app
+    backend = current_app.backend
+    metas = {}
+
+    if hasattr(backend, 'mget') and hasattr(backend, 'get_key_for_task'):
+        try:
+            values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+            for task_id, value in zip(task_ids, values):
+                if value:
+                    metas[task_id] = backend.decode_result(value)
+            return metas
+        except Exception as e:
+            logger.warning(f"MGET des états Celery impossible ({e}), lecture individuelle")
+
+    from celery.result import AsyncResult
+    for task_id in task_ids:
+        try:
+            result = AsyncResult(task_id)
+            metas[task_id] = {'status': result.state, 'result': result.info}
+        except Exception as e:
+            logger.warning(f"Erreur récupération statut Celery pour la tâche {task_id}: {e}")
+    return metas
+
+
+def live_task_ids(documents: Iterable[Dict]) -> list:
+    """Tâches à interroger : documents (dicts .values()) non terminés ayant une tâche"""
+    return [
+        doc['celery_task_id'] for doc in documents
+        if doc['celery_task_id'] and doc['upload_status'] not in FINISHED_STATUSES
+    ]
+
+
+def progress_from_meta(meta: Dict) -> Dict:
+    """Champs `progress` / `task_status` d'une réponse à partir d'une meta Celery"""
+    state = meta.get('status')
+    info = meta.get('result')
+    if state == 'PROGRESS' and isinstance(info, dict):
+        return {'progress': info.get('current', 0), 'task_status': info.get('status', '')}
+    if state in ('SUCCESS', 'FAILURE'):
+        return {'task_status': state}
+    return {}
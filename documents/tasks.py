@@ -8,6 +8,8 @@ import os
 import subprocess
 from django.conf import settings
 from kombu import Connection
+from core import tracing
+from .progress_events import publish_progress
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +23,58 @@ def check_celery_connection():
         logger.error(f"❌ ERREUR Connexion Celery: {e}")
         return False
 
+def _report_progress(task, doc_upload, current, status_text, state='PROGRESS'):
+    """Publie la progression dans Celery et la recopie sur le document (lu sans Redis une fois terminé)"""
+    task.update_state(state=state, meta={'current': current, 'total': 100, 'status': status_text})
+    doc_upload.progress = current
+    doc_upload.task_status = status_text
+    doc_upload.save(update_fields=['progress', 'task_status'])
+    publish_progress(doc_upload)
+
+
+def _run_vectorize_script(script_path, document_ids, on_line=None):
+    """Lance le script de vectorisation et relaie sa sortie. Retourne (code, lignes)."""
+    os.chmod(script_path, 0o755)
+    
+    env = os.environ.copy()
+    env['DJANGO_SETTINGS_MODULE'] = 'mediServe.settings'
+    env['PYTHONPATH'] = str(settings.BASE_DIR) + os.pathsep + env.get('PYTHONPATH', '')
+    # Le script poursuit la trace de la tâche
+    traceparent = tracing.traceparent()
+    if traceparent:
+        env[tracing.TRACEPARENT_ENV] = traceparent
+    
+    process = subprocess.Popen(
+        [script_path] + [str(document_id) for document_id in document_ids],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        env=env,
+        cwd=settings.BASE_DIR
+    )
+    
+    # Lire la sortie avec progression
+    output_lines = []
+    for line in iter(process.stdout.readline, ''):
+        line = line.strip()
+        if line:
+            logger.info(f"[SCRIPT] {line}")
+            output_lines.append(line)
+            if on_line:
+                on_line(line)
+    
+    process.stdout.close()
+    return process.wait(), output_lines
+
+
 @shared_task(bind=True, name='documents.tasks.process_document_async')
+@tracing.traced('documents.process_document_async')
 def process_document_async(self, document_upload_id):
     """
     Tâche Celery pour traiter un document avec progression détaillée
     """
     logger.info(f"[DÉBUT] Traitement du document {document_upload_id}")
+    tracing.set_attribute('document_id', document_upload_id)
     
     try:
         # 1. Récupérer le document
@@ -38,38 +86,28 @@ def process_document_async(self, document_upload_id):
             doc_upload.save(update_fields=['celery_task_id'])
         
         # 2. Vérifications initiales
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 5, 'total': 100, 'status': 'Vérification du fichier...'}
-        )
+        _report_progress(self, doc_upload, 5, 'Vérification du fichier...')
         
         if not doc_upload.file or not os.path.exists(doc_upload.file.path):
             logger.error(f"Fichier manquant pour document {document_upload_id}")
             doc_upload.upload_status = 'failed'
+            doc_upload.task_status = 'FAILURE'
             doc_upload.error_message = "Fichier physique introuvable"
             doc_upload.save()
+            publish_progress(doc_upload)
             return {"status": "error", "error": "Fichier manquant"}
         
         # 3. Démarrer le traitement
         doc_upload.upload_status = 'processing'
         doc_upload.save()
         
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 15, 'total': 100, 'status': 'Initialisation du traitement...'}
-        )
+        _report_progress(self, doc_upload, 15, 'Initialisation du traitement...')
         
         # 4. Extraction du texte
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 30, 'total': 100, 'status': 'Extraction du texte...'}
-        )
+        _report_progress(self, doc_upload, 30, 'Extraction du texte...')
         
         # 5. Vectorisation
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 60, 'total': 100, 'status': 'Vectorisation en cours...'}
-        )
+        _report_progress(self, doc_upload, 60, 'Vectorisation en cours...')
         
         # 6. Exécuter le script de vectorisation
         script_path = os.path.join(settings.BASE_DIR, 'scripts', 'vectorize_document.sh')
@@ -77,47 +115,21 @@ def process_document_async(self, document_upload_id):
         if not os.path.exists(script_path):
             logger.error(f"Script non trouvé: {script_path}")
             doc_upload.upload_status = 'failed'
+            doc_upload.task_status = 'FAILURE'
             doc_upload.error_message = "Script de vectorisation non trouvé"
             doc_upload.save()
+            publish_progress(doc_upload)
             return {"status": "error", "error": "Script non trouvé"}
         
-        os.chmod(script_path, 0o755)
-        
-        env = os.environ.copy()
-        env['DJANGO_SETTINGS_MODULE'] = 'mediServe.settings'
-        env['PYTHONPATH'] = str(settings.BASE_DIR) + os.pathsep + env.get('PYTHONPATH', '')
-        
-        process = subprocess.Popen(
-            [script_path, str(document_upload_id)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            env=env,
-            cwd=settings.BASE_DIR
-        )
-        
-        # Lire la sortie avec progression
-        output_lines = []
-        for line in iter(process.stdout.readline, ''):
-            line = line.strip()
-            if line:
-                logger.info(f"[SCRIPT] {line}")
-                output_lines.append(line)
-                
-                # Mettre à jour la progression selon la sortie
-                if "Extraction terminée" in line:
-                    self.update_state(
-                        state='PROGRESS',
-                        meta={'current': 70, 'total': 100, 'status': 'Indexation...'}
-                    )
-                elif "Vectorisation réussie" in line:
-                    self.update_state(
-                        state='PROGRESS',
-                        meta={'current': 90, 'total': 100, 'status': 'Finalisation...'}
-                    )
-        
-        process.stdout.close()
-        return_code = process.wait()
+        # Mettre à jour la progression selon la sortie
+        def on_line(line):
+            if "Extraction terminée" in line:
+                _report_progress(self, doc_upload, 70, 'Indexation...')
+            elif "Vectorisation réussie" in line:
+                _report_progress(self, doc_upload, 90, 'Finalisation...')
+
+        return_code, output_lines = _run_vectorize_script(script_path, [document_upload_id], on_line)
+        tracing.set_attribute('return_code', return_code)
         
         # 7. Traiter le résultat
         if return_code == 0:
@@ -127,19 +139,15 @@ def process_document_async(self, document_upload_id):
             doc_upload.processed_at = timezone.now()
             doc_upload.save()
             
-            self.update_state(
-                state='SUCCESS',
-                meta={'current': 100, 'total': 100, 'status': 'Terminé avec succès!'}
-            )
+            _report_progress(self, doc_upload, 100, 'Terminé avec succès!', state='SUCCESS')
             
-            # Notification WhatsApp
+            # Notification WhatsApp (queue realtime : le worker CPU n'attend pas Twilio)
             try:
-                from messaging.services import WhatsAppService
-                whatsapp = WhatsAppService()
+                from messaging.tasks import send_whatsapp_message
                 patient = doc_upload.patient
                 
                 message = f"✅ {patient.first_name}, votre document '{doc_upload.original_filename}' a été indexé avec succès."
-                whatsapp.send_message(patient.phone, message)
+                send_whatsapp_message.delay(patient.phone, message)
             except Exception as e:
                 logger.warning(f"Notification WhatsApp échouée: {e}")
             
@@ -151,8 +159,10 @@ def process_document_async(self, document_upload_id):
         else:
             logger.error(f"❌ Échec du traitement (code {return_code})")
             doc_upload.upload_status = 'failed'
+            doc_upload.task_status = 'FAILURE'
             doc_upload.error_message = f"Échec de la vectorisation (code {return_code})"
             doc_upload.save()
+            publish_progress(doc_upload)
             
             return {
                 "status": "error",
@@ -170,12 +180,99 @@ def process_document_async(self, document_upload_id):
         try:
             doc_upload = DocumentUpload.objects.get(id=document_upload_id)
             doc_upload.upload_status = 'failed'
+            doc_upload.task_status = 'FAILURE'
             doc_upload.error_message = str(e)
             doc_upload.save()
+            publish_progress(doc_upload)
         except:
             pass
         return {"status": "error", "error": str(e)}
 
+@shared_task(bind=True, name='documents.tasks.process_document_batch')
+@tracing.traced('documents.process_document_batch')
+def process_document_batch(self, patient_id, document_ids):
+    """
+    Indexe un lot de documents d'un même patient en un seul passage du
+    script de vectorisation (modèle chargé une fois, store écrit par lot).
+    Le statut de chaque DocumentUpload est tenu à jour par le script.
+    """
+    logger.info(f"[DÉBUT] Lot de {len(document_ids)} documents pour le patient {patient_id}")
+    tracing.set_attribute('patient_id', patient_id)
+    tracing.set_attribute('documents', len(document_ids))
+
+    documents = list(DocumentUpload.objects.filter(id__in=document_ids, patient_id=patient_id))
+    runnable = []
+    for doc_upload in documents:
+        if not doc_upload.file or not os.path.exists(doc_upload.file.path):
+            doc_upload.upload_status = 'failed'
+            doc_upload.task_status = 'FAILURE'
+            doc_upload.error_message = "Fichier physique introuvable"
+            doc_upload.save(update_fields=['upload_status', 'task_status', 'error_message'])
+            publish_progress(doc_upload)
+        else:
+            runnable.append(doc_upload)
+
+    if not runnable:
+        return {"status": "error", "patient_id": patient_id, "error": "Aucun fichier à traiter"}
+
+    def report(current, status_text):
+        self.update_state(
+            state='PROGRESS',
+            meta={'current': current, 'total': 100, 'status': status_text, 'documents': len(runnable)}
+        )
+        DocumentUpload.objects.filter(id__in=[d.id for d in runnable]).update(
+            upload_status='processing', progress=current, task_status=status_text
+        )
+        for doc_upload in runnable:
+            doc_upload.upload_status, doc_upload.progress, doc_upload.task_status = 'processing', current, status_text
+            publish_progress(doc_upload)
+
+    report(15, 'Initialisation du traitement...')
+
+    script_path = os.path.join(settings.BASE_DIR, 'scripts', 'vectorize_document.sh')
+    if not os.path.exists(script_path):
+        DocumentUpload.objects.filter(id__in=[d.id for d in runnable]).update(
+            upload_status='failed', task_status='FAILURE', error_message="Script de vectorisation non trouvé"
+        )
+        return {"status": "error", "patient_id": patient_id, "error": "Script non trouvé"}
+
+    report(30, 'Vectorisation en cours...')
+    return_code, output_lines = _run_vectorize_script(script_path, [d.id for d in runnable])
+    tracing.set_attribute('return_code', return_code)
+
+    # Statuts finaux écrits par le script ; un document resté en traitement a échoué
+    indexed, failed = [], []
+    for doc_upload in DocumentUpload.objects.filter(id__in=[d.id for d in runnable]):
+        if doc_upload.upload_status == 'indexed':
+            doc_upload.progress, doc_upload.task_status = 100, 'Terminé avec succès!'
+            indexed.append(doc_upload)
+        else:
+            doc_upload.upload_status, doc_upload.task_status = 'failed', 'FAILURE'
+            if not doc_upload.error_message:
+                doc_upload.error_message = f"Échec de la vectorisation (code {return_code})"
+            failed.append(doc_upload)
+    DocumentUpload.objects.bulk_update(indexed + failed, ['upload_status', 'progress', 'task_status', 'error_message'])
+    for doc_upload in indexed + failed:
+        publish_progress(doc_upload)
+
+    if indexed:
+        try:
+            from messaging.tasks import send_whatsapp_message
+            patient = indexed[0].patient
+            message = f"✅ {patient.first_name}, {len(indexed)} document(s) ont été indexés avec succès."
+            send_whatsapp_message.delay(patient.phone, message)
+        except Exception as e:
+            logger.warning(f"Notification WhatsApp échouée: {e}")
+
+    logger.info(f"[FIN] Lot patient {patient_id}: {len(indexed)} indexés, {len(failed)} en échec")
+    return {
+        "status": "success" if not failed else "partial",
+        "patient_id": patient_id,
+        "indexed": [d.id for d in indexed],
+        "failed": [d.id for d in failed],
+        "output": '\n'.join(output_lines[-5:]) if failed else '',
+    }
+
 # Tâche pour envoyer le SMS après création du patient
 @shared_task(name='documents.tasks.send_patient_activation_sms')
 def send_patient_activation_sms(patient_id):
@@ -200,4 +297,47 @@ def send_patient_activation_sms(patient_id):
         logger.exception(f"Erreur envoi SMS: {e}")
         return {"status": "error", "error": str(e)}
 
+@shared_task(bind=True, name='documents.tasks.flush_bm25_queue', max_retries=10)
+def flush_bm25_queue(self, patient_id):
+    """Écrit en un seul commit les passages BM25 en attente pour un patient"""
+    from rag.bm25_index import flush_queue, schedule_flush
+
+    delay = settings.RAG_SETTINGS.get('BM25_FLUSH_DELAY', 5)
+    try:
+        written = flush_queue(patient_id)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            # Lot toujours en file Redis : flush reprogrammé plutôt qu'abandonné
+            logger.critical(f"Flush BM25 du patient {patient_id} en échec après {self.max_retries} essais: {e}. "
+                            f"Passages en attente dans la file, nouveau flush dans 10 min")
+            schedule_flush(patient_id, 600)
+            raise
+        # Le lot est remis en file et aucun flush n'est plus planifié : réessayer nous-mêmes
+        logger.error(f"Flush BM25 échoué pour patient {patient_id}: {e}, nouvel essai planifié")
+        raise self.retry(exc=e, countdown=min(delay * 2 ** self.request.retries, 600))
+    if written is None:
+        if self.request.retries >= self.max_retries:
+            # Le flush concurrent videra aussi ce qui reste ; sinon on reprogramme
+            logger.warning(f"Flush BM25 du patient {patient_id} toujours verrouillé, reprogrammé")
+            schedule_flush(patient_id, delay)
+            return {"status": "rescheduled", "patient_id": patient_id}
+        # Un autre worker écrit déjà cet index : réessayer plus tard
+        logger.info(f"Flush BM25 déjà en cours pour patient {patient_id}, nouvel essai planifié")
+        raise self.retry(countdown=delay)
+
+    return {"status": "success", "patient_id": patient_id, "written": written}
+
+@shared_task(name='documents.tasks.optimize_bm25_indexes')
+def optimize_bm25_indexes():
+    """Tâche périodique : fusionne les segments des index BM25 trop fragmentés"""
+    from rag.bm25_index import optimize_indexes
+
+    try:
+        stats = optimize_indexes()
+        logger.info(f"Maintenance BM25: {stats}")
+        return stats
+    except Exception as e:
+        logger.error(f"Erreur maintenance BM25: {e}")
+        return {"error": str(e)}
+
 # Les autres tâches existantes...
\ No newline at end of file
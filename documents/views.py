@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from .models import DocumentUpload
 from .serializers import DocumentUploadSerializer
+from .ingest import create_uploads, dispatch_indexing
 from patients.models import Patient
 import logging
 import os
@@ -120,65 +121,56 @@ class DocumentUploadViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def bulk_upload(self, request):
-        """Upload multiple documents pour un patient"""
-        return Response({"error": "Cette méthode est obsolète"}, status=410)
-        # logger.info("=== DÉBUT BULK UPLOAD ===")
-        # patient_id = request.data.get('patient_id')
-        # files = request.FILES.getlist('files')
-        
-        # logger.info(f"Patient ID: {patient_id}")
-        # logger.info(f"Nombre de fichiers: {len(files)}")
-        
-        # if not patient_id or not files:
-        #     return Response(
-        #         {"error": "patient_id et files requis"},
-        #         status=status.HTTP_400_BAD_REQUEST
-        #     )
-        
-        # try:
-        #     patient = Patient.objects.get(id=patient_id)
-        #     logger.info(f"Patient trouvé: {patient.full_name()}")
-        # except Patient.DoesNotExist:
-        #     return Response(
-        #         {"error": "Patient non trouvé"},
-        #         status=status.HTTP_404_NOT_FOUND
-        #     )
+        """
+        POST /documents/api/documents/bulk_upload/
+        Upload de plusieurs documents (champ `files`) pour un patient.
+        Fichiers reçus sur disque par morceaux, lignes insérées en un
+        bulk_create, indexation envoyée en un group Celery par lots.
+        """
+        patient_id = request.data.get('patient_id')
+        files = request.FILES.getlist('files')
         
-        # created_documents = []
+        if not patient_id or not files:
+            return Response(
+                {"error": "patient_id et files requis"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # for file in files:
-        #     logger.info(f"Traitement du fichier: {file.name}")
-        #     document_data = {
-        #         'file': file,
-        #         'original_filename': file.name,
-        #         'file_size': file.size,
-        #         'file_type': file.name.split('.')[-1].lower()
-        #     }
-            
-        #     document = DocumentUpload.objects.create(
-        #         patient=patient,
-        #         **document_data
-        #     )
-        #     logger.info(f"Document créé: ID={document.id}")
-            
-        #     # Lancer le traitement asynchrone
-        #     try:
-        #         from .tasks import process_document_async
-        #         result = process_document_async.delay(document.id)
-        #         document.celery_task_id = result.id
-        #         document.save(update_fields=['celery_task_id'])
-        #         logger.info(f"✅ Tâche Celery envoyée: {result.id}")
-        #     except Exception as e:
-        #         logger.error(f"❌ Erreur envoi tâche pour document {document.id}: {e}")
-        #         document.upload_status = 'failed'
-        #         document.error_message = str(e)
-        #         document.save()
-            
-        #     created_documents.append(document.id)
+        try:
+            patient = Patient.objects.get(id=patient_id)
+        except Patient.DoesNotExist:
+            return Response(
+                {"error": "Patient non trouvé"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
-        # logger.info(f"=== FIN BULK UPLOAD: {len(created_documents)} documents créés ===")
+        documents, rejected = create_uploads(patient, files)
+        task_ids = {}
+        if documents:
+            try:
+                task_ids = dispatch_indexing(documents)
+            except Exception as e:
+                logger.error(f"❌ Erreur envoi des tâches d'indexation: {e}")
+                DocumentUpload.objects.filter(id__in=[doc.id for doc in documents]).update(
+                    upload_status='failed', error_message=str(e)
+                )
+                return Response(
+                    {"error": "Indexation indisponible", "details": str(e)},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
         
-        # return Response({
-        #     "uploaded_documents": created_documents,
-        #     "message": f"{len(created_documents)} documents uploadés, traitement en cours"
-        # }, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        logger.info(f"📄 Bulk upload patient {patient.id}: {len(documents)} documents, {len(rejected)} rejetés")
+        return Response({
+            "uploaded_documents": [
+                {
+                    "document_id": doc.id,
+                    "filename": doc.original_filename,
+                    "status": doc.upload_status,
+                    "task_id": task_ids.get(doc.id),
+                }
+                for doc in documents
+            ],
+            "rejected": rejected,
+            "indexing_status_url": f"/api/patients/{patient.id}/indexing-status/",
+            "message": f"{len(documents)} documents uploadés, traitement en cours"
+        }, status=status.HTTP_201_CREATED if documents else status.HTTP_400_BAD_REQUEST)
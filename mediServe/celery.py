@@ -3,11 +3,7 @@ import logging
 from celery import Celery
 from django.conf import settings
 
-# Configuration du logging pour Celery
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Le logging est configuré par settings.LOGGING (pipeline asynchrone JSON)
 logger = logging.getLogger(__name__)
 
 # Set default Django settings module for 'celery' program
@@ -22,6 +18,9 @@ app.conf.update(
     task_always_eager=False,  # Mettre à True pour exécution synchrone pendant debug
     task_eager_propagates=True,
     
+    # Garder les handlers de settings.LOGGING au lieu de ceux de Celery
+    worker_hijack_root_logger=False,
+    
     # Logs détaillés
     worker_log_format='[%(asctime)s: %(levelname)s/%(processName)s] %(message)s',
     worker_task_log_format='[%(asctime)s: %(levelname)s/%(processName)s][%(task_name)s(%(task_id)s)] %(message)s',
@@ -45,10 +44,10 @@ app.autodiscover_tasks()
 # Afficher toutes les tâches enregistrées
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    logger.info("=== TÂCHES CELERY ENREGISTRÉES ===")
+    logger.debug("=== TÂCHES CELERY ENREGISTRÉES ===")
     for task_name in app.tasks:
         if not task_name.startswith('celery.'):
-            logger.info(f"✅ Tâche: {task_name}")
+            logger.debug(f"✅ Tâche: {task_name}")
 
 # Test de connexion au démarrage
 @app.task(bind=True)
@@ -76,6 +75,32 @@ app.conf.beat_schedule = {
         'task': 'patients.tasks.check_workflow_health',
         'schedule': 900.0,
     },
+
+    # Fusionner les segments des index BM25 fragmentés toutes les 30 minutes
+    'optimize-bm25-indexes': {
+        'task': 'documents.tasks.optimize_bm25_indexes',
+        'schedule': 1800.0,
+    },
+
+    # Écrire en base les métriques du stream Redis (backend 'redis' du tampon)
+    'drain-metrics-stream': {
+        'task': 'metrics.tasks.drain_metrics_stream',
+        'schedule': 10.0,
+        'options': {'expires': 9.0}
+    },
+
+    # Agrégats minute/heure/jour du tableau de bord des métriques
+    'rollup-metrics': {
+        'task': 'metrics.tasks.rollup_metrics',
+        'schedule': 60.0,
+        'options': {'expires': 55.0}
+    },
+
+    # Purger les mesures brutes déjà agrégées une fois par jour
+    'cleanup-old-metrics': {
+        'task': 'metrics.tasks.cleanup_old_metrics',
+        'schedule': 86400.0,
+    },
 }
 
 logger.info(f"Celery configuré avec broker: {app.conf.broker_url}")
@@ -15,6 +15,7 @@ from pathlib import Path
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 from dotenv import load_dotenv
+from kombu import Queue
 import os
 
 load_dotenv()
@@ -54,18 +55,111 @@ WHATSAPP_VERIFY_TOKEN = os.getenv('CARE_MEDICAL_VERIFY_2025')
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 PINECONE_INDEX_NAME = os.getenv('PINECONE_INDEX_NAME', 'medirecord-rag')
 
+# Diffusion des messages : taille des lots, envois simultanés par lot, débit Twilio
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 500))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+TWILIO_MESSAGES_PER_SECOND = float(os.getenv('TWILIO_MESSAGES_PER_SECOND', 10))
+
+# Tampon de métriques (metrics/buffer.py) : écriture par lots en arrière-plan
+# BACKEND 'redis' pour les déploiements multi-processus (stream vidé par metrics.tasks)
+METRICS_BUFFER = {
+    'ENABLED': os.getenv('METRICS_BUFFER_ENABLED', '1') == '1',
+    'BACKEND': os.getenv('METRICS_BUFFER_BACKEND', 'memory'),
+    'MAX_SIZE': int(os.getenv('METRICS_BUFFER_MAX_SIZE', 10000)),
+    'FLUSH_SIZE': int(os.getenv('METRICS_BUFFER_FLUSH_SIZE', 500)),
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_BUFFER_FLUSH_INTERVAL', 5)),
+    'STREAM_KEY': 'metrics:stream',
+    'STREAM_MAXLEN': 100000,
+}
+
+# Rétention (jours) des mesures brutes et des agrégats (les agrégats jour sont conservés)
+METRICS_RETENTION_DAYS = {'raw': 7, 'minute': 2, 'hour': 90}
+
+# Durée de cache (secondes) des vérifications de santé par mode
+HEALTH_CHECK_CACHE_TTL = {'ready': 10, 'deep': 60}
+
+# Documents par tâche d'indexation groupée (un lot = un seul patient)
+DOCUMENT_BATCH_SIZE = 20
+
+# Flux SSE de progression d'indexation (servi par mediServe.asgi)
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_DURATION = 600  # Le navigateur se reconnecte ensuite (EventSource)
+
+# /metrics : dossier des instantanés par processus (gunicorn, workers Celery).
+# Vide = mode mono-processus. Vider le dossier au redémarrage des services.
+# METRICS_MULTIPROC_DIR=/run/medirecord/metrics
+
+# Traçage des requêtes RAG et de l'indexation (core/tracing.py, lu dans l'environnement)
+# TRACING_EXPORTER = none | jsonl | otlp, TRACING_SAMPLE_RATE (0.1 par défaut),
+# TRACING_OTLP_ENDPOINT (ex. http://localhost:4318)
+os.environ.setdefault('TRACING_JSONL_PATH', os.path.join(BASE_DIR, 'logs', 'traces.jsonl'))
+
+# Transport HTTP Twilio partagé (messaging/transport.py)
+# TWILIO_FAKE_SERVER=1 envoie vers le faux serveur local (scripts/fake_twilio_server.py)
+TWILIO_FAKE_SERVER = os.getenv('TWILIO_FAKE_SERVER', '0') == '1'
+TWILIO_API_BASE_URL = os.getenv(
+    'TWILIO_API_BASE_URL',
+    'http://127.0.0.1:8765' if TWILIO_FAKE_SERVER else 'https://api.twilio.com'
+)
+TWILIO_HTTP_POOL_SIZE = int(os.getenv('TWILIO_HTTP_POOL_SIZE', 32))
+TWILIO_HTTP_MAX_RETRIES = int(os.getenv('TWILIO_HTTP_MAX_RETRIES', 3))
+TWILIO_HTTP_BACKOFF = float(os.getenv('TWILIO_HTTP_BACKOFF', 0.5))
+TWILIO_HTTP_TIMEOUT = float(os.getenv('TWILIO_HTTP_TIMEOUT', 15))
+# Débit par numéro expéditeur, ex. {'whatsapp:+14155238886': 80}
+TWILIO_SENDER_MPS = {}
+
 # Configuration upload fichiers
-FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
+# Fichiers uploadés écrits sur disque par morceaux (jamais gardés entiers en mémoire) ;
+# la taille maximale d'un document est RAG_SETTINGS['MAX_FILE_SIZE']
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB (défaut Django)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Topologie des queues : voir mediServe/worker_profiles.py pour les workers associés
+CELERY_TASK_QUEUES = (
+    Queue('default'),
+    Queue('cpu'),          # OCR, embeddings, écriture des index (prefork)
+    Queue('io'),           # Twilio, n8n, SMS (threads/gevent)
+    Queue('realtime'),     # Réponses patients en direct
+    Queue('maintenance'),  # Nettoyage et tâches périodiques
+)
+
+# Toutes les tâches sont routées explicitement
 CELERY_TASK_ROUTES = {
-    # Tâches de haute priorité sur une queue spéciale
-    'documents.tasks.process_document_async': {'queue': 'high_priority'},
-    'messaging.tasks.send_broadcast_message_async': {'queue': 'messaging'},
-    
-    # Tâches de maintenance sur une queue séparée
-    'metrics.tasks.cleanup_old_metrics': {'queue': 'maintenance'},
+    # documents
+    'documents.tasks.process_document_async': {'queue': 'cpu'},
+    'documents.tasks.process_document_batch': {'queue': 'cpu'},
+    'documents.tasks.flush_bm25_queue': {'queue': 'cpu'},
+    'documents.tasks.send_patient_activation_sms': {'queue': 'io'},
+    'documents.tasks.optimize_bm25_indexes': {'queue': 'maintenance'},
+
+    # rag
+    'rag.tasks.index_document_task': {'queue': 'cpu'},
+    'rag.tasks.reindex_patient_task': {'queue': 'cpu'},
+
+    # messaging
+    'messaging.tasks.send_whatsapp_message': {'queue': 'realtime'},
+    'messaging.tasks.send_broadcast_message_async': {'queue': 'io'},
+    'messaging.tasks.send_broadcast_chunk': {'queue': 'io'},
+    'messaging.tasks.finalize_broadcast': {'queue': 'io'},
+    'messaging.tasks.process_scheduled_messages': {'queue': 'default'},
+    'messaging.tasks.analyze_message_engagement': {'queue': 'maintenance'},
+    'messaging.tasks.generate_content_suggestions': {'queue': 'maintenance'},
+
+    # patients
+    'patients.tasks.check_workflow_health': {'queue': 'io'},
+    'patients.tasks.send_activation_reminder': {'queue': 'io'},
+
+    # sessions
     'sessions.tasks.cleanup_expired_sessions': {'queue': 'maintenance'},
+    'sessions.tasks.archive_old_conversations': {'queue': 'maintenance'},
+    'sessions.tasks.compact_conversation_memory': {'queue': 'cpu'},  # Importe rag.runtime (torch)
+
+    # metrics
+    'metrics.tasks.cleanup_old_metrics': {'queue': 'maintenance'},
+    'metrics.tasks.collect_system_metrics': {'queue': 'maintenance'},
+    'metrics.tasks.drain_metrics_stream': {'queue': 'maintenance'},
+    'metrics.tasks.rollup_metrics': {'queue': 'maintenance'},
 }
 
 CELERY_TASK_ANNOTATIONS = {
@@ -78,10 +172,13 @@ CELERY_TASK_ANNOTATIONS = {
 CELERY_TASK_DEFAULT_RETRY_DELAY = 60  # 1 minute
 CELERY_TASK_MAX_RETRIES = 3
 
-# Configuration des queues
-CELERY_TASK_CREATE_MISSING_QUEUES = True
+# Configuration des queues : pas de création à la volée, une tâche non routée va sur 'default'
+CELERY_TASK_CREATE_MISSING_QUEUES = False
 CELERY_TASK_DEFAULT_QUEUE = 'default'
 
+# Valeurs par défaut des workers (surchargées par profil)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
 # Monitoring Celery
 CELERY_SEND_TASK_EVENTS = True
 CELERY_TASK_SEND_SENT_EVENT = True
@@ -91,6 +188,17 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
+# Logging : écriture disque hors du thread appelant (QueueHandler/QueueListener),
+# lignes JSON, échantillonnage et limitation de débit des DEBUG/INFO bavards
+LOG_LEVEL = os.getenv('DJANGO_LOG_LEVEL', 'INFO')
+# Journaliser les en-têtes / corps des webhooks (données patients) : debug uniquement
+LOG_WEBHOOK_PAYLOADS = os.getenv('LOG_WEBHOOK_PAYLOADS', '0') == '1'
+# Fraction des DEBUG/INFO conservée par préfixe de logger
+LOG_SAMPLING_RATES = {
+    'messaging.whatsapp_rag_webhook': float(os.getenv('LOG_SAMPLING_WEBHOOK', 1.0)),
+    'celery': float(os.getenv('LOG_SAMPLING_CELERY', 1.0)),
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -101,28 +209,59 @@ LOGGING = {
     'simple': {
         'format': '%(levelname)s %(message)s'
     },
+    'json': {
+        '()': 'core.logging_config.JsonFormatter',
+    },
+    },
+    'filters': {
+    'trace_context': {
+        '()': 'core.logging_config.TraceContextFilter',
+    },
+    'sampling': {
+        '()': 'core.logging_config.SamplingFilter',
+        'rates': LOG_SAMPLING_RATES,
+    },
+    # Un limiteur par handler : une instance partagée compterait chaque record plusieurs fois
+    'rate_limit_console': {
+        '()': 'core.logging_config.RateLimitFilter',
+        'max_per_interval': 100,  # Par ligne d'appel et par minute
+        'interval': 60,
+    },
+    'rate_limit_file': {
+        '()': 'core.logging_config.RateLimitFilter',
+        'max_per_interval': 100,
+        'interval': 60,
+    },
+    'rate_limit_celery': {
+        '()': 'core.logging_config.RateLimitFilter',
+        'max_per_interval': 100,
+        'interval': 60,
+    },
     },
     'handlers': {
     'console': {
         'level': 'INFO',
-        'class': 'logging.StreamHandler',
+        'class': 'core.logging_config.AsyncStreamHandler',
         'formatter': 'verbose',
+        'filters': ['sampling', 'rate_limit_console'],
     },
     'file': {
-        'level': 'DEBUG',  # Abaissé à DEBUG pour tout capturer
-        'class': 'logging.handlers.RotatingFileHandler',
+        'level': 'DEBUG',
+        'class': 'core.logging_config.AsyncRotatingFileHandler',
         'filename': os.path.join(BASE_DIR, 'logs', 'django.log'),
-        'maxBytes': 1010241024,
+        'maxBytes': 100 * 1024 * 1024,
         'backupCount': 5,
-        'formatter': 'verbose',
+        'formatter': 'json',
+        'filters': ['trace_context', 'sampling', 'rate_limit_file'],
     },
     'celery': {
-        'level': 'DEBUG',  # Abaissé à DEBUG pour tout capturer
-        'class': 'logging.handlers.RotatingFileHandler',
+        'level': 'DEBUG',
+        'class': 'core.logging_config.AsyncRotatingFileHandler',
         'filename': os.path.join(BASE_DIR, 'logs', 'celery.log'),
-        'maxBytes': 1010241024,
+        'maxBytes': 100 * 1024 * 1024,
         'backupCount': 5,
-        'formatter': 'verbose',
+        'formatter': 'json',
+        'filters': ['trace_context', 'sampling', 'rate_limit_celery'],
     },
     },
     'loggers': {
@@ -133,27 +272,42 @@ LOGGING = {
         },
     'celery': {
     'handlers': ['console', 'celery'],
-    'level': 'DEBUG',  # Abaissé à DEBUG
+    'level': LOG_LEVEL,
     'propagate': False,
     },
+    'medirecord': {
+        'handlers': ['console', 'file'],
+        'level': LOG_LEVEL,
+        'propagate': False,
+    },
+    'core': {
+        'handlers': ['console', 'file'],
+        'level': LOG_LEVEL,
+        'propagate': False,
+    },
+    'metrics': {
+        'handlers': ['console', 'file'],
+        'level': LOG_LEVEL,
+        'propagate': False,
+    },
     'documents': {  # Logger spécifique pour l'app documents
         'handlers': ['console', 'file', 'celery'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'propagate': False,
     },
     'patients': {  # Logger spécifique pour l'app patients
         'handlers': ['console', 'file'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'propagate': False,
     },
     'rag': {  # Logger spécifique pour l'app rag
         'handlers': ['console', 'file', 'celery'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'propagate': False,
     },
     'messaging': {  # Logger spécifique pour l'app messaging
         'handlers': ['console', 'file'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'propagate': False,
     },
     },
@@ -183,11 +337,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'rest_framework.authtoken',
     'drf_yasg',
     'django_celery_results',
+    'core',
     # 'users',
     'patients',
     'documents',
@@ -355,12 +511,25 @@ RAG_SETTINGS = {
 
     # Paramètres d'indexation
     'USE_BM25': True,  # Activer l'indexation BM25
+    'BM25_FLUSH_DELAY': 5,  # Secondes d'attente pour grouper les mises à jour BM25 d'un patient
+    'BM25_WRITER_TIMEOUT': 30,  # Attente maximale du verrou d'écriture Whoosh (secondes)
+    'BM25_MAX_SEGMENTS': 8,  # Au-delà, la tâche de maintenance fusionne les segments
     'USE_SEMANTIC_CHUNKING': True,  # Utiliser le chunking sémantique
     'SEMANTIC_THRESHOLD': 0.75,  # Seuil de similarité pour le chunking
 
+    # Nombre de stores patients gardés en mémoire par processus (rechargés à chaque nouvelle génération)
+    'STORE_CACHE_SIZE': 64,
+    # Threads du pool de calcul (embedding / FAISS / BM25) de l'endpoint RAG asynchrone
+    'CPU_THREADS': int(os.getenv('RAG_CPU_THREADS', 4)),
+
     # Paramètres de recherche
     'USE_RERANKING': True,  # Activer le reranking
     'RERANKER_MODEL': 'cross-encoder/ms-marco-MiniLM-L-6-v2',
+    # Routage d'intention : similarité minimale aux prototypes pour répondre sans RAG
+    'USE_INTENT_ROUTING': True,
+    'INTENT_THRESHOLD': 0.72,
+    # Budget (tokens estimés) des extraits placés dans le prompt Gemini
+    'MAX_CONTEXT_TOKENS': int(os.getenv('RAG_MAX_CONTEXT_TOKENS', 1500)),
 
     # Limite de taille des documents
     'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50MB
@@ -369,9 +538,19 @@ RAG_SETTINGS = {
     'EMBEDDING_MODEL': 'all-mpnet-base-v2',
     'LLM_MODEL': 'gemini-1.5-flash-latest',
 
-    # Configuration de chunking lexical
-    'CHUNK_SIZE': 1000,  # Taille des chunks lexicaux
-    'CHUNK_OVERLAP': 200,  # Chevauchement entre chunks
+    # Découpage des pages en chunks, en tokens du tokenizer de l'embedder
+    # (borné par la longueur d'entrée du modèle : 384 pour all-mpnet-base-v2)
+    'CHUNK_SIZE': int(os.getenv('RAG_CHUNK_SIZE', 320)),  # Taille maximale d'un chunk
+    'CHUNK_OVERLAP': int(os.getenv('RAG_CHUNK_OVERLAP', 48)),  # Recouvrement entre chunks consécutifs
+}
+
+# Mémoire de conversation WhatsApp (sessions/memory.py)
+CONVERSATION_MEMORY = {
+    'MAX_TURNS': int(os.getenv('CONVERSATION_MAX_TURNS', 4)),  # Derniers échanges gardés tels quels
+    'SUMMARY_MAX_TOKENS': 200,  # Taille maximale du résumé des échanges plus anciens
+    'TURN_MAX_CHARS': 400,  # Troncature de chaque question / réponse mémorisée
+    'TTL': 24 * 3600,  # Même durée que l'expiration des sessions
+    'REWRITE_FOLLOW_UPS': True,  # Reformuler les questions de suivi avant la recherche
 }
 
 os.makedirs(RAG_SETTINGS['VECTOR_STORE_DIR'], exist_ok=True)
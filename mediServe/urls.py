@@ -21,12 +21,13 @@ from rest_framework.routers import DefaultRouter
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
-from core.views import HealthCheckView
+from core.views import HealthCheckView, LivenessView
 from django.conf import settings
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rag.views import RAGQueryView
+from rag.views import RAGQueryView, rag_query_async
 from patients.views import PatientConfirmAPIView, ActivateRedirectView
 from messaging.whatsapp_rag_webhook import whatsapp_rag_webhook
+from metrics.views import PrometheusMetricsView
 
 router = DefaultRouter()
 
@@ -46,6 +47,8 @@ urlpatterns = [
     path("documents/", include("documents.urls")),
     path('api/', include(router.urls)),
     path('api/health/', HealthCheckView.as_view(), name='health-check'),
+    path('api/health/ready/', HealthCheckView.as_view(), name='health-ready'),
+    path('api/health/live/', LivenessView.as_view(), name='health-live'),
     
     # Authentication
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -53,6 +56,7 @@ urlpatterns = [
     
     # RAG endpoint
     path('api/rag/query/', RAGQueryView.as_view(), name='rag-query'),
+    path('api/rag/query/async/', rag_query_async, name='rag-query-async'),
     
     # Patient activation
     path('api/patients/confirm/', PatientConfirmAPIView.as_view(), name='patient-confirm'),
@@ -63,6 +67,9 @@ urlpatterns = [
     
     # Autres endpoints messaging (sans conflit)
     path('api/messaging/', include('messaging.urls')),
+
+    # Métriques : exposition Prometheus
+    path('metrics', PrometheusMetricsView.as_view(), name='prometheus-metrics'),
     
     # Swagger
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
@@ -0,0 +1,74 @@
+# mediServe/worker_profiles.py
+"""
+Profils de workers Celery.
+
+Chaque profil consomme ses propres queues avec un pool adapté à sa charge :
+- cpu : OCR, embeddings, index (prefork, un process par cœur, recyclage mémoire)
+- io : Twilio, n8n, SMS (threads ou gevent, forte concurrence)
+- realtime : réponses patients en direct (threads, prefetch 1, jamais bloqué par un lot)
+- maintenance : tâches périodiques de nettoyage (un seul process)
+
+Lancement : python manage.py celery_worker --profile cpu
+"""
+import os
+
+
+def _io_pool() -> str:
+    try:
+        import gevent  # noqa: F401
+        return 'gevent'
+    except ImportError:
+        return 'threads'
+
+
+CPU_COUNT = os.cpu_count() or 2
+
+WORKER_PROFILES = {
+    'cpu': {
+        'queues': ['cpu'],
+        'pool': 'prefork',
+        'concurrency': int(os.getenv('CELERY_CPU_CONCURRENCY', CPU_COUNT)),
+        'prefetch_multiplier': 1,
+        # Recycler les process pour libérer la mémoire des modèles (SentenceTransformer, OCR)
+        'max_tasks_per_child': int(os.getenv('CELERY_CPU_MAX_TASKS_PER_CHILD', 20)),
+        'max_memory_per_child': int(os.getenv('CELERY_CPU_MAX_MEMORY_KB', 3 * 1024 * 1024)),
+    },
+    'io': {
+        'queues': ['io', 'default'],
+        'pool': _io_pool(),
+        'concurrency': int(os.getenv('CELERY_IO_CONCURRENCY', 64)),
+        'prefetch_multiplier': 4,
+    },
+    'realtime': {
+        'queues': ['realtime'],
+        'pool': 'threads',
+        'concurrency': int(os.getenv('CELERY_REALTIME_CONCURRENCY', 16)),
+        'prefetch_multiplier': 1,
+    },
+    'maintenance': {
+        'queues': ['maintenance'],
+        'pool': 'prefork',
+        'concurrency': 1,
+        'prefetch_multiplier': 1,
+        'max_tasks_per_child': 10,
+    },
+}
+
+
+def worker_argv(profile_name: str, loglevel: str = 'info') -> list:
+    """Construit la ligne de commande `celery worker` d'un profil"""
+    profile = WORKER_PROFILES[profile_name]
+    argv = [
+        'worker',
+        f'--loglevel={loglevel}',
+        f"--queues={','.join(profile['queues'])}",
+        f"--pool={profile['pool']}",
+        f"--concurrency={profile['concurrency']}",
+        f"--prefetch-multiplier={profile['prefetch_multiplier']}",
+        f'--hostname={profile_name}@%h',
+    ]
+    if profile.get('max_tasks_per_child'):
+        argv.append(f"--max-tasks-per-child={profile['max_tasks_per_child']}")
+    if profile.get('max_memory_per_child'):
+        argv.append(f"--max-memory-per-child={profile['max_memory_per_child']}")
+    return argv
@@ -1,18 +1,16 @@
-import requests
 from django.conf import settings
 import logging
-from twilio.rest import Client
+from .transport import get_transport
+from metrics.services import measure_stage
 
 logger = logging.getLogger(__name__)
 
 class SMSService:
     """Service pour envoyer des SMS via Twilio"""
     
-    def __init__(self):
-        self.client = Client(
-            settings.TWILIO_ACCOUNT_SID,
-            settings.TWILIO_AUTH_TOKEN
-        )
+    def __init__(self, transport=None):
+        # Transport HTTP partagé du processus (pool keep-alive, retry, débit)
+        self.transport = transport or get_transport()
         # Utiliser le numéro SMS, pas le numéro WhatsApp !
         self.from_number = settings.TWILIO_SMS_NUMBER
     
@@ -27,14 +25,13 @@ class SMSService:
 {settings.HEALTH_STRUCTURE_NAME}"""
             
             # Envoyer le SMS
-            sms = self.client.messages.create(
-                body=message,
-                from_=self.from_number,  # Numéro SMS
-                to=patient.phone
-            )
+            success, result = self.transport.send_message(self.from_number, patient.phone, message)
+            if not success:
+                logger.error(f"Échec envoi SMS à {patient.phone}: {result}")
+                return False, result
             
-            logger.info(f"SMS envoyé à {patient.phone}: {sms.sid}")
-            return True, sms.sid
+            logger.info(f"SMS envoyé à {patient.phone}: {result}")
+            return True, result
             
         except Exception as e:
             logger.error(f"Erreur envoi SMS à {patient.phone}: {e}")
@@ -55,13 +52,12 @@ Si vous n'avez pas encore activé votre compte, utilisez le lien d'activation en
 Cordialement,
 {settings.HEALTH_STRUCTURE_NAME}"""
             
-            sms = self.client.messages.create(
-                body=message,
-                from_=self.from_number,  # Numéro SMS
-                to=patient.phone
-            )
+            success, result = self.transport.send_message(self.from_number, patient.phone, message)
+            if not success:
+                logger.error(f"Échec SMS de confirmation à {patient.phone}: {result}")
+                return False
             
-            logger.info(f"SMS de confirmation envoyé à {patient.phone}: {sms.sid}")
+            logger.info(f"SMS de confirmation envoyé à {patient.phone}: {result}")
             return True
             
         except Exception as e:
@@ -70,40 +66,45 @@ Cordialement,
 
 class WhatsAppService:
     """Service pour envoyer des messages WhatsApp via Twilio"""
-    def __init__(self):
+    def __init__(self, transport=None):
         self.account_sid = settings.TWILIO_ACCOUNT_SID
         self.auth_token = settings.TWILIO_AUTH_TOKEN
         # Utiliser le numéro WhatsApp Sandbox
         self.whatsapp_number = settings.TWILIO_WHATSAPP_NUMBER
+        # Transport HTTP partagé du processus (pool keep-alive, retry, débit par expéditeur)
+        self.transport = transport or get_transport()
         
     def send_message(self, to_number: str, message: str) -> bool:
         """Envoyer un message WhatsApp"""
-        url = f"https://api.twilio.com/2010-04-01/Accounts/{self.account_sid}/Messages.json"
-        
         # S'assurer que le numéro est au format E.164
         if not to_number.startswith('+'):
             to_number = f"+{to_number}"
         
-        data = {
-            'From': f'whatsapp:{self.whatsapp_number}',
-            'To': f'whatsapp:{to_number}',
-            'Body': message
-        }
-        
         try:
-            response = requests.post(
-                url,
-                data=data,
-                auth=(self.account_sid, self.auth_token)
-            )
+            with measure_stage('twilio_send'):
+                success, result = self.transport.send_message(
+                    f'whatsapp:{self.whatsapp_number}',
+                    f'whatsapp:{to_number}',
+                    message
+                )
             
-            if response.status_code == 201:
+            if success:
                 logger.info(f"Message WhatsApp envoyé à {to_number}")
                 return True
             else:
-                logger.error(f"Échec envoi WhatsApp à {to_number}: {response.text}")
+                logger.error(f"Échec envoi WhatsApp à {to_number}: {result}")
                 return False
                 
         except Exception as e:
             logger.error(f"Erreur envoi WhatsApp à {to_number}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+_whatsapp_service = None
+
+def get_whatsapp_service() -> WhatsAppService:
+    """Instance partagée du service WhatsApp (le transport est déjà partagé)"""
+    global _whatsapp_service
+    if _whatsapp_service is None:
+        _whatsapp_service = WhatsAppService()
+    return _whatsapp_service
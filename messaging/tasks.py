@@ -1,8 +1,10 @@
-from celery import shared_task
+from celery import shared_task, chord
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.utils import timezone
 from .models import BroadcastMessage, MessageDelivery
 from patients.models import Patient
-from .services import WhatsAppService
+from .services import get_whatsapp_service
 import logging
 from datetime import datetime, timedelta
 from metrics.models import SystemMetric, PerformanceAlert
@@ -10,60 +12,65 @@ from metrics.models import SystemMetric, PerformanceAlert
 
 logger = logging.getLogger(__name__)
 
+@shared_task(bind=True, max_retries=3)
+def send_whatsapp_message(self, to_number, message):
+    """Envoie un message WhatsApp individuel (queue realtime, hors workers CPU)"""
+    success = get_whatsapp_service().send_message(to_number, message)
+    if not success:
+        raise self.retry(countdown=10)
+    return {"status": "sent", "to": to_number}
+
 @shared_task
 def send_broadcast_message_async(broadcast_id):
-    """Envoyer un message diffusé à tous les patients ciblés"""
+    """
+    Envoyer un message diffusé à tous les patients ciblés.
+
+    Les livraisons sont créées en masse, puis les patients sont découpés en
+    lots envoyés par des sous-tâches en parallèle (chord) ; la dernière
+    étape consolide le statut du broadcast.
+    """
     try:
         broadcast = BroadcastMessage.objects.get(id=broadcast_id)
-        whatsapp_service = WhatsAppService()
-        
-        # Récupérer les patients ciblés
-        patients = get_targeted_patients(broadcast)
-        
-        # Créer les entrées de livraison
-        deliveries = []
-        for patient in patients:
-            delivery, created = MessageDelivery.objects.get_or_create(
-                broadcast_message=broadcast,
-                patient=patient,
-                defaults={'status': 'pending'}
-            )
-            deliveries.append(delivery)
-        
-        # Envoyer les messages
-        sent_count = 0
-        failed_count = 0
-        
-        for delivery in deliveries:
-            try:
-                success = whatsapp_service.send_message(
-                    delivery.patient.phone,
-                    broadcast.content
-                )
-                
-                if success:
-                    delivery.status = 'sent'
-                    delivery.sent_at = timezone.now()
-                    sent_count += 1
-                else:
-                    delivery.status = 'failed'
-                    delivery.error_message = "Échec envoi WhatsApp"
-                    failed_count += 1
-                    
-            except Exception as e:
-                delivery.status = 'failed'
-                delivery.error_message = str(e)
-                failed_count += 1
-                logger.error(f"Erreur envoi à {delivery.patient.phone}: {e}")
+        chunk_size = getattr(settings, 'BROADCAST_CHUNK_SIZE', 500)
+        
+        # 1. Parcourir les patients ciblés en streaming, créer les livraisons
+        #    par paquets et préparer les lots d'envoi (id, téléphone)
+        patients = get_targeted_patients(broadcast).only('id', 'phone').order_by('id')
+        
+        chunks = []
+        current_chunk = []
+        pending_deliveries = []
+        for patient in patients.iterator(chunk_size=2000):
+            pending_deliveries.append(MessageDelivery(
+                broadcast_message_id=broadcast.id,
+                patient_id=patient.id,
+                status='pending'
+            ))
+            current_chunk.append([patient.id, patient.phone])
             
-            delivery.save()
+            if len(pending_deliveries) >= 2000:
+                MessageDelivery.objects.bulk_create(pending_deliveries, ignore_conflicts=True)
+                pending_deliveries = []
+            if len(current_chunk) >= chunk_size:
+                chunks.append(current_chunk)
+                current_chunk = []
+        
+        if pending_deliveries:
+            MessageDelivery.objects.bulk_create(pending_deliveries, ignore_conflicts=True)
+        if current_chunk:
+            chunks.append(current_chunk)
         
-        # Mettre à jour le statut du broadcast
-        broadcast.status = 'sent'
-        broadcast.sent_at = timezone.now()
-        broadcast.save()
+        logger.info(f"Broadcast {broadcast_id}: {sum(len(c) for c in chunks)} patients en {len(chunks)} lots")
         
-        logger.info(f"Broadcast {broadcast_id} terminé: {sent_count} succès, {failed_count} échecs")
+        if not chunks:
+            return finalize_broadcast([], broadcast_id)
+        
+        # 2. Envoi parallèle des lots, consolidation à la fin
+        chord(
+            send_broadcast_chunk.s(broadcast_id, chunk) for chunk in chunks
+        )(finalize_broadcast.s(broadcast_id))
+        
+        return {"broadcast_id": broadcast_id, "chunks": len(chunks)}
         
     except Exception as e:
         logger.error(f"Erreur broadcast {broadcast_id}: {e}")
@@ -74,6 +81,69 @@ def send_broadcast_message_async(broadcast_id):
         except:
             pass
 
+@shared_task
+def send_broadcast_chunk(broadcast_id, recipients):
+    """
+    Envoie un lot du broadcast en parallèle (session HTTP partagée, débit
+    Twilio limité) et enregistre les statuts en un bulk_update.
+    recipients: liste de [patient_id, téléphone]
+    """
+    broadcast = BroadcastMessage.objects.only('id', 'content').get(id=broadcast_id)
+    phones = {patient_id: phone for patient_id, phone in recipients}
+    
+    # Seules les livraisons encore en attente sont envoyées (relance sans doublon)
+    deliveries = list(
+        MessageDelivery.objects.filter(
+            broadcast_message_id=broadcast_id,
+            patient_id__in=phones.keys(),
+            status='pending'
+        ).only('id', 'patient_id', 'status', 'sent_at', 'error_message')
+    )
+    
+    # Transport partagé : pool keep-alive du processus ; le débit Twilio par numéro
+    # est un budget unique dans Redis, commun à tous les lots sur tous les workers
+    concurrency = getattr(settings, 'BROADCAST_CONCURRENCY', 8)
+    whatsapp_service = get_whatsapp_service()
+    
+    def send(delivery):
+        try:
+            success = whatsapp_service.send_message(phones[delivery.patient_id], broadcast.content)
+            if success:
+                delivery.status = 'sent'
+                delivery.sent_at = timezone.now()
+            else:
+                delivery.status = 'failed'
+                delivery.error_message = "Échec envoi WhatsApp"
+        except Exception as e:
+            delivery.status = 'failed'
+            delivery.error_message = str(e)
+            logger.error(f"Erreur envoi à {phones[delivery.patient_id]}: {e}")
+        return delivery
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        deliveries = list(executor.map(send, deliveries))
+    
+    MessageDelivery.objects.bulk_update(
+        deliveries, ['status', 'sent_at', 'error_message'], batch_size=500
+    )
+    
+    sent_count = sum(1 for d in deliveries if d.status == 'sent')
+    return {"sent": sent_count, "failed": len(deliveries) - sent_count}
+
+@shared_task
+def finalize_broadcast(results, broadcast_id):
+    """Consolide les résultats des lots et met à jour le statut du broadcast"""
+    sent_count = sum(r.get('sent', 0) for r in results if r)
+    failed_count = sum(r.get('failed', 0) for r in results if r)
+    
+    BroadcastMessage.objects.filter(id=broadcast_id).update(
+        status='failed' if failed_count and not sent_count else 'sent',
+        sent_at=timezone.now()
+    )
+    
+    logger.info(f"Broadcast {broadcast_id} terminé: {sent_count} succès, {failed_count} échecs")
+    return {"broadcast_id": broadcast_id, "sent": sent_count, "failed": failed_count}
+
 def get_targeted_patients(broadcast):
     """Récupérer les patients ciblés selon les filtres"""
     queryset = Patient.objects.filter(is_active=True)
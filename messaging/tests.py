@@ -1,3 +1,95 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+import redis
+from django.test import SimpleTestCase
+
+from . import transport
+
+
+class FakeClock:
+    """Horloge de test : sleep() avance monotonic() sans attendre"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(transport, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_paced(self):
+        limiter = transport.RateLimiter(rate=2, burst=3)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+
+    def test_tokens_refill_with_time(self):
+        limiter = transport.RateLimiter(rate=1)
+        limiter.acquire()
+        self.clock.now += 1.0
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+
+class SharedRateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(transport, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waits_as_told_by_redis(self):
+        script = mock.Mock(side_effect=['0.25', '0'])
+        client = mock.Mock()
+        client.register_script.return_value = script
+        limiter = transport.SharedRateLimiter('twilio:rate:+33600000000', rate=4)
+
+        with mock.patch.object(transport, 'get_redis', return_value=client):
+            limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [0.25])
+        script.assert_called_with(keys=['twilio:rate:+33600000000'], args=[4.0, 4.0])
+        client.register_script.assert_called_once()
+
+    def test_falls_back_to_local_bucket(self):
+        limiter = transport.SharedRateLimiter('twilio:rate:+33600000000', rate=1)
+
+        with mock.patch.object(transport, 'get_redis', side_effect=redis.ConnectionError("down")):
+            limiter.acquire()
+            limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [1.0])
+
+
+class SendRetryTests(SimpleTestCase):
+    def setUp(self):
+        adapter = transport.build_session(max_retries=3).get_adapter('https://api.twilio.com')
+        self.retry = adapter.max_retries
+
+    def test_post_retried_only_on_429(self):
+        self.assertIsInstance(self.retry, transport.SendRetry)
+        self.assertTrue(self.retry.is_retry('POST', 429))
+        for status in (500, 502, 503, 504):
+            self.assertFalse(self.retry.is_retry('POST', status))
+
+    def test_get_retried_on_5xx(self):
+        self.assertTrue(self.retry.is_retry('GET', 503))
+        self.assertFalse(self.retry.is_retry('GET', 404))
+
+    def test_lost_response_not_replayed(self):
+        self.assertEqual(self.retry.read, 0)
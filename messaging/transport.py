@@ -0,0 +1,208 @@
+# messaging/transport.py
+"""
+Transport HTTP partagé pour l'API Twilio.
+
+Un seul `requests.Session` par processus : pool de connexions keep-alive,
+retry avec backoff exponentiel (en respectant Retry-After) : 429/5xx pour
+les lectures, 429 et erreurs de connexion seulement pour les envois, et
+limiteur de débit par numéro expéditeur, calé sur le débit Twilio. Le
+limiteur est un seau à jetons dans Redis (script Lua) : tous les processus
+web et workers Celery, sur tous les hôtes, partagent le même budget par
+numéro. Si Redis ne répond pas, un seau local au processus prend le relais.
+
+Pour les tests de charge, TWILIO_API_BASE_URL peut pointer vers le faux
+serveur local (scripts/fake_twilio_server.py).
+"""
+import os
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from core.redis_client import get_redis
+from metrics.registry import TWILIO_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_KEY = "twilio:rate:{sender}"
+
+# Seau à jetons atomique, horloge du serveur Redis (commune à tous les hôtes).
+# Retourne l'attente en secondes avant le prochain jeton (0 : jeton pris).
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    """Seau à jetons thread-safe : au plus `rate` appels par seconde (rafale `burst`)"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter:
+    """Seau à jetons partagé par tous les processus (Redis), même interface que RateLimiter"""
+
+    def __init__(self, key: str, rate: float, burst: int = None):
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self._script = None
+        self._fallback = RateLimiter(rate, burst)
+
+    def acquire(self):
+        while True:
+            try:
+                if self._script is None:
+                    self._script = get_redis().register_script(_TOKEN_BUCKET_LUA)
+                wait = float(self._script(keys=[self.key], args=[self.rate, self.capacity]))
+            except redis.RedisError as e:
+                logger.warning(f"Limiteur Twilio partagé indisponible ({self.key}), limiteur local: {e}")
+                self._fallback.acquire()
+                return
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class SendRetry(Retry):
+    """
+    Un POST n'est rejoué que sur 429 (message refusé) : un 5xx peut arriver
+    après l'acceptation du message par Twilio, le rejouer l'enverrait deux fois.
+    Les erreurs de connexion (requête jamais partie) restent rejouées.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == 'POST' and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_session(pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
+    """
+    Session keep-alive dont le pool accepte `pool_size` connexions simultanées.
+    Rejeux avec backoff exponentiel (0.5s, 1s, 2s...) : 429/5xx en GET,
+    429 et erreurs de connexion en POST (SendRetry).
+    """
+    retry = SendRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,  # Ne pas rejouer un envoi dont la réponse a été perdue (doublon)
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class TwilioTransport:
+    """Client HTTP Twilio partagé par tous les services d'envoi du processus"""
+
+    def __init__(self):
+        self.account_sid = settings.TWILIO_ACCOUNT_SID
+        self.auth_token = settings.TWILIO_AUTH_TOKEN
+        self.base_url = settings.TWILIO_API_BASE_URL.rstrip('/')
+        self.timeout = (3.05, getattr(settings, 'TWILIO_HTTP_TIMEOUT', 15))
+        self.session = build_session(
+            pool_size=getattr(settings, 'TWILIO_HTTP_POOL_SIZE', 32),
+            max_retries=getattr(settings, 'TWILIO_HTTP_MAX_RETRIES', 3),
+            backoff_factor=getattr(settings, 'TWILIO_HTTP_BACKOFF', 0.5),
+        )
+        self.session.auth = (self.account_sid, self.auth_token)
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @property
+    def messages_url(self) -> str:
+        return f"{self.base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+    def limiter_for(self, sender: str) -> SharedRateLimiter:
+        """Limiteur du numéro expéditeur (débit par défaut ou surcharge par numéro), partagé via Redis"""
+        with self._limiters_lock:
+            if sender not in self._limiters:
+                overrides = getattr(settings, 'TWILIO_SENDER_MPS', {}) or {}
+                rate = overrides.get(sender, settings.TWILIO_MESSAGES_PER_SECOND)
+                self._limiters[sender] = SharedRateLimiter(RATE_LIMIT_KEY.format(sender=sender), rate)
+            return self._limiters[sender]
+
+    def send_message(self, from_: str, to: str, body: str) -> Tuple[bool, Optional[str]]:
+        """Envoie un message. Retourne (succès, sid Twilio ou texte d'erreur)."""
+        self.limiter_for(from_).acquire()
+        try:
+            response = self.session.post(
+                self.messages_url,
+                data={'From': from_, 'To': to, 'Body': body},
+                timeout=self.timeout
+            )
+        except requests.RequestException:
+            TWILIO_REQUESTS.inc(status='network_error')
+            raise
+        TWILIO_REQUESTS.inc(status=str(response.status_code))
+        if response.status_code == 201:
+            try:
+                return True, response.json().get('sid')
+            except ValueError:
+                return True, None
+        return False, response.text
+
+
+_transport: Optional[TwilioTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> TwilioTransport:
+    """Transport du processus courant (recréé après un fork des workers prefork)"""
+    global _transport
+    if _transport is None or _transport.pid != os.getpid():
+        with _transport_lock:
+            if _transport is None or _transport.pid != os.getpid():
+                _transport = TwilioTransport()
+                logger.info(f"Transport Twilio initialisé ({_transport.base_url})")
+    return _transport
@@ -200,9 +200,8 @@ Comment puis-je vous aider aujourd'hui ?"""
     def send_whatsapp_response(self, to_number, message):
         """Envoie une réponse WhatsApp"""
         try:
-            from messaging.services import WhatsAppService
-            whatsapp = WhatsAppService()
-            whatsapp.send_message(to_number, message)
+            from messaging.services import get_whatsapp_service
+            get_whatsapp_service().send_message(to_number, message)
             
             return Response({"status": "sent"}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -20,7 +20,12 @@ sys.path.append(os.path.join(settings.BASE_DIR, 'scripts'))
 from patients.models import Patient
 from documents.models import DocumentUpload
 from sessions.models import WhatsAppSession, ConversationLog
+from sessions.memory import ConversationMemory, prepare_history
 from messaging.utils import normalize_phone_number, phones_match
+from metrics.services import MetricsService, measure_stage
+from core import tracing
+from metrics.collectors import mark_session_active
+from metrics.registry import RAG_INTENTS
 
 logger = logging.getLogger(__name__)
 
@@ -30,14 +35,11 @@ def whatsapp_rag_webhook(request):
     """Webhook WhatsApp avec RAG intégré"""
     start_time = time.time()
     
-    # Logger toutes les données reçues pour debug
-    logger.info("="*50)
-    logger.info("📱 WEBHOOK TWILIO APPELÉ")
-    logger.info(f"Method: {request.method}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    logger.info(f"POST data: {dict(request.POST)}")
-    logger.info(f"Body: {request.body.decode('utf-8', errors='ignore')[:500]}")  # Premiers 500 chars
-    logger.info("="*50)
+    # Données brutes (en-têtes, numéro, message du patient) : seulement si explicitement demandé
+    if settings.LOG_WEBHOOK_PAYLOADS:
+        logger.debug(f"Headers: {dict(request.headers)}")
+        logger.debug(f"POST data: {dict(request.POST)}")
+        logger.debug(f"Body: {request.body.decode('utf-8', errors='ignore')[:500]}")  # Premiers 500 chars
     
     try:
         # 1. Extraire les données du message - Twilio envoie en POST form-encoded
@@ -45,9 +47,9 @@ def whatsapp_rag_webhook(request):
         message_body = request.POST.get('Body', '').strip()
         message_sid = request.POST.get('MessageSid', '')
         
-        logger.info(f"📱 From: {from_number}")
-        logger.info(f"📱 Body: {message_body}")
-        logger.info(f"📱 MessageSid: {message_sid}")
+        logger.info("📱 Webhook Twilio reçu", extra={'message_sid': message_sid})
+        if settings.LOG_WEBHOOK_PAYLOADS:
+            logger.debug(f"📱 From: {from_number} Body: {message_body}")
         
         # 2. Préparer la réponse Twilio
         resp = MessagingResponse()
@@ -64,28 +66,30 @@ def whatsapp_rag_webhook(request):
         try:
             # Normaliser le numéro d'abord
             normalized_from = normalize_phone_number(from_number)
-            logger.info(f"🔍 Recherche du patient avec numéro normalisé: {normalized_from}")
+            if settings.LOG_WEBHOOK_PAYLOADS:
+                logger.debug(f"🔍 Recherche du patient avec numéro normalisé: {normalized_from}")
             
             # Recherche flexible du patient
             patient = None
             
-            # 1. Recherche exacte
-            try:
-                patient = Patient.objects.get(phone=normalized_from)
-                logger.info(f"✅ Patient trouvé par recherche exacte")
-            except Patient.DoesNotExist:
-                # 2. Recherche avec comparaison flexible
-                all_patients = Patient.objects.all()
-                for p in all_patients:
-                    if phones_match(p.phone, from_number):
-                        patient = p
-                        logger.info(f"✅ Patient trouvé par comparaison flexible: {p.phone} ≈ {from_number}")
-                        break
+            with measure_stage('patient_lookup'):
+                # 1. Recherche exacte
+                try:
+                    patient = Patient.objects.get(phone=normalized_from)
+                    logger.info(f"✅ Patient trouvé par recherche exacte")
+                except Patient.DoesNotExist:
+                    # 2. Recherche avec comparaison flexible
+                    all_patients = Patient.objects.all()
+                    for p in all_patients:
+                        if phones_match(p.phone, from_number):
+                            patient = p
+                            logger.info(f"✅ Patient trouvé par comparaison flexible (ID: {p.id})")
+                            break
             
             if not patient:
                 raise Patient.DoesNotExist()
             
-            logger.info(f"👤 Patient trouvé: {patient.full_name()} (ID: {patient.id})")
+            logger.info(f"👤 Patient trouvé (ID: {patient.id})")
             
             if not patient.is_active:
                 logger.warning(f"⚠️ Patient non actif: {patient.id}")
@@ -93,12 +97,14 @@ def whatsapp_rag_webhook(request):
                 return HttpResponse(str(resp), content_type='text/xml')
             
         except Patient.DoesNotExist:
-            logger.error(f"❌ Patient non trouvé pour le numéro: {from_number} (normalisé: {normalized_from})")
+            logger.error("❌ Patient non trouvé pour le numéro entrant", extra={'message_sid': message_sid})
             
-            # Logger tous les numéros de patients pour debug
-            logger.debug("📱 Numéros de patients dans la DB:")
-            for p in Patient.objects.all()[:10]:  # Limiter à 10 pour les logs
-                logger.debug(f"  - {p.phone} ({p.full_name()})")
+            # Logger des numéros de patients pour debug
+            if settings.LOG_WEBHOOK_PAYLOADS:
+                logger.debug(f"📱 Numéro: {from_number} (normalisé: {normalized_from})")
+                logger.debug("📱 Numéros de patients dans la DB:")
+                for p in Patient.objects.all()[:10]:  # Limiter à 10 pour les logs
+                    logger.debug(f"  - {p.phone} ({p.full_name()})")
             
             resp.message("❌ Numéro non reconnu. Veuillez contacter votre médecin pour vous inscrire.")
             return HttpResponse(str(resp), content_type='text/xml')
@@ -118,6 +124,7 @@ def whatsapp_rag_webhook(request):
         session.save()
         
         logger.info(f"💬 Session {'créée' if created else 'récupérée'}: {session.session_id}")
+        mark_session_active(session.session_id)
         
         # 6. Utiliser le RAG pour générer la réponse
         try:
@@ -149,7 +156,8 @@ def whatsapp_rag_webhook(request):
         # 8. Envoyer la réponse
         resp.message(response_text)
         logger.info("✅ Réponse envoyée à Twilio")
-        logger.info(f"XML envoyé: {str(resp)}")
+        if settings.LOG_WEBHOOK_PAYLOADS:
+            logger.debug(f"XML envoyé: {str(resp)}")
         return HttpResponse(str(resp), content_type='text/xml')
         
     except Exception as e:
@@ -162,7 +170,9 @@ def whatsapp_rag_webhook(request):
 def handle_activation(from_number, message_body):
     """Gère l'activation du patient"""
     try:
-        logger.info(f"🔑 Traitement activation pour {from_number}")
+        logger.info("🔑 Traitement d'une demande d'activation")
+        if settings.LOG_WEBHOOK_PAYLOADS:
+            logger.debug(f"🔑 Activation demandée par {from_number}")
         
         # Extraire le token - plus flexible
         # Le token peut être après "ACTIVER " ou juste le UUID
@@ -175,18 +185,20 @@ def handle_activation(from_number, message_body):
         
         if matches:
             token = matches[0]
-            logger.info(f"🔑 Token extrait: {token}")
+            logger.info("🔑 Token d'activation extrait")
         else:
             logger.error("❌ Aucun token UUID trouvé dans le message")
             return "❌ Format invalide. Copiez le message complet depuis votre SMS."
         
         # Rechercher le patient par token
         patient = Patient.objects.get(activation_token=token)
-        logger.info(f"👤 Patient trouvé par token: {patient.full_name()}")
+        logger.info(f"👤 Patient trouvé par token (ID: {patient.id})")
         
         # Vérifier que le numéro correspond
         if not phones_match(patient.phone, from_number):
-            logger.error(f"❌ Numéro non correspondant. Patient: {patient.phone}, From: {from_number}")
+            logger.error(f"❌ Numéro non correspondant pour le patient {patient.id}")
+            if settings.LOG_WEBHOOK_PAYLOADS:
+                logger.debug(f"Patient: {patient.phone}, From: {from_number}")
             return "❌ Ce lien d'activation ne correspond pas à votre numéro."
         
         if patient.is_active:
@@ -220,101 +232,104 @@ Je suis votre assistant médical personnel. Je peux vous aider avec :
 Comment puis-je vous aider aujourd'hui ?"""
         
     except Patient.DoesNotExist:
-        logger.error(f"❌ Patient non trouvé pour token: {token}")
+        logger.error("❌ Patient non trouvé pour le token d'activation")
         return "❌ Token d'activation invalide. Veuillez vérifier votre SMS."
     except Exception as e:
         logger.error(f"❌ Erreur activation: {e}", exc_info=True)
         return "❌ Erreur lors de l'activation. Veuillez contacter le support."
 
 
+WHATSAPP_INSTRUCTIONS = """Patient: {first_name} {last_name}
+
+Instructions pour l'assistant médical:
+- Répondre en français de manière claire, empathique et professionnelle
+- Utiliser des emojis appropriés pour WhatsApp (🏥 💊 🔬 📋 ✅ etc.)
+- Limiter la réponse à 300 mots maximum
+- Utiliser un langage simple et accessible
+- Si l'information n'est pas dans les documents, le dire clairement
+- Toujours rappeler que pour des décisions médicales importantes, il faut consulter le médecin
+- Éviter le jargon médical complexe
+- Être rassurant tout en restant factuel"""
+
+
+@tracing.traced('whatsapp.process_with_rag')
 def process_with_rag(patient, query, session):
     """Traite la question avec le système RAG"""
+    tracing.set_attribute('patient_id', patient.id)
     try:
-        logger.info(f"🤖 Traitement RAG pour patient {patient.id} - {patient.full_name()}")
-        logger.info(f"📝 Question: {query}")
+        logger.info(f"🤖 Traitement RAG pour patient {patient.id}")
+        if settings.LOG_WEBHOOK_PAYLOADS:
+            logger.debug(f"📝 Question: {query}")
+        
+        from rag.your_rag_module import RAG
+        from rag import runtime
+        
+        # 0. Routage d'intention : salutations, documents, activation, aide → réponse immédiate
+        if settings.RAG_SETTINGS.get('USE_INTENT_ROUTING', True):
+            with measure_stage('intent'), tracing.span('rag.intent') as span:
+                intent = runtime.get_intent_classifier().classify(query)
+                span.set_attributes(intent=intent.name, method=intent.method, confidence=round(intent.confidence, 3))
+            RAG_INTENTS.inc(intent=intent.name, method=intent.method)
+            if not intent.needs_rag:
+                logger.info(f"🧭 Intention '{intent.name}' ({intent.method}) : réponse sans RAG")
+                return intent_response(patient, intent.name)
         
         # Vérifier d'abord les documents indexés
         indexed_docs = DocumentUpload.objects.filter(
             patient=patient,
             upload_status='indexed'
         )
-        logger.info(f"📚 Documents indexés pour ce patient: {indexed_docs.count()}")
-        for doc in indexed_docs:
-            logger.info(f"  - {doc.original_filename} (ID: {doc.id})")
-        
-        # Importer les modules RAG
-        from rag.your_rag_module import (
-            VectorStoreHDF5, EmbeddingGenerator, 
-            HybridRetriever, GeminiLLM, RAG
-        )
-        
-        # Chemins des fichiers pour ce patient
-        vector_dir = os.path.join(settings.MEDIA_ROOT, 'vectors', f'patient_{patient.id}')
-        hdf5_path = os.path.join(vector_dir, 'vector_store.h5')
-        faiss_path = os.path.join(vector_dir, 'vector_store.faiss')
-        bm25_dir = os.path.join(settings.MEDIA_ROOT, 'indexes', f'patient_{patient.id}_bm25')
+        logger.debug(f"📚 Documents indexés pour ce patient: {indexed_docs.count()}")
         
-        logger.info(f"📁 Recherche vector store: {hdf5_path}")
-        logger.info(f"📁 Existe? {os.path.exists(hdf5_path)}")
+        # 1. Charger le vector store (rechargé seulement si sa génération a changé)
+        with measure_stage('store_load'), tracing.span('rag.store_load', patient_id=patient.id) as span:
+            vector_store = runtime.get_patient_store(patient.id)
+            span.set_attribute('vectors', len(vector_store.meta) if vector_store else 0)
         
         # Vérifier l'existence des fichiers
-        if not os.path.exists(hdf5_path):
+        if vector_store is None:
             logger.warning(f"⚠️ Pas de vector store pour patient {patient.id}")
             if indexed_docs.count() > 0:
                 logger.error("❌ Documents marqués comme indexés mais pas de vector store!")
                 return "⚠️ Vos documents sont en cours de traitement. Veuillez réessayer dans quelques instants."
             return fallback_response(patient, query)
         
-        # 1. Charger le vector store
-        logger.info(f"📚 Chargement du vector store")
-        vector_store = VectorStoreHDF5(hdf5_path)
-        vector_store.load_store()
+        logger.info(f"📚 Vector store chargé (génération {vector_store.generation})")
         
-        # 2. Initialiser l'embedder
-        embedder = EmbeddingGenerator(settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
-        
-        # 3. Créer le retriever
-        if os.path.exists(bm25_dir) and settings.RAG_SETTINGS.get('USE_BM25', True):
-            logger.info("🔍 Utilisation du retriever hybride (dense + BM25)")
-            retriever = HybridRetriever(vector_store, embedder, bm25_dir)
-            
-            # Activer le reranking si configuré
-            if settings.RAG_SETTINGS.get('USE_RERANKING', True):
-                reranker_model = settings.RAG_SETTINGS.get('RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
-                retriever.enable_reranking(reranker_model)
-        else:
-            logger.info("🔍 Utilisation du retriever dense uniquement")
-            retriever = HybridRetriever(vector_store, embedder)
+        # 2-3. Créer le retriever (hybride dense + BM25 si l'index existe, reranking partagé)
+        retriever = runtime.build_retriever(patient.id, vector_store)
         
         # 4. Initialiser le LLM
-        llm = GeminiLLM(model_name=settings.RAG_SETTINGS.get('LLM_MODEL', 'gemini-1.5-flash-latest'))
-        
-        # 5. Créer le pipeline RAG
-        rag = RAG(retriever, llm)
-        
-        # 6. Personnaliser le prompt pour WhatsApp
-        enhanced_query = f"""
-        Patient: {patient.first_name} {patient.last_name}
-        Question: {query}
-        
-        Instructions pour l'assistant médical:
-        - Répondre en français de manière claire, empathique et professionnelle
-        - Utiliser des emojis appropriés pour WhatsApp (🏥 💊 🔬 📋 ✅ etc.)
-        - Limiter la réponse à 300 mots maximum
-        - Utiliser un langage simple et accessible
-        - Si l'information n'est pas dans les documents, le dire clairement
-        - Toujours rappeler que pour des décisions médicales importantes, il faut consulter le médecin
-        - Éviter le jargon médical complexe
-        - Être rassurant tout en restant factuel
-        """
+        llm = runtime.get_llm()
+        
+        # 5. Mémoire de la session : question de suivi reformulée pour la recherche,
+        # historique (résumé + derniers échanges) pour le prompt
+        with tracing.span('rag.conversation_memory') as span:
+            search_query, history = prepare_history(session.session_id if session else None, query, llm)
+            span.set_attributes(rewritten=search_query != query, history_chars=len(history))
+        
+        # 6. Créer le pipeline RAG : les consignes WhatsApp vont dans le prompt,
+        # la recherche (embedding, BM25, rerank) ne reçoit que la question du patient
+        rag = RAG(
+            retriever, llm,
+            instructions=WHATSAPP_INSTRUCTIONS.format(first_name=patient.first_name, last_name=patient.last_name),
+            max_context_tokens=settings.RAG_SETTINGS.get('MAX_CONTEXT_TOKENS', 1500),
+            history=history
+        )
         
         # 7. Obtenir la réponse
         logger.info(f"💭 Génération de la réponse RAG")
-        response = rag.answer(enhanced_query, top_k=5)
+        response = rag.answer(search_query, top_k=5)
+        MetricsService.record_stage_timings(rag.timings)
         
         # 8. Post-traiter la réponse
         response = post_process_response(response, patient)
         
+        # 9. Mémoriser l'échange (réponses RAG uniquement : les intentions routées
+        # ne remplissent pas l'historique et ne déclenchent pas de compaction)
+        if session:
+            ConversationMemory(session.session_id).append(query, response)
+        
         logger.info("✅ Réponse RAG générée avec succès")
         return response
         
@@ -323,24 +338,30 @@ def process_with_rag(patient, query, session):
         return fallback_response(patient, query)
 
 
-def fallback_response(patient, query):
-    """Réponse de secours quand le RAG échoue"""
-    query_lower = query.lower()
-    
-    # Réponses basées sur des mots-clés
-    if any(word in query_lower for word in ['bonjour', 'salut', 'hello', 'bonsoir']):
+def intent_response(patient, intent):
+    """Réponse immédiate (sans recherche ni LLM) pour une intention hors question médicale"""
+    if intent == 'greeting':
         return f"👋 Bonjour {patient.first_name} ! Comment allez-vous aujourd'hui ?"
     
-    elif any(word in query_lower for word in ['document', 'fichier', 'dossier']):
-        docs = DocumentUpload.objects.filter(patient=patient, upload_status='indexed')
-        if docs.exists():
-            doc_list = '\n'.join([f"• {doc.original_filename}" for doc in docs[:5]])
+    elif intent == 'thanks':
+        return f"🙏 Avec plaisir, {patient.first_name} ! N'hésitez pas si vous avez d'autres questions. Bonne journée !"
+    
+    elif intent == 'documents':
+        doc_names = list(
+            DocumentUpload.objects.filter(patient=patient, upload_status='indexed')
+            .values_list('original_filename', flat=True)[:5]
+        )
+        if doc_names:
+            doc_list = '\n'.join([f"• {name}" for name in doc_names])
             return f"📄 Vos documents disponibles :\n{doc_list}\n\nQue souhaitez-vous savoir ?"
         else:
             return "📭 Aucun document trouvé dans votre dossier. Contactez votre médecin pour les ajouter."
     
-    elif any(word in query_lower for word in ['aide', 'help', 'comment', 'quoi']):
-        return """🤝 Je peux vous aider avec :
+    elif intent == 'activation':
+        # Les patients non activés sont arrêtés avant le RAG : le compte est actif
+        return f"✅ Votre compte est déjà activé, {patient.first_name}. Posez-moi directement votre question !"
+    
+    return """🤝 Je peux vous aider avec :
         
 • 📋 Consulter vos documents médicaux
 • 💊 Informations sur vos médicaments
@@ -349,6 +370,21 @@ def fallback_response(patient, query):
 • ❓ Répondre à vos questions de santé
 
 Posez-moi votre question !"""
+
+
+def fallback_response(patient, query):
+    """Réponse de secours quand le RAG échoue"""
+    query_lower = query.lower()
+    
+    # Réponses basées sur des mots-clés
+    if any(word in query_lower for word in ['bonjour', 'salut', 'hello', 'bonsoir']):
+        return intent_response(patient, 'greeting')
+    
+    elif any(word in query_lower for word in ['document', 'fichier', 'dossier']):
+        return intent_response(patient, 'documents')
+    
+    elif any(word in query_lower for word in ['aide', 'help', 'comment', 'quoi']):
+        return intent_response(patient, 'help')
     
     else:
         return f"""🤔 Je n'ai pas trouvé d'information spécifique sur : "{query}"
@@ -0,0 +1,205 @@
+# metrics/buffer.py
+"""
+Tampon de métriques en mémoire.
+
+Les mesures sont ajoutées à une file bornée et écrites par un thread de
+fond, par lots (bulk_create), toutes les FLUSH_INTERVAL secondes ou dès que
+FLUSH_SIZE mesures sont en attente. Une file pleine fait perdre la mesure
+(compteur `dropped`) plutôt que de bloquer l'appelant. Un lot dont
+l'écriture échoue est remis en tête de file, dans la limite de MAX_SIZE ;
+le surplus est compté comme perdu.
+
+Avec le backend 'redis', le thread pousse les lots dans un stream Redis
+(XADD) ; la tâche metrics.tasks.drain_metrics_stream les écrit en base.
+Utile quand de nombreux processus (gunicorn, workers) produisent des mesures.
+"""
+import os
+import json
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .registry import METRICS_BUFFER_DROPPED
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'memory',  # 'memory' ou 'redis'
+    'MAX_SIZE': 10000,
+    'FLUSH_SIZE': 500,
+    'FLUSH_INTERVAL': 5.0,
+    'STREAM_KEY': 'metrics:stream',
+    'STREAM_MAXLEN': 100000,
+}
+
+
+def buffer_settings() -> Dict:
+    return {**DEFAULTS, **getattr(settings, 'METRICS_BUFFER', {})}
+
+
+class MetricsBuffer:
+    """File de mesures bornée, vidée en arrière-plan"""
+
+    def __init__(self, options: Optional[Dict] = None):
+        self.options = options or buffer_settings()
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+
+    def record(self, metric_type: str, value: float, metadata: Optional[Dict] = None,
+               timestamp: Optional[datetime] = None) -> bool:
+        """Ajoute une mesure. Retourne False si la file est pleine (mesure perdue)."""
+        self._ensure_thread()
+        item = (metric_type, float(value), timestamp or timezone.now(), metadata or {})
+        with self._lock:
+            if len(self._items) >= self.options['MAX_SIZE']:
+                self.dropped += 1
+                METRICS_BUFFER_DROPPED.inc()
+                return False
+            self._items.append(item)
+            pending = len(self._items)
+        if pending >= self.options['FLUSH_SIZE']:
+            self._wake.set()
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending': len(self._items),
+                'dropped': self.dropped,
+                'flushed': self.flushed,
+                'failed': self.failed,
+            }
+
+    def _ensure_thread(self):
+        # Un thread par processus : après un fork (gunicorn, prefork), on le relance
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.options['FLUSH_INTERVAL'])
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Erreur vidage du tampon de métriques: {e}")
+
+    def _drain(self) -> List[tuple]:
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+        return items
+
+    def flush(self) -> int:
+        """Écrit les mesures en attente. Retourne le nombre de mesures écrites."""
+        items = self._drain()
+        if not items:
+            return 0
+
+        written = 0
+        if self.options['BACKEND'] == 'redis':
+            written = self._flush_to_stream(items)
+        if not written:
+            written = self._flush_to_db(items)
+
+        if written:
+            with self._lock:
+                self.flushed += written
+        else:
+            self._requeue(items)
+        return written
+
+    def _requeue(self, items: List[tuple]):
+        """Remet un lot non écrit en tête de file ; les plus anciennes mesures sont perdues si elle déborde"""
+        with self._lock:
+            self.failed += len(items)
+            room = max(self.options['MAX_SIZE'] - len(self._items), 0)
+            kept = items[len(items) - room:] if room < len(items) else items
+            self._items.extendleft(reversed(kept))
+            lost = len(items) - len(kept)
+            self.dropped += lost
+        if lost:
+            METRICS_BUFFER_DROPPED.inc(lost)
+            logger.warning(f"{lost} métriques perdues (écriture en échec, tampon plein)")
+
+    def _flush_to_stream(self, items: List[tuple]) -> int:
+        try:
+            from core.redis_client import get_redis
+            pipe = get_redis().pipeline(transaction=False)
+            for metric_type, value, timestamp, metadata in items:
+                pipe.xadd(
+                    self.options['STREAM_KEY'],
+                    {
+                        'metric_type': metric_type,
+                        'value': value,
+                        'timestamp': timestamp.isoformat(),
+                        'metadata': json.dumps(metadata),
+                    },
+                    maxlen=self.options['STREAM_MAXLEN'],
+                    approximate=True
+                )
+            pipe.execute()
+            return len(items)
+        except Exception as e:
+            logger.warning(f"Stream Redis des métriques indisponible ({e}), écriture directe")
+            return 0
+
+    def _flush_to_db(self, items: List[tuple]) -> int:
+        from .models import SystemMetric
+        close_old_connections()
+        try:
+            SystemMetric.objects.bulk_create(
+                [
+                    SystemMetric(metric_type=metric_type, value=value,
+                                 timestamp=timestamp, metadata=metadata)
+                    for metric_type, value, timestamp, metadata in items
+                ],
+                batch_size=self.options['FLUSH_SIZE']
+            )
+            return len(items)
+        except Exception as e:
+            logger.error(f"Échec écriture de {len(items)} métriques: {e}")
+            return 0
+
+
+_buffer: Optional[MetricsBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> MetricsBuffer:
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = MetricsBuffer()
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def record(metric_type: str, value: float, metadata: Optional[Dict] = None) -> bool:
+    """Enregistre une mesure (tampon, ou écriture directe si le tampon est désactivé)"""
+    if not buffer_settings()['ENABLED']:
+        from .models import SystemMetric
+        SystemMetric.objects.create(metric_type=metric_type, value=value, metadata=metadata or {})
+        return True
+    return get_buffer().record(metric_type, value, metadata)
@@ -0,0 +1,62 @@
+# metrics/collectors.py
+"""
+Collecteurs évalués au moment du scrape /metrics, à partir de Redis
+uniquement (jamais de requête en base).
+"""
+import time
+import logging
+from typing import Dict, List
+
+from django.conf import settings
+
+from .registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_SESSIONS_KEY = 'metrics:active_sessions'
+ACTIVE_SESSION_WINDOW = 30 * 60  # Une session est active si un message a été reçu depuis 30 min
+
+
+def mark_session_active(session_id: str):
+    """Note l'activité d'une session WhatsApp (ZADD, score = horodatage)"""
+    try:
+        from core.redis_client import get_redis
+        get_redis().zadd(ACTIVE_SESSIONS_KEY, {session_id: time.time()})
+    except Exception as e:
+        logger.debug(f"Suivi des sessions actives indisponible: {e}")
+
+
+def _queue_names() -> List[str]:
+    return [queue.name for queue in getattr(settings, 'CELERY_TASK_QUEUES', ())] or ['celery']
+
+
+def collect_redis_gauges() -> List[Dict]:
+    from core.redis_client import get_redis
+    client = get_redis()
+    queues = _queue_names()
+    now = time.time()
+
+    pipe = client.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    pipe.zremrangebyscore(ACTIVE_SESSIONS_KEY, '-inf', now - ACTIVE_SESSION_WINDOW)
+    pipe.zcard(ACTIVE_SESSIONS_KEY)
+    results = pipe.execute()
+
+    return [
+        {
+            'name': 'medirecord_celery_queue_length',
+            'type': 'gauge',
+            'help': "Messages en attente par queue Celery",
+            'samples': [[[['queue', queue]], depth] for queue, depth in zip(queues, results)],
+        },
+        {
+            'name': 'medirecord_whatsapp_active_sessions',
+            'type': 'gauge',
+            'help': "Sessions WhatsApp actives (message reçu depuis 30 min)",
+            'samples': [[[], results[-1]]],
+        },
+    ]
+
+
+REGISTRY.register_collector(collect_redis_gauges)
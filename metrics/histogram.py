@@ -0,0 +1,60 @@
+# metrics/histogram.py
+"""
+Histogrammes log-linéaires pour les latences.
+
+Chaque puissance de 2 est découpée en SUB_BUCKETS intervalles égaux : l'erreur
+relative d'un percentile reste sous ~1/SUB_BUCKETS quelle que soit l'échelle
+(1 ms comme 60 s). Les histogrammes sont des dicts {index: effectif},
+sérialisables en JSON et fusionnables par simple addition.
+"""
+import math
+from typing import Dict, Iterable, Optional
+
+SUB_BUCKETS = 8
+MIN_VALUE = 1.0  # Tout ce qui est sous 1 ms tombe dans le bucket 0
+
+
+def bucket_index(value: float) -> int:
+    if value < MIN_VALUE:
+        return 0
+    exponent = int(math.floor(math.log2(value / MIN_VALUE)))
+    base = MIN_VALUE * (2 ** exponent)
+    sub = int((value - base) / base * SUB_BUCKETS)
+    return 1 + exponent * SUB_BUCKETS + min(sub, SUB_BUCKETS - 1)
+
+
+def bucket_upper(index: int) -> float:
+    """Borne supérieure du bucket (valeur rapportée pour un percentile)"""
+    if index <= 0:
+        return MIN_VALUE
+    exponent, sub = divmod(index - 1, SUB_BUCKETS)
+    base = MIN_VALUE * (2 ** exponent)
+    return base + base * (sub + 1) / SUB_BUCKETS
+
+
+def add(histogram: Dict[str, int], value: float, count: int = 1) -> Dict[str, int]:
+    key = str(bucket_index(value))
+    histogram[key] = histogram.get(key, 0) + count
+    return histogram
+
+
+def merge(histograms: Iterable[Optional[Dict[str, int]]]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for histogram in histograms:
+        for key, count in (histogram or {}).items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def percentile(histogram: Dict[str, int], q: float) -> Optional[float]:
+    """Percentile q (0-100) estimé à partir de l'histogramme"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = math.ceil(total * q / 100.0)
+    seen = 0
+    for key in sorted(histogram, key=int):
+        seen += histogram[key]
+        if seen >= rank:
+            return bucket_upper(int(key))
+    return bucket_upper(max(int(k) for k in histogram))
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0002_systemmetric_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Heure'), ('day', 'Jour')], max_length=10)),
+                ('metric_type', models.CharField(max_length=30)),
+                ('endpoint', models.CharField(blank=True, default='', max_length=200)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('histogram', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'metric_type', 'bucket_start'], name='metrics_rollup_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('resolution', 'metric_type', 'endpoint', 'bucket_start'), name='unique_metric_rollup_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricRollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_metric_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0003_metricrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='systemmetric',
+            name='metric_type',
+            field=models.CharField(choices=[('response_time', 'Temps de réponse'), ('rag_accuracy', 'Précision RAG'), ('user_satisfaction', 'Satisfaction utilisateur'), ('message_delivery', 'Livraison message'), ('document_indexing', 'Indexation document'), ('stage_latency', 'Latence par étape')], max_length=30),
+        ),
+    ]
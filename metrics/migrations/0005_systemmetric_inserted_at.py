@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.functions.datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0004_systemmetric_stage_latency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemmetric',
+            name='inserted_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), editable=False),
+        ),
+    ]
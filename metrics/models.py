@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Now
+from django.utils import timezone
 
 class SystemMetric(models.Model):
     METRIC_TYPES = [
@@ -7,12 +9,16 @@ class SystemMetric(models.Model):
         ('user_satisfaction', 'Satisfaction utilisateur'),
         ('message_delivery', 'Livraison message'),
         ('document_indexing', 'Indexation document'),
+        ('stage_latency', 'Latence par étape'),
     ]
     
     metric_type = models.CharField(max_length=30, choices=METRIC_TYPES)
     value = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Horodatage de la mesure (fourni par le tampon, pas l'heure d'écriture)
+    timestamp = models.DateTimeField(default=timezone.now)
     metadata = models.JSONField(default=dict, blank=True)
+    # Heure d'insertion attribuée par la base (watermark des rollups)
+    inserted_at = models.DateTimeField(db_default=Now(), editable=False)
     
     class Meta:
         indexes = [
@@ -35,3 +41,41 @@ class PerformanceAlert(models.Model):
     resolved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
+
+
+class MetricRollup(models.Model):
+    """Agrégats pré-calculés des SystemMetric par minute, heure et jour"""
+    RESOLUTION_CHOICES = [
+        ('minute', 'Minute'),
+        ('hour', 'Heure'),
+        ('day', 'Jour'),
+    ]
+
+    resolution = models.CharField(max_length=10, choices=RESOLUTION_CHOICES)
+    metric_type = models.CharField(max_length=30)
+    endpoint = models.CharField(max_length=200, blank=True, default='')
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    sum = models.FloatField(default=0)
+    min = models.FloatField(null=True, blank=True)
+    max = models.FloatField(null=True, blank=True)
+    # Histogramme log-linéaire des valeurs (metrics/histogram.py), latences uniquement
+    histogram = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resolution', 'metric_type', 'endpoint', 'bucket_start'],
+                name='unique_metric_rollup_bucket'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'metric_type', 'bucket_start'], name='metrics_rollup_lookup_idx'),
+        ]
+
+
+class MetricRollupWatermark(models.Model):
+    """Dernier SystemMetric agrégé : la tâche de rollup reprend à partir de là"""
+    name = models.CharField(max_length=50, unique=True)
+    last_metric_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,421 @@
+# metrics/registry.py
+"""
+Registre de métriques en mémoire (compteurs, jauges, histogrammes) exposé
+au format texte Prometheus.
+
+Chaque processus (gunicorn, workers Celery) garde ses valeurs en mémoire et
+les écrit périodiquement dans un fichier instantané `<pid>-<début>.json` du
+dossier METRICS_MULTIPROC_DIR (un pid réutilisé n'écrase pas l'instantané
+d'un processus terminé). L'endpoint /metrics agrège ces fichiers : compteurs
+et histogrammes sont additionnés, les jauges ne retiennent que les
+processus vivants et à jour. Les instantanés des processus terminés sont
+fusionnés dans `archived.json` (sous verrou de fichier) puis supprimés : le
+dossier ne grossit pas avec le recyclage des workers. Aucune lecture en base.
+
+Sans dépendance Django (utilisable depuis rag/your_rag_module.py).
+"""
+import os
+import json
+import time
+import fcntl
+import atexit
+import logging
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ARCHIVE_NAME = 'archived.json'
+ARCHIVE_LOCK_NAME = '.archive.lock'
+# Instantané périmé au-delà de STALE_INTERVALS intervalles d'écriture (jauges
+# ignorées), archivé au-delà de ARCHIVE_INTERVALS même si le pid existe
+# (pid réutilisé par un autre processus)
+STALE_INTERVALS = 3
+ARCHIVE_INTERVALS = 60
+
+LabelKey = Tuple[Tuple[str, str], ...]
+_process_starts: Dict[int, int] = {}
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, registry: 'Registry' = None):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, object] = {}
+        self._lock = threading.Lock()
+        self._registry = registry or REGISTRY
+        self._registry.register(self)
+
+    def _meta(self) -> Dict:
+        return {'type': self.type, 'help': self.documentation}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = [
+                [list(map(list, key)), dict(value, counts=list(value['counts'])) if isinstance(value, dict) else value]
+                for key, value in self._values.items()
+            ]
+        return {**self._meta(), 'samples': samples}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        self._registry.ensure_writer()
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Jauge. `multiprocess_mode` : 'sum' (somme des processus vivants) ou 'max'."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, multiprocess_mode: str = 'sum', registry=None):
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, registry)
+
+    def _meta(self) -> Dict:
+        return {**super()._meta(), 'mode': self.multiprocess_mode}
+
+    def set(self, value: float, **labels):
+        self._registry.ensure_writer()
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        self._registry.ensure_writer()
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, registry)
+
+    def _meta(self) -> Dict:
+        return {**super()._meta(), 'buckets': list(self.buckets)}
+
+    def observe(self, value: float, **labels):
+        self._registry.ensure_writer()
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state['counts'][i] += 1
+                    break
+            else:
+                state['counts'][-1] += 1
+            state['sum'] += value
+
+    def time(self, **labels):
+        """Context manager : observe la durée du bloc en secondes"""
+        histogram = self
+
+        class _Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+            def __exit__(self, *exc):
+                histogram.observe(time.perf_counter() - self.start, **labels)
+                return False
+
+        return _Timer()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], List[Dict]]] = []
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrique déjà enregistrée: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], List[Dict]]):
+        """Collecteur évalué à chaque scrape ; retourne des familles {name, type, help, samples}"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    # ---------------------------
+    # Multi-processus
+    # ---------------------------
+    @staticmethod
+    def multiproc_dir() -> Optional[str]:
+        return os.getenv('METRICS_MULTIPROC_DIR') or None
+
+    def write_snapshot(self):
+        directory = self.multiproc_dir()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        payload = {'pid': os.getpid(), 'written_at': time.time(), 'metrics': self.snapshot()}
+        _write_json(directory, _snapshot_name(), payload)
+
+    def ensure_writer(self):
+        """Démarre l'écriture périodique de l'instantané du processus (une fois par pid)"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        if not self.multiproc_dir():
+            return
+        interval = snapshot_interval()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    logger.warning(f"Écriture de l'instantané de métriques échouée: {e}")
+
+        self._writer = threading.Thread(target=run, name='metrics-snapshot', daemon=True)
+        self._writer.start()
+        atexit.register(self.write_snapshot)
+
+    def collect(self) -> Dict[str, Dict]:
+        """Familles agrégées sur tous les processus + collecteurs de scrape"""
+        directory = self.multiproc_dir()
+        if directory:
+            self.write_snapshot()
+            families = _aggregate_snapshots(_read_snapshots(directory))
+        else:
+            families = self.snapshot()
+
+        for collector in self._collectors:
+            try:
+                for family in collector():
+                    families[family['name']] = family
+            except Exception as e:
+                logger.warning(f"Collecteur de métriques en échec: {e}")
+        return families
+
+
+def snapshot_interval() -> float:
+    return float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '5'))
+
+
+def _snapshot_name() -> str:
+    # Début du processus (après fork) : distingue deux processus de même pid
+    pid = os.getpid()
+    if pid not in _process_starts:
+        _process_starts[pid] = int(time.time() * 1000)
+    return f'{pid}-{_process_starts[pid]}.json'
+
+
+def _write_json(directory: str, file_name: str, payload: Dict):
+    """Écriture atomique (fichier temporaire puis rename)"""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(payload))
+        os.replace(tmp_path, os.path.join(directory, file_name))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _load_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_state(snapshot: Dict, now: float, interval: float) -> str:
+    """'live' (jauges comptées), 'stale' (compteurs seulement) ou 'dead' (à archiver)"""
+    age = now - snapshot.get('written_at', 0)
+    if not _pid_alive(snapshot.get('pid', 0)) or age > ARCHIVE_INTERVALS * interval:
+        return 'dead'
+    if age > STALE_INTERVALS * interval:
+        return 'stale'
+    return 'live'
+
+
+def _read_snapshots(directory: str) -> List[Dict]:
+    """
+    Instantanés des processus + archive. Ceux des processus terminés sont
+    fusionnés dans l'archive et supprimés au passage.
+    """
+    now, interval = time.time(), snapshot_interval()
+    snapshots, dead = [], []
+    for file_name in os.listdir(directory):
+        if not file_name.endswith('.json') or file_name == ARCHIVE_NAME:
+            continue
+        snapshot = _load_json(os.path.join(directory, file_name))
+        if snapshot is None:
+            continue
+        state = _snapshot_state(snapshot, now, interval)
+        if state == 'dead':
+            dead.append(file_name)
+            continue
+        snapshots.append({**snapshot, 'live': state == 'live'})
+
+    try:
+        archive = _archive_snapshots(directory, dead) if dead else _load_json(os.path.join(directory, ARCHIVE_NAME))
+    except OSError as e:
+        logger.warning(f"Archivage des instantanés de métriques impossible: {e}")
+        archive = _load_json(os.path.join(directory, ARCHIVE_NAME))
+    if archive:
+        snapshots.append({**archive, 'live': False})
+    return snapshots
+
+
+def _archive_snapshots(directory: str, file_names: List[str]) -> Optional[Dict]:
+    """Fusionne compteurs et histogrammes des fichiers dans archived.json, puis les supprime"""
+    with open(os.path.join(directory, ARCHIVE_LOCK_NAME), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            archive_path = os.path.join(directory, ARCHIVE_NAME)
+            archive = _load_json(archive_path)
+            merged = [{**archive, 'live': False}] if archive else []
+            archived = []
+            for file_name in file_names:
+                # Relu sous verrou : déjà archivé par un autre scrape si absent
+                snapshot = _load_json(os.path.join(directory, file_name))
+                if snapshot is not None:
+                    merged.append({**snapshot, 'live': False})
+                    archived.append(file_name)
+            if not archived:
+                return archive
+            archive = {'pid': 0, 'written_at': time.time(), 'metrics': _aggregate_snapshots(merged)}
+            _write_json(directory, ARCHIVE_NAME, archive)
+            for file_name in archived:
+                os.remove(os.path.join(directory, file_name))
+            return archive
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _aggregate_snapshots(snapshots: List[Dict]) -> Dict[str, Dict]:
+    families: Dict[str, Dict] = {}
+    for snapshot in snapshots:
+        live = snapshot.get('live', True)
+        for name, family in snapshot.get('metrics', {}).items():
+            # Les jauges d'un processus terminé ou muet n'ont plus de sens ; ses compteurs restent acquis
+            if family['type'] == 'gauge' and not live:
+                continue
+            target = families.setdefault(name, {**family, 'samples': {}})
+            for label_pairs, value in family['samples']:
+                key = tuple(tuple(pair) for pair in label_pairs)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif family['type'] == 'histogram':
+                    target['samples'][key] = {
+                        'counts': [a + b for a, b in zip(current['counts'], value['counts'])],
+                        'sum': current['sum'] + value['sum'],
+                    }
+                elif family['type'] == 'gauge' and family.get('mode') == 'max':
+                    target['samples'][key] = max(current, value)
+                else:
+                    target['samples'][key] = current + value
+
+    for family in families.values():
+        family['samples'] = [[list(map(list, key)), value] for key, value in family['samples'].items()]
+    return families
+
+
+# ---------------------------
+# Format texte
+# ---------------------------
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(label_pairs, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [tuple(pair) for pair in label_pairs]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def render(families: Dict[str, Dict]) -> str:
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family.get('help', '')}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for label_pairs, value in family['samples']:
+            if family['type'] == 'histogram':
+                cumulative = 0
+                bounds = list(family['buckets']) + [float('inf')]
+                for upper, count in zip(bounds, value['counts']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(label_pairs, ('le', _format_value(upper)))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_pairs)} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(label_pairs)} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(label_pairs)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# ---------------------------
+# Métriques de l'application
+# ---------------------------
+RAG_STORE_CACHE = Counter('medirecord_rag_store_cache_total', "Accès au cache des stores patients (result=hit|miss)")
+RAG_STORE_VECTORS = Gauge('medirecord_rag_store_cached_vectors', "Vecteurs des stores patients en cache")
+RAG_STORE_CACHED = Gauge('medirecord_rag_store_cached_stores', "Stores patients en cache")
+MODEL_LOAD_SECONDS = Histogram('medirecord_model_load_seconds', "Durée de chargement des modèles (model)",
+                               buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120))
+TWILIO_REQUESTS = Counter('medirecord_twilio_requests_total', "Requêtes API Twilio (status)")
+GEMINI_REQUESTS = Counter('medirecord_gemini_requests_total', "Appels Gemini (outcome=ok|error)")
+RAG_INTENTS = Counter('medirecord_rag_intents_total', "Messages patients par intention (intent, method)")
+GEMINI_SECONDS = Histogram('medirecord_gemini_request_seconds', "Durée des appels Gemini")
+METRICS_BUFFER_DROPPED = Counter('medirecord_metrics_buffer_dropped_total', "Mesures perdues (tampon plein)")
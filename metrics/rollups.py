@@ -0,0 +1,163 @@
+# metrics/rollups.py
+"""
+Agrégation incrémentale des SystemMetric en MetricRollup.
+
+Chaque passage lit les mesures dont l'id dépasse le watermark, les agrège
+par (résolution, type, endpoint, début de bucket) et fusionne le résultat
+dans les lignes existantes. Les mesures arrivées en retard (tampon, stream
+Redis) sont donc comptées dans leur bucket d'origine.
+
+Les ids sont attribués à l'insertion mais les lots des différents processus
+ne sont pas validés dans cet ordre : un lot d'ids plus bas peut devenir
+visible après un lot plus haut. Le watermark ne dépasse donc jamais une
+ligne insérée depuis moins de ROLLUP_LAG, d'après `inserted_at` (horloge de
+la base, début de la transaction d'insertion) comparé à l'heure de la base :
+l'horodatage de la mesure ne convient pas, une mesure vidée en retard par le
+tampon ou le stream porte une heure ancienne. Les lots encore en cours de
+validation restent ainsi devant le watermark.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import histogram
+from .models import SystemMetric, MetricRollup, MetricRollupWatermark
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = ('minute', 'hour', 'day')
+RESOLUTION_STEP = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+# Types dont on garde l'histogramme (percentiles de latence)
+LATENCY_TYPES = {'response_time', 'stage_latency'}
+WATERMARK_NAME = 'system_metric'
+
+
+def rollup_lag() -> timedelta:
+    """Ancienneté d'insertion minimale d'une ligne avant agrégation"""
+    flush_interval = float(getattr(settings, 'METRICS_BUFFER', {}).get('FLUSH_INTERVAL', 5))
+    return timedelta(seconds=getattr(settings, 'METRICS_ROLLUP_LAG', max(2 * flush_interval, 30)))
+
+
+def _database_now() -> datetime:
+    # Même horloge que inserted_at : pas de décalage entre hôtes applicatifs et base
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT CURRENT_TIMESTAMP")
+        return cursor.fetchone()[0]
+
+
+def bucket_start(timestamp: datetime, resolution: str) -> datetime:
+    timestamp = timestamp.replace(second=0, microsecond=0)
+    if resolution in ('hour', 'day'):
+        timestamp = timestamp.replace(minute=0)
+    if resolution == 'day':
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def _metric_endpoint(metadata) -> str:
+    if isinstance(metadata, dict):
+        return (metadata.get('endpoint') or '')[:200]
+    return ''
+
+
+def _aggregate(rows) -> Dict[Tuple, Dict]:
+    buckets: Dict[Tuple, Dict] = defaultdict(
+        lambda: {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'histogram': {}}
+    )
+    for metric_type, value, timestamp, metadata in rows:
+        endpoint = _metric_endpoint(metadata)
+        for resolution in RESOLUTIONS:
+            agg = buckets[(resolution, metric_type, endpoint, bucket_start(timestamp, resolution))]
+            agg['count'] += 1
+            agg['sum'] += value
+            agg['min'] = value if agg['min'] is None else min(agg['min'], value)
+            agg['max'] = value if agg['max'] is None else max(agg['max'], value)
+            if metric_type in LATENCY_TYPES:
+                histogram.add(agg['histogram'], value)
+    return buckets
+
+
+def _merge_into_rollups(buckets: Dict[Tuple, Dict]):
+    """Fusionne les agrégats dans MetricRollup (une requête de lecture par résolution)"""
+    by_resolution = defaultdict(dict)
+    for key, agg in buckets.items():
+        by_resolution[key[0]][key] = agg
+
+    for resolution, items in by_resolution.items():
+        starts = {key[3] for key in items}
+        existing = {
+            (r.resolution, r.metric_type, r.endpoint, r.bucket_start): r
+            for r in MetricRollup.objects.select_for_update().filter(
+                resolution=resolution,
+                metric_type__in={key[1] for key in items},
+                bucket_start__gte=min(starts),
+                bucket_start__lte=max(starts),
+            )
+        }
+
+        to_create, to_update = [], []
+        for key, agg in items.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                to_create.append(MetricRollup(
+                    resolution=key[0], metric_type=key[1], endpoint=key[2], bucket_start=key[3],
+                    count=agg['count'], sum=agg['sum'], min=agg['min'], max=agg['max'],
+                    histogram=agg['histogram'],
+                ))
+                continue
+            rollup.count += agg['count']
+            rollup.sum += agg['sum']
+            rollup.min = agg['min'] if rollup.min is None else min(rollup.min, agg['min'])
+            rollup.max = agg['max'] if rollup.max is None else max(rollup.max, agg['max'])
+            if agg['histogram']:
+                rollup.histogram = histogram.merge([rollup.histogram, agg['histogram']])
+            to_update.append(rollup)
+
+        MetricRollup.objects.bulk_create(to_create, batch_size=1000)
+        MetricRollup.objects.bulk_update(
+            to_update, ['count', 'sum', 'min', 'max', 'histogram'], batch_size=1000
+        )
+
+
+def rollup_new_metrics(batch_size: int = 20000, max_batches: int = 10) -> int:
+    """Agrège les mesures postérieures au watermark. Retourne le nombre traité."""
+    processed = 0
+    cutoff = _database_now() - rollup_lag()
+    for _ in range(max_batches):
+        with transaction.atomic():
+            watermark, _ = MetricRollupWatermark.objects.select_for_update().get_or_create(
+                name=WATERMARK_NAME
+            )
+            rows = list(
+                SystemMetric.objects.filter(id__gt=watermark.last_metric_id)
+                .order_by('id')
+                .values_list('id', 'metric_type', 'value', 'timestamp', 'metadata', 'inserted_at')[:batch_size]
+            )
+            fetched = len(rows)
+            # Arrêt à la première ligne insérée trop récemment : un lot d'ids
+            # plus bas peut encore être en cours de validation
+            recent = next((i for i, row in enumerate(rows) if row[5] >= cutoff), None)
+            if recent is not None:
+                rows = rows[:recent]
+            if not rows:
+                break
+
+            _merge_into_rollups(_aggregate(row[1:5] for row in rows))
+            watermark.last_metric_id = rows[-1][0]
+            watermark.save(update_fields=['last_metric_id', 'updated_at'])
+
+        processed += len(rows)
+        if recent is not None or fetched < batch_size:
+            break
+
+    if processed:
+        logger.info(f"{processed} métriques agrégées")
+    return processed
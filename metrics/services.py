@@ -1,22 +1,24 @@
 import time
+from contextlib import contextmanager
 from typing import Dict, Any
-from .models import SystemMetric, PerformanceAlert
+from .models import PerformanceAlert
+from . import buffer
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
 class MetricsService:
-    """Service pour enregistrer et analyser les métriques système"""
+    """
+    Service pour enregistrer et analyser les métriques système.
+    Les mesures passent par le tampon (metrics/buffer.py) : aucune écriture
+    en base sur le chemin de la requête.
+    """
     
     @staticmethod
     def record_response_time(response_time_ms: float, endpoint: str = ""):
         """Enregistre le temps de réponse d'une API"""
-        SystemMetric.objects.create(
-            metric_type='response_time',
-            value=response_time_ms,
-            metadata={'endpoint': endpoint}
-        )
+        buffer.record('response_time', response_time_ms, {'endpoint': endpoint})
         
         # Vérifier les seuils d'alerte
         if response_time_ms > 5000:  # Plus de 5 secondes
@@ -28,40 +30,39 @@ class MetricsService:
                 response_time_ms
             )
     
+    @staticmethod
+    def record_stage_latency(stage: str, duration_ms: float):
+        """Enregistre la durée d'une étape (patient_lookup, embedding, llm, twilio_send...)"""
+        buffer.record('stage_latency', duration_ms, {'endpoint': stage})
+
+    @staticmethod
+    def record_stage_timings(timings: Dict[str, float]):
+        """Enregistre les durées par étape relevées par le retriever / le RAG"""
+        for stage, duration_ms in timings.items():
+            MetricsService.record_stage_latency(stage, duration_ms)
+    
     @staticmethod
     def record_rag_accuracy(accuracy_score: float, query: str = ""):
         """Enregistre la précision d'une réponse RAG"""
-        SystemMetric.objects.create(
-            metric_type='rag_accuracy',
-            value=accuracy_score,
-            metadata={'query_sample': query[:100]}
-        )
+        buffer.record('rag_accuracy', accuracy_score, {'query_sample': query[:100]})
     
     @staticmethod
     def record_document_indexing(success: bool, document_id: str, processing_time_ms: float):
         """Enregistre les métriques d'indexation de document"""
-        SystemMetric.objects.create(
-            metric_type='document_indexing',
-            value=1.0 if success else 0.0,
-            metadata={
-                'document_id': document_id,
-                'processing_time_ms': processing_time_ms,
-                'success': success
-            }
-        )
+        buffer.record('document_indexing', 1.0 if success else 0.0, {
+            'document_id': document_id,
+            'processing_time_ms': processing_time_ms,
+            'success': success
+        })
     
     @staticmethod
     def record_message_delivery(success: bool, phone_number: str, message_type: str):
         """Enregistre les métriques de livraison de message"""
-        SystemMetric.objects.create(
-            metric_type='message_delivery',
-            value=1.0 if success else 0.0,
-            metadata={
-                'phone_number': phone_number,
-                'message_type': message_type,
-                'success': success
-            }
-        )
+        buffer.record('message_delivery', 1.0 if success else 0.0, {
+            'phone_number': phone_number,
+            'message_type': message_type,
+            'success': success
+        })
     
     @staticmethod
     def _create_alert(metric_type: str, severity: str, message: str, 
@@ -78,6 +79,15 @@ class MetricsService:
         # Log l'alerte
         logger.warning(f"ALERTE {severity.upper()}: {message}")
 
+@contextmanager
+def measure_stage(stage: str):
+    """Chronomètre un bloc et l'enregistre comme latence d'étape"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        MetricsService.record_stage_latency(stage, (time.perf_counter() - start) * 1000)
+
 class PerformanceMonitor:
     """Décorateur pour monitorer les performances d'une fonction"""
     
@@ -0,0 +1,93 @@
+from celery import shared_task
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from datetime import timedelta
+import json
+import logging
+
+from .buffer import buffer_settings
+from .models import SystemMetric, MetricRollup, MetricRollupWatermark
+from .rollups import rollup_new_metrics, WATERMARK_NAME
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def drain_metrics_stream(batch_size=2000, max_batches=20):
+    """
+    Écrit en base les mesures accumulées dans le stream Redis par les
+    tampons des processus (backend 'redis'), par lots de `batch_size`.
+    """
+    options = buffer_settings()
+    if options['BACKEND'] != 'redis':
+        return {"written": 0}
+
+    from core.redis_client import get_redis
+    client = get_redis()
+    stream_key = options['STREAM_KEY']
+    written = 0
+
+    for _ in range(max_batches):
+        entries = client.xrange(stream_key, min='-', max='+', count=batch_size)
+        if not entries:
+            break
+
+        metrics = []
+        for _entry_id, fields in entries:
+            fields = {k.decode(): v.decode() for k, v in fields.items()}
+            try:
+                metrics.append(SystemMetric(
+                    metric_type=fields['metric_type'],
+                    value=float(fields['value']),
+                    timestamp=parse_datetime(fields['timestamp']) or timezone.now(),
+                    metadata=json.loads(fields.get('metadata') or '{}'),
+                ))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Mesure invalide ignorée dans {stream_key}: {e}")
+
+        SystemMetric.objects.bulk_create(metrics, batch_size=500)
+        # Supprimer seulement après l'écriture : un échec laisse les mesures dans le stream
+        client.xdel(stream_key, *[entry_id for entry_id, _ in entries])
+        written += len(metrics)
+
+        if len(entries) < batch_size:
+            break
+
+    if written:
+        logger.info(f"{written} métriques écrites depuis {stream_key}")
+    return {"written": written}
+
+
+@shared_task
+def rollup_metrics():
+    """Met à jour les agrégats minute/heure/jour à partir des nouvelles mesures"""
+    return {"processed": rollup_new_metrics()}
+
+
+@shared_task
+def cleanup_old_metrics():
+    """
+    Purge les mesures brutes déjà agrégées et les agrégats fins trop anciens.
+    Les agrégats journaliers sont conservés.
+    """
+    retention = getattr(settings, 'METRICS_RETENTION_DAYS', {})
+    now = timezone.now()
+
+    watermark = MetricRollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+    last_id = watermark.last_metric_id if watermark else 0
+    raw_deleted, _ = SystemMetric.objects.filter(
+        id__lte=last_id,
+        timestamp__lt=now - timedelta(days=retention.get('raw', 7))
+    ).delete()
+
+    rollups_deleted = 0
+    for resolution in ('minute', 'hour'):
+        deleted, _ = MetricRollup.objects.filter(
+            resolution=resolution,
+            bucket_start__lt=now - timedelta(days=retention.get(resolution, 2 if resolution == 'minute' else 90))
+        ).delete()
+        rollups_deleted += deleted
+
+    logger.info(f"Nettoyage métriques: {raw_deleted} brutes, {rollups_deleted} agrégats")
+    return {"raw_deleted": raw_deleted, "rollups_deleted": rollups_deleted}
@@ -1,3 +1,130 @@
-from django.test import TestCase
+import os
+import json
+import time
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import histogram, registry
+
+
+class HistogramTests(SimpleTestCase):
+    def test_bucket_bounds_relative_error(self):
+        for value in (1.0, 1.3, 7.9, 42.0, 999.0, 61000.0):
+            upper = histogram.bucket_upper(histogram.bucket_index(value))
+            self.assertGreaterEqual(upper, value)
+            self.assertLessEqual((upper - value) / value, 1.0 / histogram.SUB_BUCKETS)
+
+    def test_small_values_share_first_bucket(self):
+        self.assertEqual(histogram.bucket_index(0.2), 0)
+        self.assertEqual(histogram.bucket_upper(0), histogram.MIN_VALUE)
+
+    def test_bucket_index_is_monotonic(self):
+        values = [0.5 + i * 0.37 for i in range(2000)]
+        indexes = [histogram.bucket_index(v) for v in values]
+        self.assertEqual(indexes, sorted(indexes))
+
+    def test_percentiles_and_merge(self):
+        low, high = {}, {}
+        for _ in range(90):
+            histogram.add(low, 10.0)
+        for _ in range(10):
+            histogram.add(high, 1000.0)
+        merged = histogram.merge([low, None, high])
+
+        self.assertEqual(sum(merged.values()), 100)
+        self.assertAlmostEqual(histogram.percentile(merged, 50), 10.0, delta=10.0 / histogram.SUB_BUCKETS)
+        self.assertAlmostEqual(histogram.percentile(merged, 95), 1000.0, delta=1000.0 / histogram.SUB_BUCKETS)
+        self.assertIsNone(histogram.percentile({}, 95))
+
+
+def _snapshot(pid, metrics, written_at=None):
+    return {'pid': pid, 'written_at': written_at or time.time(), 'metrics': metrics}
+
+
+def _counter(value, **labels):
+    return {'type': 'counter', 'help': '', 'samples': [[sorted(labels.items()), value]]}
+
+
+def _gauge(value, mode='sum'):
+    return {'type': 'gauge', 'help': '', 'mode': mode, 'samples': [[[], value]]}
+
+
+class RegistryAggregationTests(SimpleTestCase):
+    def test_counters_and_histograms_are_summed(self):
+        hist = {'type': 'histogram', 'help': '', 'buckets': [1.0], 'samples': [[[], {'counts': [1, 2], 'sum': 3.5}]]}
+        families = registry._aggregate_snapshots([
+            {**_snapshot(1, {'c': _counter(2, status='201'), 'h': hist}), 'live': True},
+            {**_snapshot(2, {'c': _counter(3, status='201'), 'h': hist}), 'live': False},
+        ])
+
+        self.assertEqual(families['c']['samples'], [[[['status', '201']], 5]])
+        self.assertEqual(families['h']['samples'], [[[], {'counts': [2, 4], 'sum': 7.0}]])
+
+    def test_gauges_only_from_live_snapshots(self):
+        families = registry._aggregate_snapshots([
+            {**_snapshot(1, {'g': _gauge(4), 'm': _gauge(2, 'max')}), 'live': True},
+            {**_snapshot(2, {'g': _gauge(6), 'm': _gauge(9, 'max')}), 'live': True},
+            {**_snapshot(3, {'g': _gauge(100), 'm': _gauge(100, 'max')}), 'live': False},
+        ])
+
+        self.assertEqual(families['g']['samples'], [[[], 10]])
+        self.assertEqual(families['m']['samples'], [[[], 9]])
+
+    def test_render_histogram_is_cumulative(self):
+        reg = registry.Registry()
+        h = registry.Histogram('latency_seconds', 'Latence', buckets=(0.1, 1.0), registry=reg)
+        for value in (0.05, 0.5, 5.0):
+            h.observe(value, stage='faiss')
+        text = registry.render(reg.snapshot())
+
+        self.assertIn('latency_seconds_bucket{stage="faiss",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="faiss",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{stage="faiss",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{stage="faiss"} 3', text)
+
+    def test_duplicate_metric_name_rejected(self):
+        reg = registry.Registry()
+        registry.Counter('dup_total', '', registry=reg)
+        with self.assertRaises(ValueError):
+            registry.Counter('dup_total', '', registry=reg)
+
+
+class SnapshotArchiveTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def _write(self, name, snapshot):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump(snapshot, f)
+
+    def test_dead_snapshots_are_archived_once(self):
+        self._write('100-1.json', _snapshot(100, {'c': _counter(2), 'g': _gauge(5)}))
+        self._write('200-1.json', _snapshot(200, {'c': _counter(3), 'g': _gauge(7)}))
+
+        with mock.patch.object(registry, '_pid_alive', side_effect=lambda pid: pid == 200):
+            first = registry._aggregate_snapshots(registry._read_snapshots(self.directory))
+            second = registry._aggregate_snapshots(registry._read_snapshots(self.directory))
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [registry.ARCHIVE_LOCK_NAME, '200-1.json', registry.ARCHIVE_NAME])
+        for families in (first, second):
+            self.assertEqual(families['c']['samples'], [[[], 5]])
+            self.assertEqual(families['g']['samples'], [[[], 7]])
+
+    def test_stale_snapshot_of_reused_pid(self):
+        interval = registry.snapshot_interval()
+        stale = time.time() - (registry.STALE_INTERVALS + 1) * interval
+        silent = time.time() - (registry.ARCHIVE_INTERVALS + 1) * interval
+        self._write('300-1.json', _snapshot(300, {'c': _counter(1), 'g': _gauge(5)}, written_at=stale))
+        self._write('400-1.json', _snapshot(400, {'c': _counter(4), 'g': _gauge(8)}, written_at=silent))
+
+        with mock.patch.object(registry, '_pid_alive', return_value=True):
+            families = registry._aggregate_snapshots(registry._read_snapshots(self.directory))
+
+        self.assertEqual(families['c']['samples'], [[[], 5]])
+        self.assertNotIn('g', families)
+        self.assertNotIn('400-1.json', os.listdir(self.directory))
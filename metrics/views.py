@@ -1,80 +1,136 @@
+from django.http import HttpResponse
+from django.views import View
 from rest_framework import views
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.db.models import Avg, Count
-from datetime import datetime, timedelta
+from django.db.models import Sum
+from datetime import timedelta
 from django.utils import timezone
-from .models import SystemMetric, PerformanceAlert
+from .models import MetricRollup, PerformanceAlert
+from .rollups import bucket_start, RESOLUTION_STEP, LATENCY_TYPES
+from . import histogram
+
+DASHBOARD_METRIC_TYPES = ('response_time', 'document_indexing', 'message_delivery')
+PERCENTILES = (50, 95, 99)
+MAX_HOURS = 366 * 24
+
+
+def _percentiles(hist):
+    return {f'p{q}': histogram.percentile(hist, q) for q in PERCENTILES}
+
 
 class MetricsDashboardAPIView(views.APIView):
     """
     GET /api/metrics/dashboard/
-    Tableau de bord des métriques système
+    Tableau de bord des métriques système, calculé sur les agrégats
+    (MetricRollup) : deux requêtes quelle que soit la fenêtre, dont une pour
+    les percentiles p50/p95/p99 par étape.
     """
     permission_classes = [AllowAny]
-    
+
     def get(self, request):
-        # Période d'analyse (dernières 24h par défaut)
-        hours = int(request.GET.get('hours', 24))
-        since = timezone.now() - timedelta(hours=hours)
-        
-        # Temps de réponse moyen
-        avg_response_time = SystemMetric.objects.filter(
-            metric_type='response_time',
-            timestamp__gte=since
-        ).aggregate(avg_time=Avg('value'))['avg_time'] or 0
-        
-        # Taux de succès indexation
-        indexing_metrics = SystemMetric.objects.filter(
-            metric_type='document_indexing',
-            timestamp__gte=since
-        )
-        indexing_success_rate = 0
-        if indexing_metrics.exists():
-            total_indexing = indexing_metrics.count()
-            successful_indexing = indexing_metrics.filter(value=1.0).count()
-            indexing_success_rate = (successful_indexing / total_indexing) * 100
-        
-        # Taux de livraison messages
-        delivery_metrics = SystemMetric.objects.filter(
-            metric_type='message_delivery',
-            timestamp__gte=since
+        # Période d'analyse (dernières 24h par défaut, au plus la rétention journalière)
+        try:
+            hours = int(request.GET.get('hours', 24))
+        except (TypeError, ValueError):
+            return Response({'error': "Le paramètre 'hours' doit être un entier"}, status=400)
+        if not 1 <= hours <= MAX_HOURS:
+            return Response({'error': f"Le paramètre 'hours' doit être entre 1 et {MAX_HOURS}"}, status=400)
+        # Résolution des tendances : heure par défaut, jour au-delà de 14 jours
+        resolution = request.GET.get('resolution') or ('hour' if hours <= 14 * 24 else 'day')
+        if resolution not in RESOLUTION_STEP:
+            resolution = 'hour'
+
+        now = timezone.now()
+        since = bucket_start(now - timedelta(hours=hours), resolution)
+
+        rows = MetricRollup.objects.filter(
+            resolution=resolution,
+            metric_type__in=DASHBOARD_METRIC_TYPES,
+            bucket_start__gte=since
+        ).values('metric_type', 'bucket_start').annotate(
+            total_count=Sum('count'), total_sum=Sum('sum')
         )
-        delivery_success_rate = 0
-        if delivery_metrics.exists():
-            total_delivery = delivery_metrics.count()
-            successful_delivery = delivery_metrics.filter(value=1.0).count()
-            delivery_success_rate = (successful_delivery / total_delivery) * 100
-        
+
+        totals = {metric_type: [0, 0.0] for metric_type in DASHBOARD_METRIC_TYPES}
+        response_buckets = {}
+        for row in rows:
+            totals[row['metric_type']][0] += row['total_count']
+            totals[row['metric_type']][1] += row['total_sum']
+            if row['metric_type'] == 'response_time':
+                response_buckets[row['bucket_start']] = (row['total_count'], row['total_sum'])
+
+        def mean(metric_type):
+            count, total = totals[metric_type]
+            return total / count if count else 0
+
+        # Temps de réponse moyen ; succès = moyenne des valeurs 1.0/0.0
+        avg_response_time = mean('response_time')
+        indexing_success_rate = mean('document_indexing') * 100
+        delivery_success_rate = mean('message_delivery') * 100
+
+        # Percentiles de latence par étape (stage_latency) et globaux (response_time),
+        # par bucket et sur la fenêtre : fusion des histogrammes des agrégats
+        latency_rows = MetricRollup.objects.filter(
+            resolution=resolution,
+            metric_type__in=LATENCY_TYPES,
+            bucket_start__gte=since
+        ).values_list('metric_type', 'endpoint', 'bucket_start', 'histogram')
+
+        stage_buckets = {}
+        for metric_type, endpoint, start, hist in latency_rows:
+            stage = endpoint if metric_type == 'stage_latency' else 'response_time'
+            per_bucket = stage_buckets.setdefault(stage, {})
+            per_bucket[start] = histogram.merge([per_bucket.get(start), hist])
+
+        latency_percentiles = {}
+        for stage, per_bucket in sorted(stage_buckets.items()):
+            latency_percentiles[stage] = {
+                **_percentiles(histogram.merge(per_bucket.values())),
+                'buckets': [
+                    {'bucket_start': start.isoformat(), 'count': sum(hist.values()), **_percentiles(hist)}
+                    for start, hist in sorted(per_bucket.items())
+                ]
+            }
+
         # Alertes actives
         active_alerts = PerformanceAlert.objects.filter(resolved=False).count()
-        
-        # Évolution des métriques (par heure)
-        hourly_metrics = []
-        for i in range(hours):
-            hour_start = timezone.now() - timedelta(hours=i+1)
-            hour_end = timezone.now() - timedelta(hours=i)
-            
-            hour_data = {
-                'hour': hour_start.strftime('%H:00'),
-                'response_time': SystemMetric.objects.filter(
-                    metric_type='response_time',
-                    timestamp__gte=hour_start,
-                    timestamp__lt=hour_end
-                ).aggregate(avg=Avg('value'))['avg'] or 0,
-                'conversations': SystemMetric.objects.filter(
-                    metric_type='response_time',
-                    timestamp__gte=hour_start,
-                    timestamp__lt=hour_end
-                ).count()
-            }
-            hourly_metrics.append(hour_data)
-        
+
+        # Évolution des métriques (buckets vides inclus)
+        step = RESOLUTION_STEP[resolution]
+        label_format = '%Y-%m-%d' if resolution == 'day' else '%H:%M' if resolution == 'minute' else '%H:00'
+        trends = []
+        current = since
+        while current <= now:
+            count, total = response_buckets.get(current, (0, 0.0))
+            trends.append({
+                'hour': current.strftime(label_format),
+                'bucket_start': current.isoformat(),
+                'response_time': total / count if count else 0,
+                'conversations': count
+            })
+            current += step
+
         return Response({
             "period_hours": hours,
+            "resolution": resolution,
             "avg_response_time_ms": round(avg_response_time, 2),
             "indexing_success_rate": round(indexing_success_rate, 2),
             "delivery_success_rate": round(delivery_success_rate, 2),
             "active_alerts": active_alerts,
-            "hourly_trends": list(reversed(hourly_metrics))
+            "hourly_trends": trends,
+            "latency_percentiles": latency_percentiles
         })
+
+
+class PrometheusMetricsView(View):
+    """
+    GET /metrics
+    Exposition texte Prometheus du registre en mémoire, agrégé sur tous les
+    processus (METRICS_MULTIPROC_DIR). Aucune requête en base.
+    """
+
+    def get(self, request):
+        from . import collectors  # noqa: F401 (enregistre les collecteurs Redis)
+        from .registry import REGISTRY, render
+        return HttpResponse(render(REGISTRY.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
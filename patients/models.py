@@ -1,7 +1,9 @@
 # patients/models.py
 
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 from datetime import date
 
@@ -32,6 +34,16 @@ class Patient(models.Model):
     # NEW: store the workflow ID that n8n returns when dynamically creating a workflow
     n8n_workflow_id = models.CharField(max_length=128, null=True, blank=True, help_text="ID du workflow n8n associé")
 
+    class Meta:
+        indexes = [
+            # Pagination par curseur sur (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='patients_created_id_idx'),
+            # Recherche icontains (UPPER(col) LIKE ...) : index trigramme sur UPPER(col)
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='patients_first_name_trgm'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'), name='patients_last_name_trgm'),
+            GinIndex(OpClass(Upper('phone'), name='gin_trgm_ops'), name='patients_phone_trgm'),
+        ]
+
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
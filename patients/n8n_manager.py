@@ -70,10 +70,10 @@ class N8NWorkflowManager:
         except Exception as e:
             print(f"❌ Debug failed: {e}")
 
-    def test_connection(self) -> bool:
+    def test_connection(self, timeout: Optional[float] = None) -> bool:
         """Vérifie que l'instance n8n est joignable."""
         try:
-            response = self.session.get(f"{self.base_url}/api/v1/workflows")
+            response = self.session.get(f"{self.base_url}/api/v1/workflows", timeout=timeout)
             return response.status_code in [200, 401]
         except requests.exceptions.RequestException as e:
             print(f"❌ Connection test failed: {e}")
@@ -1,4 +1,5 @@
 from django.urls import path
+from documents.progress_events import indexing_events
 from .views import (
     PatientCreateAPIView,
     PatientConfirmAPIView,
@@ -19,6 +20,9 @@ urlpatterns = [
     path('api/patients/<int:patient_id>/indexing-status/', 
          PatientIndexingStatusView.as_view(), 
          name='patient-indexing-status'),
+    path('api/patients/<int:patient_id>/indexing-events/',
+         indexing_events,
+         name='patient-indexing-events'),
     path('api/documents/<int:document_id>/status/', 
          DocumentIndexingStatusView.as_view(), 
          name='document-status'),
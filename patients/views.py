@@ -10,20 +10,27 @@ import uuid
 from django.urls import reverse
 from django.views import View
 from django.http import HttpResponseBadRequest, HttpResponseRedirect
+from django.utils.http import parse_etags, quote_etag
 from .serializers import PatientCreateSerializer
 from .models import Patient
 from .n8n_client import trigger_n8n_activation # This might be unused, depending on final structure
 from django.utils import timezone
 import os
 import json
-from django.db import models
+import base64
+import hashlib
+from collections import Counter
+from datetime import datetime
+from django.db import connection, models
 import uuid
 import logging
 from .n8n_manager import N8NWorkflowManager
 from django.http import JsonResponse
 import time
 from documents.models import DocumentUpload
+from documents.task_status import FINISHED_STATUSES, fetch_task_metas, live_task_ids, progress_from_meta
 from documents.tasks import process_document_async
+from documents.ingest import create_uploads, dispatch_indexing
 from messaging.services import WhatsAppService
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -82,39 +89,28 @@ class PatientCreateAPIView(views.APIView):
                 files = request.FILES.getlist('documents')
                 logger.info(f"📄 {len(files)} documents à traiter")
 
-                for file in files:
+                # Insertion groupée puis un seul group Celery (lots par patient)
+                documents, rejected = create_uploads(patient, files)
+                task_ids = {}
+                if documents:
                     try:
-                        # Créer l'entrée document directement
-                        doc = DocumentUpload.objects.create(
-                            patient=patient,
-                            file=file,
-                            original_filename=file.name,
-                            file_size=file.size,
-                            file_type=file.name.split('.')[-1].lower()
-                        )
-                        logger.info(f"📄 Document créé: ID={doc.id}, Nom={file.name}")
-
-                        # Lancer le traitement asynchrone
-                        from documents.tasks import process_document_async
-                        task = process_document_async.delay(doc.id)
-                        doc.celery_task_id = task.id
-                        doc.save(update_fields=['celery_task_id'])
-                        logger.info(f"✅ Tâche Celery envoyée: {task.id}")
-
-                        documents_results.append({
-                            'document_id': doc.id,
-                            'filename': doc.original_filename,
-                            'status': 'pending',
-                            'task_id': task.id
-                        })
-
+                        task_ids = dispatch_indexing(documents)
                     except Exception as e:
-                        logger.error(f"❌ Erreur document {file.name}: {e}")
-                        documents_results.append({
-                            'filename': file.name,
-                            'status': 'error',
-                            'error': str(e)
-                        })
+                        logger.error(f"❌ Erreur envoi des tâches d'indexation: {e}")
+                        DocumentUpload.objects.filter(id__in=[doc.id for doc in documents]).update(
+                            upload_status='failed', error_message=str(e)
+                        )
+                        for doc in documents:
+                            doc.upload_status = 'failed'
+
+                for doc in documents:
+                    documents_results.append({
+                        'document_id': doc.id,
+                        'filename': doc.original_filename,
+                        'status': 'pending' if doc.upload_status == 'pending' else 'error',
+                        'task_id': task_ids.get(doc.id)
+                    })
+                documents_results.extend(rejected)
 
             # 5. Préparer la réponse COMPATIBLE avec le frontend
             # This block is now outside the document processing loop
@@ -277,15 +273,52 @@ class PatientCheckActiveAPIView(views.APIView):
                 "error": "Patient non trouvé"
             })
 
+def _encode_cursor(created_at, pk) -> str:
+    raw = json.dumps([created_at.isoformat(), pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor: str):
+    """Retourne (created_at, id) ou lève ValueError si le curseur est invalide"""
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(pk)
+    except Exception as e:
+        raise ValueError(f"Curseur invalide: {e}")
+
+
+def _approximate_count(queryset) -> int:
+    """
+    Nombre approximatif de lignes sans COUNT(*) : statistiques de la table
+    (pg_class.reltuples) sans filtre, estimation du planificateur sinon.
+    """
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [Patient._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return max(int(row[0]), 0) if row else 0
+    plan = json.loads(queryset.explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
 class PatientListAPIView(views.APIView):
     """
     GET /api/patients/
-    Liste des patients avec pagination et filtres
+    Liste des patients, pagination par curseur sur (created_at, id).
+
+    Paramètres : is_active, search, page_size (max 100), cursor (valeur
+    `next_cursor` de la page précédente), count=approx pour un total estimé.
     """
     permission_classes = [AllowAny]
+    max_page_size = 100
 
     def get(self, request):
-        patients = Patient.objects.all().order_by('-created_at')
+        patients = Patient.objects.annotate(
+            documents_count=models.Count('uploaded_documents')
+        ).order_by('-created_at', '-id')
 
         # Filtres
         is_active = request.GET.get('is_active')
@@ -294,42 +327,61 @@ class PatientListAPIView(views.APIView):
 
         search = request.GET.get('search')
         if search:
+            # icontains -> UPPER(col) LIKE UPPER('%...%') : servi par les index trigramme
             patients = patients.filter(
                 models.Q(first_name__icontains=search) |
                 models.Q(last_name__icontains=search) |
                 models.Q(phone__icontains=search)
             )
 
-        # Pagination simple
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 20))
-        start = (page - 1) * page_size
-        end = start + page_size
-
-        total_count = patients.count()
-        patients_page = patients[start:end]
-
-        # Sérialiser les données
-        data = []
-        for patient in patients_page:
-            data.append({
-                'id': patient.id,
-                'full_name': patient.full_name(),
-                'phone': patient.phone,
-                'email': patient.email,
-                'is_active': patient.is_active,
-                'created_at': patient.created_at,
-                'activated_at': patient.activated_at,
-                'documents_count': patient.documents.count() if hasattr(patient, 'documents') else 0
-            })
+        try:
+            page_size = min(max(int(request.GET.get('page_size', 20)), 1), self.max_page_size)
+        except ValueError:
+            return Response({"detail": "page_size doit être un entier."}, status=status.HTTP_400_BAD_REQUEST)
+
+        total_count = None
+        if request.GET.get('count') == 'approx':
+            total_count = _approximate_count(patients)
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            try:
+                created_at, pk = _decode_cursor(cursor)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            patients = patients.filter(
+                models.Q(created_at__lt=created_at) |
+                models.Q(created_at=created_at, id__lt=pk)
+            )
+
+        # Une ligne de plus pour savoir s'il existe une page suivante
+        rows = list(patients.values(
+            'id', 'first_name', 'last_name', 'phone', 'email',
+            'is_active', 'created_at', 'activated_at', 'documents_count'
+        )[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+        data = [
+            {
+                'id': row['id'],
+                'full_name': f"{row['first_name']} {row['last_name']}",
+                'phone': row['phone'],
+                'email': row['email'],
+                'is_active': row['is_active'],
+                'created_at': row['created_at'],
+                'activated_at': row['activated_at'],
+                'documents_count': row['documents_count'],
+            }
+            for row in rows
+        ]
 
         return Response({
             'results': data,
-            'total_count': total_count,
-            'page': page,
             'page_size': page_size,
-            'has_next': end < total_count,
-            'has_previous': page > 1
+            'has_next': has_next,
+            'next_cursor': _encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_next else None,
+            'total_count': total_count,
         })
 
 class PatientConfirmAPIView(views.APIView):
@@ -376,71 +428,103 @@ class PatientConfirmAPIView(views.APIView):
             return Response({"detail": "Patient non trouvé."}, status=status.HTTP_404_NOT_FOUND)
 
 
+def _etag_response(request, payload, volatile=('last_updated',)):
+    """
+    Réponse avec ETag calculé sur le contenu (hors champs volatils) ;
+    304 si le client possède déjà cette version (If-None-Match).
+    """
+    stable = {key: value for key, value in payload.items() if key not in volatile}
+    digest = hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    etag = quote_etag(digest)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        client_etags = parse_etags(if_none_match)
+        if '*' in client_etags or etag in client_etags or f'W/{etag}' in client_etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+    response = Response(payload)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _document_progress(doc: dict, metas: dict) -> dict:
+    """Progression d'un document : Redis pour les tâches en cours, la ligne sinon"""
+    if doc['upload_status'] in FINISHED_STATUSES:
+        return {
+            'progress': doc['progress'],
+            'task_status': 'SUCCESS' if doc['upload_status'] == 'indexed' else 'FAILURE',
+        }
+    meta = metas.get(doc['celery_task_id'])
+    if meta:
+        return progress_from_meta(meta)
+    if doc['task_status']:
+        return {'progress': doc['progress'], 'task_status': doc['task_status']}
+    return {}
+
+
 class PatientIndexingStatusView(views.APIView):
     """
     GET /api/patients/{patient_id}/indexing-status/
     Obtient le statut d'indexation des documents d'un patient avec plus de détails
+
+    Une requête SQL, un MGET Redis pour les tâches encore en cours, et un
+    ETag : un sondage sans changement reçoit 304.
     """
     permission_classes = [AllowAny]
 
     def get(self, request, patient_id):
         try:
-            patient = Patient.objects.get(id=patient_id)
-            documents = DocumentUpload.objects.filter(patient=patient).select_related('patient')
-            
+            patient = Patient.objects.only('id', 'first_name', 'last_name').get(id=patient_id)
+            documents = list(
+                DocumentUpload.objects.filter(patient_id=patient_id).order_by('id').values(
+                    'id', 'original_filename', 'upload_status', 'error_message', 'uploaded_at',
+                    'processed_at', 'celery_task_id', 'progress', 'task_status'
+                )
+            )
+
             # Calculer les stats
-            total = documents.count()
-            indexed = documents.filter(upload_status='indexed').count()
-            processing = documents.filter(upload_status='processing').count()
-            failed = documents.filter(upload_status='failed').count()
-            pending = documents.filter(upload_status='pending').count()
-            
+            counts = Counter(doc['upload_status'] for doc in documents)
+            total = len(documents)
+            indexed = counts['indexed']
+            failed = counts['failed']
+
             progress = int((indexed / total) * 100) if total > 0 else 0
             is_complete = (indexed + failed) == total and total > 0
-            
-            # Détails des documents avec progression Celery
+
+            # Progression Celery : un seul aller-retour pour toutes les tâches en cours
+            metas = fetch_task_metas(live_task_ids(documents))
+
             documents_data = []
             for doc in documents:
                 doc_data = {
-                    'id': doc.id,
-                    'filename': doc.original_filename,
-                    'status': doc.upload_status,
-                    'error': doc.error_message if doc.error_message else None,
-                    'uploaded_at': doc.uploaded_at.isoformat(),
-                    'processed_at': doc.processed_at.isoformat() if doc.processed_at else None,
+                    'id': doc['id'],
+                    'filename': doc['original_filename'],
+                    'status': doc['upload_status'],
+                    'error': doc['error_message'] or None,
+                    'uploaded_at': doc['uploaded_at'].isoformat(),
+                    'processed_at': doc['processed_at'].isoformat() if doc['processed_at'] else None,
                 }
-                
-                # Ajouter la progression Celery si disponible
-                if hasattr(doc, 'celery_task_id') and doc.celery_task_id:
-                    try:
-                        from celery.result import AsyncResult
-                        result = AsyncResult(doc.celery_task_id)
-                        
-                        if result.state == 'PROGRESS' and isinstance(result.info, dict):
-                            doc_data['progress'] = result.info.get('current', 0)
-                            doc_data['task_status'] = result.info.get('status', '')
-                        elif result.state in ['SUCCESS', 'FAILURE']:
-                            doc_data['task_status'] = result.state
-                            
-                    except Exception as e:
-                        logger.warning(f"Erreur récupération statut Celery pour doc {doc.id}: {e}")
-                
+                doc_data.update(_document_progress(doc, metas))
                 documents_data.append(doc_data)
 
-            return Response({
+            return _etag_response(request, {
                 'patient_id': patient_id,
                 'patient_name': patient.full_name(),
                 'total_documents': total,
                 'indexed': indexed,
-                'processing': processing,
+                'processing': counts['processing'],
                 'failed': failed,
-                'pending': pending,
+                'pending': counts['pending'],
                 'progress': progress,
                 'is_complete': is_complete,
                 'documents': documents_data,
                 'last_updated': timezone.now().isoformat()
             })
-            
+
         except Patient.DoesNotExist:
             return Response(
                 {'error': 'Patient non trouvé'},
@@ -472,16 +556,22 @@ class DocumentIndexingStatusView(views.APIView):
                 'file_size': doc.file_size,
                 'uploaded_at': doc.uploaded_at,
                 'processed_at': doc.processed_at,
-                'error_message': doc.error_message
+                'error_message': doc.error_message,
+                'progress': doc.progress,
             }
 
-            # Vérifier le statut Celery si disponible
-            if hasattr(doc, 'celery_task_id') and doc.celery_task_id:
-                result = AsyncResult(doc.celery_task_id)
-                response_data['task_status'] = result.status
-                response_data['task_info'] = result.info
+            # Statut Celery : seulement tant que le document n'est pas terminé
+            if doc.upload_status in FINISHED_STATUSES:
+                response_data['task_status'] = 'SUCCESS' if doc.upload_status == 'indexed' else 'FAILURE'
+            elif doc.celery_task_id:
+                meta = fetch_task_metas([doc.celery_task_id]).get(doc.celery_task_id)
+                if meta:
+                    response_data['task_status'] = meta.get('status')
+                    response_data['task_info'] = meta.get('result')
+                else:
+                    response_data['task_status'] = doc.task_status or None
 
-            return Response(response_data)
+            return _etag_response(request, response_data, volatile=())
 
         except DocumentUpload.DoesNotExist:
             return Response(
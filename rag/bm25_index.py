@@ -0,0 +1,202 @@
+# rag/bm25_index.py
+"""
+Maintenance des index BM25 (Whoosh) par patient.
+
+Les mises à jour ne sont plus écrites document par document : elles sont
+empilées dans une file Redis par patient, puis une tâche Celery les vide en
+un seul commit. Une tâche périodique fusionne les segments quand un index
+en accumule trop.
+"""
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from whoosh import index as whoosh_index
+from whoosh.analysis import RegexTokenizer, LowercaseFilter
+from whoosh.fields import Schema, TEXT, ID
+
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+FR_ANALYZER = RegexTokenizer(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+") | LowercaseFilter()
+
+QUEUE_KEY = "bm25:pending:patient_{patient_id}"
+SCHEDULED_KEY = "bm25:scheduled:patient_{patient_id}"
+LOCK_KEY = "bm25:lock:patient_{patient_id}"
+
+
+def bm25_schema() -> Schema:
+    return Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
+
+
+def patient_bm25_dir(patient_id) -> str:
+    return os.path.join(settings.RAG_SETTINGS['BM25_INDEX_DIR'], f'patient_{patient_id}_bm25')
+
+
+def open_or_create_index(bm25_dir: str):
+    """Ouvre l'index BM25 du dossier, ou le crée s'il est absent/vide"""
+    os.makedirs(bm25_dir, exist_ok=True)
+    if whoosh_index.exists_in(bm25_dir):
+        try:
+            return whoosh_index.open_dir(bm25_dir)
+        except whoosh_index.EmptyIndexError:
+            logger.warning(f"Index BM25 vide ou corrompu à {bm25_dir}. Recréation.")
+    return whoosh_index.create_in(bm25_dir, bm25_schema())
+
+
+def segment_count(idx) -> int:
+    try:
+        return len(idx._segments())
+    except Exception:
+        return 0
+
+
+def write_documents(bm25_dir: str, items: List[Dict]) -> int:
+    """Écrit un lot de documents dans l'index en un seul commit"""
+    if not items:
+        return 0
+
+    # Dédupliquer par id (la dernière version gagne)
+    latest = {}
+    for item in items:
+        latest[item['id']] = item['content']
+
+    idx = open_or_create_index(bm25_dir)
+    # Attente bornée du verrou Whoosh (vectoriseur, réindexation) : un échec
+    # remonte à l'appelant au lieu d'un commit différé dans un thread muet
+    writer = idx.writer(timeout=settings.RAG_SETTINGS.get('BM25_WRITER_TIMEOUT', 30))
+    try:
+        for doc_id, content in latest.items():
+            writer.update_document(id=doc_id, content=content)
+    except Exception:
+        writer.cancel()
+        raise
+    writer.commit()
+
+    logger.info(f"Index BM25 mis à jour: {len(latest)} documents en un commit ({bm25_dir})")
+    return len(latest)
+
+
+def enqueue_documents(patient_id, metadata: List[Dict]) -> bool:
+    """
+    Ajoute des passages à la file BM25 du patient et programme un flush.
+    Retourne False si Redis est indisponible (l'appelant écrit alors directement).
+    """
+    if not metadata:
+        return True
+
+    rag_settings = settings.RAG_SETTINGS
+    delay = rag_settings.get('BM25_FLUSH_DELAY', 5)
+
+    try:
+        r = get_redis()
+        payload = [json.dumps({'id': m['id'], 'content': m['text']}) for m in metadata]
+        r.rpush(QUEUE_KEY.format(patient_id=patient_id), *payload)
+
+        # Un seul flush programmé par fenêtre, les documents suivants s'y ajoutent
+        schedule_flush(patient_id, delay)
+
+        logger.info(f"{len(payload)} passages ajoutés à la file BM25 du patient {patient_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"File BM25 indisponible pour patient {patient_id}: {e}")
+        return False
+
+
+def schedule_flush(patient_id, delay: float) -> bool:
+    """Programme un flush de la file du patient, sauf si un flush est déjà programmé"""
+    if get_redis().set(SCHEDULED_KEY.format(patient_id=patient_id), 1, nx=True, ex=max(int(delay) * 4, 30)):
+        from documents.tasks import flush_bm25_queue
+        flush_bm25_queue.apply_async(args=[patient_id], countdown=delay)
+        return True
+    return False
+
+
+def update_index(patient_id, metadata: List[Dict]):
+    """Point d'entrée du vectoriseur : file Redis si possible, écriture directe sinon"""
+    if not enqueue_documents(patient_id, metadata):
+        write_documents(patient_bm25_dir(patient_id), [
+            {'id': m['id'], 'content': m['text']} for m in metadata
+        ])
+
+
+def flush_queue(patient_id) -> Optional[int]:
+    """
+    Vide la file du patient dans l'index. Retourne le nombre de documents écrits,
+    ou None si un autre flush détient déjà le verrou.
+    """
+    r = get_redis()
+    r.delete(SCHEDULED_KEY.format(patient_id=patient_id))
+
+    lock = r.lock(LOCK_KEY.format(patient_id=patient_id), timeout=300, blocking_timeout=0)
+    if not lock.acquire(blocking=False):
+        return None
+
+    queue_key = QUEUE_KEY.format(patient_id=patient_id)
+    try:
+        pipe = r.pipeline(transaction=True)
+        pipe.lrange(queue_key, 0, -1)
+        pipe.delete(queue_key)
+        raw_items, _ = pipe.execute()
+
+        items = [json.loads(raw) for raw in raw_items]
+        try:
+            return write_documents(patient_bm25_dir(patient_id), items)
+        except Exception:
+            # Remettre le lot en file pour le prochain flush
+            if raw_items:
+                r.lpush(queue_key, *reversed(raw_items))
+            raise
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def optimize_indexes(max_segments: Optional[int] = None) -> Dict[str, int]:
+    """Fusionne les segments des index qui dépassent le seuil"""
+    if max_segments is None:
+        max_segments = settings.RAG_SETTINGS.get('BM25_MAX_SEGMENTS', 8)
+
+    base_dir = settings.RAG_SETTINGS['BM25_INDEX_DIR']
+    stats = {'checked': 0, 'optimized': 0, 'skipped': 0}
+    if not os.path.isdir(base_dir):
+        return stats
+
+    r = get_redis()
+    for name in os.listdir(base_dir):
+        if not (name.startswith('patient_') and name.endswith('_bm25')):
+            continue
+        bm25_dir = os.path.join(base_dir, name)
+        if not whoosh_index.exists_in(bm25_dir):
+            continue
+
+        stats['checked'] += 1
+        idx = whoosh_index.open_dir(bm25_dir)
+        segments = segment_count(idx)
+        if segments <= max_segments:
+            continue
+
+        patient_id = name[len('patient_'):-len('_bm25')]
+        lock = r.lock(LOCK_KEY.format(patient_id=patient_id), timeout=600, blocking_timeout=0)
+        if not lock.acquire(blocking=False):
+            stats['skipped'] += 1
+            continue
+        try:
+            idx.optimize()
+            stats['optimized'] += 1
+            logger.info(f"Index BM25 {name} optimisé ({segments} segments fusionnés)")
+        except Exception as e:
+            stats['skipped'] += 1
+            logger.warning(f"Optimisation BM25 impossible pour {name}: {e}")
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+    return stats
@@ -0,0 +1,241 @@
+# rag/chunking.py
+"""
+Découpage des passages extraits avant indexation.
+
+Chunking sémantique : les phrases de tous les passages d'un document sont
+encodées en un seul appel (par lots), puis regroupées tant que la phrase
+suivante reste proche du centroïde du chunk courant. Le centroïde est tenu
+comme une somme courante (O(dim) par phrase, sans recalcul de moyenne) et
+l'embedding du chunk en est dérivé : le modèle n'est pas relancé sur le
+texte des chunks.
+
+Chunking par budget de tokens : les phrases sont comptées avec le
+tokenizer de l'embedder (tokenisation rapide, par lot) et regroupées
+jusqu'à CHUNK_SIZE tokens, avec CHUNK_OVERLAP tokens de recouvrement. Un
+chunk ne dépasse jamais la longueur d'entrée du modèle : tout son texte
+est réellement encodé (all-mpnet-base-v2 tronque à 384 tokens).
+
+Sans dépendance Django (utilisable depuis scripts/generate_embeddings.py).
+"""
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?;:])\s+|\n{2,}')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Phrases d'un texte français (Punkt si disponible, sinon ponctuation)"""
+    text = (text or '').strip()
+    if not text:
+        return []
+    try:
+        from nltk.tokenize import sent_tokenize
+        sentences = sent_tokenize(text, language='french')
+    except Exception:
+        sentences = _SENTENCE_RE.split(text)
+    return [sentence.strip() for sentence in sentences if sentence and sentence.strip()]
+
+
+def token_budget(embedder, chunk_size: int) -> int:
+    """Budget effectif : CHUNK_SIZE borné par la longueur d'entrée du modèle (hors [CLS]/[SEP])"""
+    max_seq = getattr(embedder, 'max_seq_length', None) or chunk_size + 2
+    return max(1, min(chunk_size, max_seq - 2))
+
+
+def _split_units(texts: List[str], tokenizer, max_tokens: int) -> List[List[Tuple[str, int]]]:
+    """
+    Tokenise toutes les phrases en un appel et retourne, par phrase, des
+    morceaux (texte, nb de tokens) de max_tokens au plus. Une phrase trop
+    longue est coupée sur les offsets du tokenizer rapide (sur les mots
+    sinon).
+    """
+    if not texts:
+        return []
+    fast = getattr(tokenizer, 'is_fast', False)
+    encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=fast,
+                        return_attention_mask=False, return_token_type_ids=False)
+
+    units = []
+    for i, text in enumerate(texts):
+        ids = encoded['input_ids'][i]
+        if len(ids) <= max_tokens:
+            units.append([(text, len(ids))])
+            continue
+        pieces = []
+        if fast:
+            offsets = encoded['offset_mapping'][i]
+            for start in range(0, len(ids), max_tokens):
+                window = offsets[start:start + max_tokens]
+                piece = text[window[0][0]:window[-1][1]].strip()
+                if piece:
+                    pieces.append((piece, len(window)))
+        else:
+            words = text.split()
+            per_piece = max(1, len(words) * max_tokens // len(ids))
+            for start in range(0, len(words), per_piece):
+                pieces.append((' '.join(words[start:start + per_piece]), max_tokens))
+        units.append(pieces)
+    return units
+
+
+def token_chunk_passages(passages: List[Dict], tokenizer, chunk_size: int, overlap: int) -> List[Dict]:
+    """
+    Découpe chaque passage {'source', 'page', 'text'} en chunks d'au plus
+    chunk_size tokens, coupés entre phrases. Les dernières phrases d'un
+    chunk (jusqu'à `overlap` tokens) ouvrent le suivant.
+    """
+    sentences_per_passage = [split_sentences(passage['text']) for passage in passages]
+    all_sentences = [sentence for sentences in sentences_per_passage for sentence in sentences]
+    all_units = _split_units(all_sentences, tokenizer, chunk_size)
+
+    chunked = []
+    offset = 0
+    for passage, sentences in zip(passages, sentences_per_passage):
+        units = [unit for pieces in all_units[offset:offset + len(sentences)] for unit in pieces]
+        offset += len(sentences)
+
+        window: List[Tuple[str, int]] = []
+        tokens = 0
+        fresh = 0  # Unités ajoutées depuis le dernier chunk émis
+        for text, n_tokens in units:
+            if window and tokens + n_tokens > chunk_size:
+                chunked.append({**passage, 'text': ' '.join(t for t, _ in window)})
+                # Recouvrement : garder la fin du chunk, sans dépasser overlap
+                kept, kept_tokens = [], 0
+                for unit in reversed(window):
+                    if kept_tokens + unit[1] > overlap or kept_tokens + unit[1] + n_tokens > chunk_size:
+                        break
+                    kept.insert(0, unit)
+                    kept_tokens += unit[1]
+                window, tokens, fresh = kept, kept_tokens, 0
+            window.append((text, n_tokens))
+            tokens += n_tokens
+            fresh += 1
+        if window and fresh:
+            chunked.append({**passage, 'text': ' '.join(t for t, _ in window)})
+
+    logger.info(f"Chunking par tokens: {len(passages)} passages -> {len(chunked)} chunks "
+                f"(≤{chunk_size} tokens, recouvrement {overlap})")
+    return chunked
+
+
+def encode_normalized(embedder, texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Encodage par lots, vecteurs normalisés L2 (float32)"""
+    if not texts:
+        dim = embedder.get_sentence_embedding_dimension()
+        return np.zeros((0, dim), dtype='float32')
+    vectors = embedder.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                              normalize_embeddings=True, show_progress_bar=False)
+    return np.asarray(vectors, dtype='float32')
+
+
+def _chunk_sentences(sentences: List[str], vectors: np.ndarray, threshold: float,
+                     max_sentences: int, lengths: Optional[List[int]] = None,
+                     max_tokens: Optional[int] = None) -> List[Dict]:
+    """Regroupe les phrases consécutives d'un passage ; retourne [{'text', 'embedding'}]"""
+    chunks = []
+    chunk_sents: List[str] = []
+    centroid_sum = None
+    tokens = 0
+    lengths = lengths or [0] * len(sentences)
+
+    def close_chunk():
+        norm = np.linalg.norm(centroid_sum)
+        chunks.append({
+            'text': ' '.join(chunk_sents),
+            'embedding': (centroid_sum / norm if norm else centroid_sum).astype('float32'),
+        })
+
+    for sentence, vec, n_tokens in zip(sentences, vectors, lengths):
+        if centroid_sum is None:
+            chunk_sents, centroid_sum, tokens = [sentence], vec.astype('float64').copy(), n_tokens
+            continue
+        # Cosinus avec le centroïde normalisé : dot(vec, somme) / ||somme||
+        norm = np.linalg.norm(centroid_sum)
+        similarity = float(np.dot(vec, centroid_sum) / norm) if norm else 0.0
+        fits = tokens + n_tokens <= max_tokens if max_tokens else len(chunk_sents) < max_sentences
+        if similarity >= threshold and fits:
+            chunk_sents.append(sentence)
+            centroid_sum += vec
+            tokens += n_tokens
+        else:
+            close_chunk()
+            chunk_sents, centroid_sum, tokens = [sentence], vec.astype('float64').copy(), n_tokens
+
+    if centroid_sum is not None:
+        close_chunk()
+    return chunks
+
+
+def semantic_chunk_passages(passages: List[Dict], embedder, threshold: float = 0.75,
+                            batch_size: int = 64, max_sentences: int = 12,
+                            max_tokens: Optional[int] = None) -> List[Dict]:
+    """
+    Découpe chaque passage {'source', 'page', 'text'} en chunks sémantiques.
+    Chaque chunk garde source et page et porte son embedding normalisé
+    ('embedding'), dérivé des embeddings de ses phrases. Avec max_tokens,
+    la taille d'un chunk est bornée en tokens (tokenizer de l'embedder)
+    plutôt qu'en nombre de phrases.
+    """
+    sentences_per_passage = [split_sentences(passage['text']) for passage in passages]
+    lengths_per_passage = [None] * len(passages)
+    if max_tokens:
+        all_units = _split_units(
+            [sentence for sentences in sentences_per_passage for sentence in sentences],
+            embedder.tokenizer, max_tokens
+        )
+        offset = 0
+        for i, sentences in enumerate(sentences_per_passage):
+            units = [unit for pieces in all_units[offset:offset + len(sentences)] for unit in pieces]
+            offset += len(sentences)
+            sentences_per_passage[i] = [text for text, _ in units]
+            lengths_per_passage[i] = [n_tokens for _, n_tokens in units]
+    all_sentences = [sentence for sentences in sentences_per_passage for sentence in sentences]
+    vectors = encode_normalized(embedder, all_sentences, batch_size)
+
+    chunked = []
+    offset = 0
+    for passage, sentences, lengths in zip(passages, sentences_per_passage, lengths_per_passage):
+        passage_vectors = vectors[offset:offset + len(sentences)]
+        offset += len(sentences)
+        for chunk in _chunk_sentences(sentences, passage_vectors, threshold, max_sentences,
+                                      lengths, max_tokens):
+            chunked.append({**passage, **chunk})
+
+    logger.info(f"Chunking sémantique: {len(passages)} passages -> {len(chunked)} chunks "
+                f"({len(all_sentences)} phrases encodées en un lot)")
+    return chunked
+
+
+def chunk_text_passages(passages: List[Dict], model, chunk_size: int, overlap: int,
+                        semantic: bool = False, threshold: float = 0.75) -> List[Dict]:
+    """
+    Chunking de l'indexation (DocumentVectorizer, benchmark) : sémantique ou
+    par budget de tokens, chunks bornés à la longueur d'entrée du modèle.
+    """
+    max_tokens = token_budget(model, chunk_size)
+    if semantic:
+        return semantic_chunk_passages(passages, model, threshold=threshold, max_tokens=max_tokens)
+    return token_chunk_passages(passages, model.tokenizer, max_tokens, min(overlap, max_tokens // 2))
+
+
+def passage_vectors(passages: List[Dict], embedder, batch_size: int = 32) -> np.ndarray:
+    """
+    Vecteurs normalisés des passages : l'embedding déjà calculé par le
+    chunking est réutilisé, seuls les autres passages sont encodés (un lot).
+    """
+    missing = [i for i, passage in enumerate(passages) if passage.get('embedding') is None]
+    encoded = encode_normalized(embedder, [passages[i]['text'] for i in missing], batch_size)
+    dim = embedder.get_sentence_embedding_dimension()
+    vectors = np.zeros((len(passages), dim), dtype='float32')
+    for i, passage in enumerate(passages):
+        if passage.get('embedding') is not None:
+            vectors[i] = passage['embedding']
+    if missing:
+        vectors[missing] = encoded
+    return vectors
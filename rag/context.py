@@ -0,0 +1,123 @@
+# rag/context.py
+"""
+Assemblage du contexte envoyé au LLM.
+
+Les passages retrouvés sont regroupés par (document, source, page) : les
+chunks consécutifs d'une même page sont fusionnés (le recouvrement du
+chunking n'est gardé qu'une fois) et les doublons écartés. Les blocs sont
+ensuite pris par score décroissant jusqu'au budget de tokens du prompt ;
+le dernier bloc est tronqué sur une fin de phrase plutôt qu'au caractère.
+
+Le nombre de tokens est estimé (CHARS_PER_TOKEN caractères par token) :
+le tokenizer de Gemini n'est pas disponible localement.
+"""
+import re
+from typing import Dict, List, Optional
+
+CHARS_PER_TOKEN = 4
+MIN_TRUNCATED_TOKENS = 40  # En dessous, un bloc tronqué n'apporte rien
+_CHUNK_ID_RE = re.compile(r'_c(\d+)$')
+_SENTENCE_END_RE = re.compile(r'[.!?;:\n]')
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _passage_text(ctx: Dict) -> str:
+    return (ctx.get('original_text') or ctx.get('text') or ctx.get('text_representation') or '').strip()
+
+
+def _chunk_index(ctx: Dict) -> Optional[int]:
+    if ctx.get('chunk_index') is not None:
+        return int(ctx['chunk_index'])
+    match = _CHUNK_ID_RE.search(str(ctx.get('id', '')))
+    return int(match.group(1)) if match else None
+
+
+def _merge_text(left: str, right: str) -> str:
+    """Concatène deux chunks consécutifs sans répéter leur recouvrement"""
+    if right in left:
+        return left
+    probe = right.split(None, 1)[0]
+    pos = left.find(probe)
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return left[:pos] + right
+        pos = left.find(probe, pos + 1)
+    return f"{left} {right}"
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Coupe à la dernière fin de phrase dans le budget"""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    ends = [m.end() for m in _SENTENCE_END_RE.finditer(head)]
+    if ends and ends[-1] > limit // 2:
+        return head[:ends[-1]].rstrip()
+    return head.rsplit(' ', 1)[0] + '…'
+
+
+def assemble_context(contexts: List[Dict], max_tokens: int = 1500) -> List[Dict]:
+    """
+    Dédoublonne, fusionne et borne les passages retrouvés.
+    Retourne des blocs {'file_name', 'type', 'page', 'score', 'text'} par
+    score décroissant, dont le texte total tient dans max_tokens.
+    """
+    groups: Dict[tuple, List[Dict]] = {}
+    seen_texts = set()
+    for ctx in contexts:
+        text = _passage_text(ctx)
+        if not text or text in seen_texts:
+            continue
+        seen_texts.add(text)
+        key = (ctx.get('document_id') or ctx.get('file_name'), ctx.get('type'), ctx.get('page'))
+        groups.setdefault(key, []).append({**ctx, 'text': text, 'score': float(ctx.get('score', 0.0))})
+
+    blocks = []
+    for passages in groups.values():
+        passages.sort(key=lambda p: (_chunk_index(p) is None, _chunk_index(p) or 0))
+        current = None
+        for passage in passages:
+            index = _chunk_index(passage)
+            if current is not None and index is not None and current['last_index'] is not None \
+                    and index == current['last_index'] + 1:
+                current['text'] = _merge_text(current['text'], passage['text'])
+                current['score'] = max(current['score'], passage['score'])
+                current['last_index'] = index
+                continue
+            if current is not None and passage['text'] in current['text']:
+                continue
+            current = {
+                'file_name': passage.get('file_name', 'Document'),
+                'type': passage.get('type', 'document'),
+                'page': passage.get('page', '?'),
+                'score': passage['score'],
+                'text': passage['text'],
+                'last_index': index,
+            }
+            blocks.append(current)
+
+    blocks.sort(key=lambda b: b['score'], reverse=True)
+
+    selected, remaining = [], max_tokens
+    for block in blocks:
+        block.pop('last_index', None)
+        cost = estimate_tokens(block['text'])
+        if cost > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                break
+            block['text'] = truncate_to_tokens(block['text'], remaining)
+            cost = estimate_tokens(block['text'])
+        selected.append(block)
+        remaining -= cost
+    return selected
+
+
+def format_context(blocks: List[Dict]) -> str:
+    return "\n".join(
+        f"- {block['file_name']} ({block['type']}, page {block['page']}): {block['text']}"
+        for block in blocks
+    )
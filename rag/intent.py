@@ -0,0 +1,122 @@
+# rag/intent.py
+"""
+Routage d'intention devant le pipeline RAG.
+
+Les messages qui n'ont pas besoin des documents (salutations,
+remerciements et au revoir, liste des documents, activation, aide) reçoivent une réponse immédiate ; seules les
+vraies questions médicales passent par la recherche et Gemini.
+
+Deux étages :
+1. Règles par mots-clés (regex), sans modèle : décident la plupart des cas.
+2. Sinon, similarité cosinus entre la question et des phrases prototypes
+   de chaque intention, encodées une fois avec l'embedder déjà chargé.
+   Une intention hors 'medical' n'est retenue qu'au-dessus d'un seuil et
+   avec une marge sur les prototypes médicaux : en cas de doute, la
+   question va au RAG.
+"""
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MEDICAL = 'medical'
+GREETING = 'greeting'
+THANKS = 'thanks'
+DOCUMENTS = 'documents'
+ACTIVATION = 'activation'
+HELP = 'help'
+
+PROTOTYPES: Dict[str, List[str]] = {
+    GREETING: [
+        "bonjour", "salut", "bonsoir", "coucou", "hello", "bonjour comment allez-vous",
+    ],
+    THANKS: [
+        "merci", "merci beaucoup", "merci bonne journée", "merci pour votre aide",
+        "au revoir", "à bientôt", "bonne soirée",
+    ],
+    DOCUMENTS: [
+        "quels sont mes documents", "liste de mes documents", "montre-moi mes fichiers",
+        "quels fichiers avez-vous dans mon dossier", "quels documents sont disponibles",
+    ],
+    ACTIVATION: [
+        "comment activer mon compte", "je veux activer mon compte",
+        "j'ai reçu un code d'activation", "mon compte n'est pas activé",
+    ],
+    HELP: [
+        "aide", "que peux-tu faire", "comment ça marche", "à quoi sers-tu",
+        "quelles questions puis-je poser",
+    ],
+    MEDICAL: [
+        "quels sont mes derniers résultats d'analyse", "quelle est ma posologie",
+        "que dit mon compte rendu", "mon taux de cholestérol est-il normal",
+        "quand dois-je prendre mon médicament", "résume mon dernier rapport médical",
+        "quel est le diagnostic du médecin", "est-ce que ma tension est trop élevée",
+    ],
+}
+
+_GREETING_WORDS = r"(bonjour|bonsoir|salut|coucou|hello|hi)"
+_THANKS_WORDS = r"(merci( beaucoup| bien)?|bonne (journée|soirée)|au revoir|à bientôt|a bientot|bye)"
+_RULES = [
+    (GREETING, re.compile(rf"^\W*({_GREETING_WORDS}\W*)+(docteur|doc)?\W*$", re.IGNORECASE)),
+    (THANKS, re.compile(rf"^\W*({_THANKS_WORDS}\W*)+(docteur|doc)?\W*$", re.IGNORECASE)),
+    (DOCUMENTS, re.compile(
+        r"^\W*(quels?|liste[rz]?|montre[rz]?|voir|affiche[rz]?)?\W*(sont|de|des|moi|-moi)?\W*"
+        r"(mes|les)\s+(documents?|fichiers?|dossiers?)\W*(disponibles?)?\W*$", re.IGNORECASE)),
+    (ACTIVATION, re.compile(r"\b(activer|activation)\b.*\b(compte|code)\b|^\W*activer\W*$", re.IGNORECASE)),
+    (HELP, re.compile(r"^\W*(aide|help|menu|\?|que (peux|sais)[- ]tu faire|comment (ça|ca) marche)\W*$",
+                      re.IGNORECASE)),
+]
+
+
+class Intent:
+    def __init__(self, name: str, confidence: float, method: str):
+        self.name = name
+        self.confidence = confidence
+        self.method = method  # 'rule' | 'embedding' | 'default'
+
+    @property
+    def needs_rag(self) -> bool:
+        return self.name == MEDICAL
+
+
+def classify_by_rules(message: str) -> Optional[Intent]:
+    for name, pattern in _RULES:
+        if pattern.search(message.strip()):
+            return Intent(name, 1.0, 'rule')
+    return None
+
+
+class IntentClassifier:
+    """Classifieur par prototypes ; la matrice des prototypes est encodée une seule fois"""
+
+    def __init__(self, model, threshold: float = 0.72, margin: float = 0.05, max_words: int = 12):
+        self.model = model
+        self.threshold = threshold
+        self.margin = margin
+        # Au-delà, un message est traité comme une question médicale sans encodage
+        self.max_words = max_words
+        self.labels = [name for name, phrases in PROTOTYPES.items() for _ in phrases]
+        self.matrix = self._encode([phrase for phrases in PROTOTYPES.values() for phrase in phrases])
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False),
+            dtype='float32'
+        )
+
+    def classify(self, message: str) -> Intent:
+        rule = classify_by_rules(message)
+        if rule is not None:
+            return rule
+        if not message.strip() or len(message.split()) > self.max_words:
+            return Intent(MEDICAL, 0.0, 'default')
+
+        similarities = self.matrix @ self._encode([message])[0]
+        best: Dict[str, float] = {}
+        for label, similarity in zip(self.labels, similarities.tolist()):
+            best[label] = max(best.get(label, -1.0), similarity)
+
+        name = max(best, key=best.get)
+        if name != MEDICAL and best[name] >= self.threshold and best[name] - best[MEDICAL] >= self.margin:
+            return Intent(name, best[name], 'embedding')
+        return Intent(MEDICAL, best[MEDICAL], 'embedding')
@@ -0,0 +1,229 @@
+# rag/reindex.py
+"""
+Réindexation complète sans interruption (blue/green par patient).
+
+Pour chaque patient, un nouveau store (HDF5/FAISS + BM25) est construit à
+côté du store en service, dans des dossiers `<dossier>__<run_id>`, avec le
+modèle d'embedding cible, pour les documents présents dans le store en
+service (lus avec sa génération). Si l'un d'eux ne peut pas être repris,
+le patient est en échec et rien n'est basculé. La bascule se fait ensuite sous le verrou du
+patient : le store en service est remplacé par une écriture atomique
+(nouvelle génération, rechargée par les caches), l'index BM25 par un
+renommage de dossier. Si le store a changé pendant la construction
+(document indexé entre-temps), le patient est reconstruit.
+
+L'avancement est enregistré par patient dans Redis (hash
+`reindex:<run_id>`) : relancer avec le même run_id reprend où l'on
+s'était arrêté.
+"""
+import os
+import shutil
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.redis_client import get_redis
+from . import bm25_index, store_writer
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = "reindex:{run_id}"
+CHECKPOINT_TTL = 30 * 24 * 3600
+STALE_RETRIES = 3
+
+
+class Checkpoint:
+    """Statut par patient d'une réindexation (done / failed:<raison>)"""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.key = CHECKPOINT_KEY.format(run_id=run_id)
+
+    def statuses(self) -> Dict[int, str]:
+        return {int(k): v.decode('utf-8') for k, v in get_redis().hgetall(self.key).items()}
+
+    def done(self) -> set:
+        return {patient_id for patient_id, status in self.statuses().items() if status == 'done'}
+
+    def mark(self, patient_id, status: str):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(self.key, str(patient_id), status)
+        pipe.expire(self.key, CHECKPOINT_TTL)
+        pipe.execute()
+
+
+class StagingError(Exception):
+    """Le store de staging ne couvre pas tous les documents du store en service"""
+
+
+def staging_vector_dir(patient_id, run_id: str) -> str:
+    return f"{store_writer.patient_vector_dir(patient_id)}__{run_id}"
+
+
+def staging_bm25_dir(patient_id, run_id: str) -> str:
+    return f"{bm25_index.patient_bm25_dir(patient_id)}__{run_id}"
+
+
+def _discard(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def live_documents(patient_id) -> Tuple[int, List[int]]:
+    """
+    Génération et documents du store en service, lus ensemble sous le verrou
+    du patient. Les documents viennent des métadonnées du store (document_id)
+    et non de upload_status : un document est écrit dans le store avant
+    d'être marqué 'indexed'.
+    """
+    live_dir = store_writer.patient_vector_dir(patient_id)
+    with store_writer.PatientStoreLock(patient_id):
+        generation = store_writer.read_generation(live_dir)
+        metadata = store_writer.load_metadata(live_dir)
+    document_ids = sorted({int(meta['document_id']) for meta in metadata if meta.get('document_id')})
+    return generation, document_ids
+
+
+def build_staging_store(vectorizer, patient_id, run_id: str) -> Dict:
+    """
+    Construit le store du patient dans les dossiers de staging à partir des
+    fichiers sources des documents du store en service. Retourne
+    {'generation': génération en service au début, 'documents': n, 'vectors': n}.
+    Lève StagingError si un document ne peut pas être repris : le store en
+    service n'est alors pas remplacé.
+    """
+    from documents.models import DocumentUpload
+
+    live_generation, document_ids = live_documents(patient_id)
+    documents = list(DocumentUpload.objects.filter(patient_id=patient_id, id__in=document_ids).order_by('id'))
+    missing = set(document_ids) - {doc_upload.id for doc_upload in documents}
+    if missing:
+        raise StagingError(f"documents du store introuvables: {sorted(missing)}")
+
+    metadata: List[Dict] = []
+    passages_all: List[Dict] = []
+    failed = {}
+    for doc_upload in documents:
+        try:
+            passages = vectorizer._extract_passages(doc_upload)
+        except Exception as e:
+            failed[doc_upload.id] = str(e)
+            continue
+        metadata.extend(vectorizer._passage_metadata(doc_upload, patient_id, passages))
+        passages_all.extend(passages)
+    if failed:
+        # Un document absent du nouveau store disparaîtrait de la recherche : pas de bascule
+        raise StagingError(f"extraction impossible pour les documents {sorted(failed)}: "
+                           f"{next(iter(failed.values()))}")
+
+    vector_dir = staging_vector_dir(patient_id, run_id)
+    bm25_dir = staging_bm25_dir(patient_id, run_id)
+    _discard(vector_dir)
+    _discard(bm25_dir)
+
+    if metadata:
+        # Embeddings du chunking réutilisés, les autres passages encodés en un lot
+        vectors = vectorizer.encode_passages(passages_all)
+        store_writer.write_store(vector_dir, vectors, metadata)
+        if settings.RAG_SETTINGS.get('USE_BM25', True):
+            bm25_index.write_documents(bm25_dir, [{'id': m['id'], 'content': m['text']} for m in metadata])
+
+    return {'generation': live_generation, 'documents': len(documents), 'vectors': len(metadata)}
+
+
+def switch_over(patient_id, run_id: str, expected_generation: int) -> bool:
+    """
+    Remplace le store en service par le store de staging. Retourne False si
+    le store en service a changé depuis le début de la construction.
+    """
+    live_dir = store_writer.patient_vector_dir(patient_id)
+    vector_dir = staging_vector_dir(patient_id, run_id)
+    bm25_dir = staging_bm25_dir(patient_id, run_id)
+
+    with store_writer.PatientStoreLock(patient_id):
+        if store_writer.read_generation(live_dir) != expected_generation:
+            return False
+
+        vectors, metadata = store_writer.load_store(vector_dir)
+        if len(metadata):
+            # Écriture atomique (os.replace) et nouvelle génération : les caches rechargent
+            store_writer.write_store(live_dir, vectors, metadata)
+
+        if os.path.isdir(bm25_dir):
+            live_bm25 = bm25_index.patient_bm25_dir(patient_id)
+            old_bm25 = f"{live_bm25}__old_{run_id}"
+            lock = get_redis().lock(bm25_index.LOCK_KEY.format(patient_id=patient_id),
+                                    timeout=120, blocking_timeout=60)
+            if not lock.acquire():
+                raise TimeoutError(f"Verrou BM25 du patient {patient_id} non obtenu")
+            try:
+                if os.path.isdir(live_bm25):
+                    os.rename(live_bm25, old_bm25)
+                os.rename(bm25_dir, live_bm25)
+            finally:
+                lock.release()
+            _discard(old_bm25)
+
+    _discard(vector_dir)
+    return True
+
+
+def reindex_patient(vectorizer, patient_id, run_id: str) -> str:
+    """Construit puis bascule un patient. Retourne le statut de checkpoint."""
+    for attempt in range(1, STALE_RETRIES + 1):
+        try:
+            built = build_staging_store(vectorizer, patient_id, run_id)
+        except StagingError as e:
+            logger.error(f"Réindexation du patient {patient_id} abandonnée, store en service conservé: {e}")
+            return f"failed:{e}"
+        if switch_over(patient_id, run_id, built['generation']):
+            logger.info(f"Patient {patient_id} réindexé: {built['vectors']} vecteurs ({built['documents']} documents)")
+            return 'done'
+        logger.info(f"Store du patient {patient_id} modifié pendant la construction, nouvel essai ({attempt})")
+    return 'failed:store modifié pendant la construction'
+
+
+# ---------------------------
+# Exécution (pool de processus ou workers Celery)
+# ---------------------------
+_vectorizers = {}
+
+
+def get_vectorizer(embedder_name: str):
+    """Vectoriseur du modèle cible, chargé une fois par processus"""
+    if embedder_name not in _vectorizers:
+        import sys
+        scripts_dir = os.path.join(settings.BASE_DIR, 'scripts')
+        if scripts_dir not in sys.path:
+            sys.path.append(scripts_dir)
+        from vectorize_single_document import DocumentVectorizer
+        _vectorizers[embedder_name] = DocumentVectorizer(embedder_name)
+    return _vectorizers[embedder_name]
+
+
+def pool_initializer(embedder_name: str):
+    # Processus forké : ne pas réutiliser les connexions du parent
+    from django.db import connections
+    connections.close_all()
+    get_vectorizer(embedder_name)
+
+
+def run_patient(patient_id, run_id: str, embedder_name: str) -> str:
+    """Réindexe un patient et enregistre le checkpoint. Retourne le statut."""
+    try:
+        status = reindex_patient(get_vectorizer(embedder_name), patient_id, run_id)
+    except Exception as e:
+        logger.exception(f"Réindexation du patient {patient_id} échouée: {e}")
+        status = f"failed:{e}"
+    Checkpoint(run_id).mark(patient_id, status)
+    return status
+
+
+def live_queue_depth(queues: Optional[List[str]] = None) -> int:
+    """Messages en attente dans les queues Celery du trafic (indexation, temps réel)"""
+    queues = queues or ['cpu', 'realtime']
+    pipe = get_redis().pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    return sum(pipe.execute())
@@ -0,0 +1,161 @@
+# rag/runtime.py
+"""
+Caches par processus pour le chemin de requête RAG : modèles chargés une
+seule fois, stores patients rechargés seulement quand leur génération change.
+"""
+import os
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+
+from core import tracing
+from metrics.registry import (
+    RAG_STORE_CACHE, RAG_STORE_CACHED, RAG_STORE_VECTORS, MODEL_LOAD_SECONDS
+)
+
+from .store_writer import patient_vector_dir, read_generation, HDF5_NAME
+from .bm25_index import patient_bm25_dir
+from .your_rag_module import (
+    VectorStoreHDF5, EmbeddingGenerator, HybridRetriever, GeminiLLM
+)
+from sentence_transformers import CrossEncoder
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_embedders = {}
+_cross_encoders = {}
+_llms = {}
+_stores: "OrderedDict[str, tuple]" = OrderedDict()
+_executor: Optional[ThreadPoolExecutor] = None
+_intent_classifier = None
+
+
+def get_embedder(model_name: Optional[str] = None) -> EmbeddingGenerator:
+    model_name = model_name or settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
+    with _lock:
+        if model_name not in _embedders:
+            logger.info(f"Chargement de l'embedder {model_name}")
+            with MODEL_LOAD_SECONDS.time(model=model_name):
+                _embedders[model_name] = EmbeddingGenerator(model_name)
+        return _embedders[model_name]
+
+
+def get_cross_encoder(model_name: Optional[str] = None) -> CrossEncoder:
+    model_name = model_name or settings.RAG_SETTINGS.get('RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+    with _lock:
+        if model_name not in _cross_encoders:
+            logger.info(f"Chargement du CrossEncoder {model_name}")
+            with MODEL_LOAD_SECONDS.time(model=model_name):
+                _cross_encoders[model_name] = CrossEncoder(model_name)
+        return _cross_encoders[model_name]
+
+
+def get_llm(model_name: Optional[str] = None) -> GeminiLLM:
+    model_name = model_name or settings.RAG_SETTINGS.get('LLM_MODEL', 'gemini-1.5-flash-latest')
+    with _lock:
+        if model_name not in _llms:
+            _llms[model_name] = GeminiLLM(model_name=model_name)
+        return _llms[model_name]
+
+
+def get_intent_classifier():
+    """Routeur d'intention sur l'embedder déjà chargé (prototypes encodés une fois)"""
+    global _intent_classifier
+    from .intent import IntentClassifier
+    with _lock:
+        if _intent_classifier is None:
+            _intent_classifier = IntentClassifier(
+                get_embedder().model,
+                threshold=settings.RAG_SETTINGS.get('INTENT_THRESHOLD', 0.72)
+            )
+        return _intent_classifier
+
+
+def get_patient_store(patient_id) -> Optional[VectorStoreHDF5]:
+    """
+    Retourne le store du patient, rechargé seulement si sa version a changé.
+    La version est (génération, mtime du HDF5) : une lecture de fichier et un stat.
+    """
+    vector_dir = patient_vector_dir(patient_id)
+    hdf5_path = os.path.join(vector_dir, HDF5_NAME)
+    try:
+        version = (read_generation(vector_dir), os.stat(hdf5_path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+    key = str(patient_id)
+    with _lock:
+        cached = _stores.get(key)
+        if cached and cached[0] == version:
+            _stores.move_to_end(key)
+            tracing.set_attribute('store_cache_hit', True)
+            RAG_STORE_CACHE.inc(result='hit')
+            return cached[1]
+    tracing.set_attribute('store_cache_hit', False)
+    RAG_STORE_CACHE.inc(result='miss')
+
+    store = VectorStoreHDF5(hdf5_path)
+    store.load_store()
+
+    with _lock:
+        _stores[key] = (version, store)
+        _stores.move_to_end(key)
+        max_size = settings.RAG_SETTINGS.get('STORE_CACHE_SIZE', 64)
+        while len(_stores) > max_size:
+            _stores.popitem(last=False)
+        RAG_STORE_CACHED.set(len(_stores))
+        RAG_STORE_VECTORS.set(sum(len(cached_store.meta) for _, cached_store in _stores.values()))
+    logger.info(f"Store patient {patient_id} chargé (génération {version[0]})")
+    return store
+
+
+def build_retriever(patient_id, store: VectorStoreHDF5) -> HybridRetriever:
+    """Retriever hybride du patient avec les modèles partagés du processus"""
+    rag_settings = settings.RAG_SETTINGS
+    # Le modèle qui a produit le store (peut différer de EMBEDDING_MODEL après une réindexation)
+    embedders = Counter(meta.get('embedder') for meta in store.meta if meta.get('embedder'))
+    if len(embedders) > 1:
+        logger.error(f"Store du patient {patient_id} encodé avec plusieurs modèles {dict(embedders)} : "
+                     f"réindexation nécessaire (manage.py reindex --patients {patient_id})")
+    embedder = get_embedder(embedders.most_common(1)[0][0] if embedders else None)
+    bm25_dir = patient_bm25_dir(patient_id)
+
+    if rag_settings.get('USE_BM25', True) and os.path.exists(bm25_dir):
+        retriever = HybridRetriever(store, embedder, bm25_dir)
+    else:
+        retriever = HybridRetriever(store, embedder)
+
+    if retriever.bm25_idx and rag_settings.get('USE_RERANKING', True):
+        retriever.cross_encoder = get_cross_encoder()
+    return retriever
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Pool borné pour le travail bloquant du chemin async (chargement de store,
+    embedding, FAISS, BM25) : au plus RAG_SETTINGS['CPU_THREADS'] requêtes
+    calculent en même temps, les autres attendent sans occuper de thread.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RAG_SETTINGS.get('CPU_THREADS', 4),
+                thread_name_prefix='rag-cpu'
+            )
+        return _executor
+
+
+async def run_blocking(func, *args):
+    """Exécute `func(*args)` dans le pool RAG en conservant le contexte (traces)"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await loop.run_in_executor(get_executor(), call)
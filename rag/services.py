@@ -49,13 +49,14 @@ class EmbeddingService:
     def __init__(self):
         genai.configure(api_key=settings.GEMINI_API_KEY)
         
-    def generate_embedding(self, text: str) -> List[float]:
+    def generate_embedding(self, text: str, timeout: Optional[float] = None) -> List[float]:
         """Génère un embedding pour un texte donné"""
         try:
             response = genai.embed_content(
                 model="models/embedding-001",
                 content=text,
-                task_type="retrieval_document"
+                task_type="retrieval_document",
+                request_options={'timeout': timeout} if timeout else None
             )
             return response['embedding']
         except Exception as e:
@@ -0,0 +1,183 @@
+# rag/store_writer.py
+"""
+Écriture concurrente sûre du vector store d'un patient (HDF5 + FAISS).
+
+- Un verrou par patient (Redis, ou verrou fichier si Redis est absent)
+  sérialise les cycles lecture → ajout → écriture des workers Celery.
+- Les fichiers sont écrits dans des fichiers temporaires du même dossier
+  puis basculés avec os.replace : un lecteur voit l'ancienne ou la nouvelle
+  version, jamais un fichier à moitié écrit.
+- Un numéro de génération croissant (fichier `generation` + attribut HDF5)
+  permet aux lecteurs et aux caches de détecter une nouvelle version.
+"""
+import os
+import json
+import fcntl
+import logging
+import tempfile
+from typing import List, Dict, Tuple
+
+import numpy as np
+import h5py
+import faiss
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HDF5_NAME = 'vector_store.h5'
+FAISS_NAME = 'vector_store.faiss'
+GENERATION_NAME = 'generation'
+LOCK_KEY = "vector_store:lock:patient_{patient_id}"
+
+
+def patient_vector_dir(patient_id) -> str:
+    return os.path.join(settings.RAG_SETTINGS['VECTOR_STORE_DIR'], f'patient_{patient_id}')
+
+
+def read_generation(vector_dir: str) -> int:
+    """Lit la génération courante du store (0 si jamais écrit par le writer)"""
+    try:
+        with open(os.path.join(vector_dir, GENERATION_NAME)) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _atomic_write_text(path: str, content: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PatientStoreLock:
+    """Verrou exclusif sur le store d'un patient (Redis, repli sur flock)"""
+
+    def __init__(self, patient_id, timeout: int = 600, blocking_timeout: int = 300):
+        self.patient_id = patient_id
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self._redis_lock = None
+        self._file = None
+
+    def __enter__(self):
+        try:
+            from core.redis_client import get_redis
+            lock = get_redis().lock(
+                LOCK_KEY.format(patient_id=self.patient_id),
+                timeout=self.timeout,
+                blocking_timeout=self.blocking_timeout
+            )
+            if not lock.acquire():
+                raise TimeoutError(f"Verrou du store patient {self.patient_id} non obtenu")
+            self._redis_lock = lock
+            return self
+        except TimeoutError:
+            raise
+        except Exception as e:
+            logger.warning(f"Verrou Redis indisponible ({e}), repli sur verrou fichier")
+
+        vector_dir = patient_vector_dir(self.patient_id)
+        os.makedirs(vector_dir, exist_ok=True)
+        self._file = open(os.path.join(vector_dir, '.lock'), 'w')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._redis_lock is not None:
+            try:
+                self._redis_lock.release()
+            except Exception as e:
+                logger.warning(f"Libération du verrou store patient {self.patient_id}: {e}")
+            self._redis_lock = None
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+def load_metadata(vector_dir: str) -> List[Dict]:
+    """Métadonnées seules (sans charger les vecteurs) ; liste vide si le store n'existe pas"""
+    hdf5_path = os.path.join(vector_dir, HDF5_NAME)
+    if not os.path.exists(hdf5_path):
+        return []
+    with h5py.File(hdf5_path, 'r') as hf:
+        if 'metadata' not in hf:
+            return []
+        return [
+            json.loads(item.decode('utf-8') if isinstance(item, bytes) else item)
+            for item in hf['metadata'][:]
+        ]
+
+
+def load_store(vector_dir: str) -> Tuple[np.ndarray, List[Dict]]:
+    """Charge vecteurs et métadonnées (tableau vide si le store n'existe pas)"""
+    hdf5_path = os.path.join(vector_dir, HDF5_NAME)
+    if not os.path.exists(hdf5_path):
+        return np.zeros((0, 0), dtype='float32'), []
+
+    with h5py.File(hdf5_path, 'r') as hf:
+        vectors = hf['vectors'][:] if 'vectors' in hf else np.zeros((0, 0), dtype='float32')
+        metadata = []
+        if 'metadata' in hf:
+            for item in hf['metadata'][:]:
+                if isinstance(item, bytes):
+                    item = item.decode('utf-8')
+                metadata.append(json.loads(item))
+    return vectors.astype('float32'), metadata
+
+
+def write_store(vector_dir: str, vectors: np.ndarray, metadata: List[Dict]) -> int:
+    """
+    Écrit le couple HDF5/FAISS de façon atomique et incrémente la génération.
+    Doit être appelé sous PatientStoreLock. Retourne la nouvelle génération.
+    """
+    os.makedirs(vector_dir, exist_ok=True)
+    generation = read_generation(vector_dir) + 1
+
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+
+    hdf5_path = os.path.join(vector_dir, HDF5_NAME)
+    faiss_path = os.path.join(vector_dir, FAISS_NAME)
+    tmp_hdf5 = os.path.join(vector_dir, f'.tmp_{generation}_{HDF5_NAME}')
+    tmp_faiss = os.path.join(vector_dir, f'.tmp_{generation}_{FAISS_NAME}')
+
+    try:
+        # 1. HDF5 temporaire
+        with h5py.File(tmp_hdf5, 'w') as hf:
+            hf.attrs['generation'] = generation
+            hf.create_dataset('vectors', data=vectors)
+            dt = h5py.special_dtype(vlen=bytes)
+            meta_dataset = hf.create_dataset('metadata', (len(metadata),), dtype=dt)
+            for i, meta_item in enumerate(metadata):
+                meta_dataset[i] = json.dumps(meta_item).encode('utf-8')
+
+        # 2. FAISS temporaire (produit scalaire sur vecteurs normalisés = cosinus)
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        normalized = vectors.copy()
+        faiss.normalize_L2(normalized)
+        index.add(normalized)
+        faiss.write_index(index, tmp_faiss)
+
+        # 3. Bascule : FAISS puis HDF5 puis génération. Un lecteur qui tombe
+        #    entre deux renommages détecte l'écart (ntotal != len(vectors)).
+        os.replace(tmp_faiss, faiss_path)
+        os.replace(tmp_hdf5, hdf5_path)
+        _atomic_write_text(os.path.join(vector_dir, GENERATION_NAME), str(generation))
+    finally:
+        for tmp_path in (tmp_hdf5, tmp_faiss):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    logger.info(f"Store écrit: {vector_dir} ({len(metadata)} vecteurs, génération {generation})")
+    return generation
@@ -7,6 +7,12 @@ from django.utils import timezone
 
 model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
 
+@shared_task(name='rag.tasks.reindex_patient_task')
+def reindex_patient_task(patient_id, run_id, embedder_name):
+    """Réindexation blue/green d'un patient (lancée par manage.py reindex --celery)"""
+    from .reindex import run_patient
+    return run_patient(patient_id, run_id, embedder_name)
+
 @shared_task
 def index_document_task(document_id):
     doc = Document.objects.get(id=document_id)
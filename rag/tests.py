@@ -1,3 +1,162 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+import numpy as np
+
+from . import chunking
+from .intent import (
+    ACTIVATION, DOCUMENTS, GREETING, HELP, MEDICAL, THANKS, Intent, IntentClassifier, classify_by_rules,
+)
+
+
+class WordTokenizer:
+    """Tokenizer de test : un token par mot (chemin « lent », sans offsets)"""
+    is_fast = False
+
+    def __call__(self, texts, **kwargs):
+        return {'input_ids': [text.split() for text in texts]}
+
+
+class TopicEmbedder:
+    """Embedder de test : un axe par thème, reconnu par mot-clé"""
+    TOPICS = ('tension', 'glycémie', 'vaccin')
+    max_seq_length = 12
+
+    def __init__(self):
+        self.tokenizer = WordTokenizer()
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return len(self.TOPICS)
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        vectors = np.zeros((len(texts), len(self.TOPICS)), dtype='float32')
+        for i, text in enumerate(texts):
+            for j, topic in enumerate(self.TOPICS):
+                if topic in text.lower():
+                    vectors[i, j] = 1.0
+        return vectors
+
+
+def _passage(text, page=1):
+    return {'source': 'pdf_page', 'page': page, 'text': text}
+
+
+class TokenChunkingTests(SimpleTestCase):
+    def test_chunks_respect_budget_and_keep_page(self):
+        text = " ".join(f"Phrase numéro {i} du compte rendu." for i in range(20))
+        chunks = chunking.token_chunk_passages([_passage(text, page=3)], WordTokenizer(), 15, 0)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk['text'].split()), 15)
+            self.assertEqual(chunk['page'], 3)
+        self.assertEqual(" ".join(c['text'] for c in chunks).split(), text.split())
+
+    def test_overlap_repeats_last_sentence(self):
+        sentences = [f"Phrase {i} courte." for i in range(6)]
+        chunks = chunking.token_chunk_passages([_passage(" ".join(sentences))], WordTokenizer(), 9, 3)
+
+        self.assertGreater(len(chunks), 1)
+        for previous, following in zip(chunks, chunks[1:]):
+            last_sentence = " ".join(previous['text'].split()[-3:])
+            self.assertTrue(following['text'].startswith(last_sentence))
+
+    def test_long_sentence_is_split(self):
+        text = " ".join(f"mot{i}" for i in range(50)) + "."
+        chunks = chunking.token_chunk_passages([_passage(text)], WordTokenizer(), 10, 0)
+
+        self.assertEqual(len(chunks), 5)
+        self.assertTrue(all(len(c['text'].split()) <= 10 for c in chunks))
+
+    def test_token_budget_bounded_by_model_input(self):
+        embedder = TopicEmbedder()
+        self.assertEqual(chunking.token_budget(embedder, 320), 10)
+        self.assertEqual(chunking.token_budget(embedder, 5), 5)
+        self.assertEqual(chunking.token_budget(object(), 320), 320)
+
+
+class SemanticChunkingTests(SimpleTestCase):
+    TEXT = ("Votre tension est de 12/8. La tension reste stable. "
+            "La glycémie à jeun est normale. Contrôler la glycémie dans trois mois.")
+
+    def test_chunks_follow_topics_with_normalized_embeddings(self):
+        chunks = chunking.semantic_chunk_passages([_passage(self.TEXT, page=2)], TopicEmbedder(), threshold=0.5)
+
+        self.assertEqual(len(chunks), 2)
+        self.assertIn('tension', chunks[0]['text'])
+        self.assertIn('glycémie', chunks[1]['text'])
+        for chunk in chunks:
+            self.assertEqual(chunk['page'], 2)
+            self.assertAlmostEqual(float(np.linalg.norm(chunk['embedding'])), 1.0, places=5)
+
+    def test_max_tokens_bounds_chunks(self):
+        chunks = chunking.semantic_chunk_passages([_passage(self.TEXT)], TopicEmbedder(), threshold=0.5,
+                                                  max_tokens=6)
+        self.assertTrue(all(len(c['text'].split()) <= 6 for c in chunks))
+
+    def test_chunk_text_passages_dispatch(self):
+        passages = [_passage(self.TEXT)]
+        semantic = chunking.chunk_text_passages(passages, TopicEmbedder(), 320, 48, semantic=True, threshold=0.5)
+        tokens = chunking.chunk_text_passages(passages, TopicEmbedder(), 320, 48, semantic=False)
+
+        self.assertTrue(all('embedding' in c for c in semantic))
+        self.assertTrue(all('embedding' not in c for c in tokens))
+        self.assertTrue(all(len(c['text'].split()) <= 10 for c in semantic + tokens))
+
+    def test_passage_vectors_reuse_chunk_embeddings(self):
+        embedder = TopicEmbedder()
+        passages = [
+            {'text': 'déjà encodé', 'embedding': np.array([0, 0, 1], dtype='float32')},
+            {'text': 'Rappel du vaccin'},
+        ]
+        vectors = chunking.passage_vectors(passages, embedder)
+
+        self.assertEqual(embedder.encoded, ['Rappel du vaccin'])
+        np.testing.assert_array_equal(vectors[0], [0, 0, 1])
+        np.testing.assert_array_equal(vectors[1], [0, 0, 1])
+
+
+class IntentRuleTests(SimpleTestCase):
+    def assertIntent(self, message, expected):
+        intent = classify_by_rules(message)
+        self.assertEqual(intent.name if intent else None, expected, message)
+
+    def test_rules(self):
+        self.assertIntent("Bonjour docteur !", GREETING)
+        self.assertIntent("merci bonne journée", THANKS)
+        self.assertIntent("Au revoir", THANKS)
+        self.assertIntent("quels sont mes documents ?", DOCUMENTS)
+        self.assertIntent("comment activer mon compte", ACTIVATION)
+        self.assertIntent("aide", HELP)
+        self.assertIntent("merci, quelle est ma dose ?", None)
+        self.assertIntent("quel est mon taux de cholestérol ?", None)
+
+
+class IntentClassifierTests(SimpleTestCase):
+    def _classifier(self, **kwargs):
+        classifier = IntentClassifier.__new__(IntentClassifier)
+        classifier.threshold = kwargs.get('threshold', 0.72)
+        classifier.margin = kwargs.get('margin', 0.05)
+        classifier.max_words = kwargs.get('max_words', 12)
+        classifier.labels = [GREETING, MEDICAL]
+        classifier.matrix = np.array([[1.0, 0.0], [0.0, 1.0]], dtype='float32')
+        return classifier
+
+    def _classify(self, classifier, vector, message="ça va ?"):
+        classifier._encode = lambda texts: np.array([vector], dtype='float32')
+        return classifier.classify(message)
+
+    def test_routes_above_threshold_and_margin(self):
+        intent = self._classify(self._classifier(), [0.9, 0.3])
+        self.assertEqual((intent.name, intent.method), (GREETING, 'embedding'))
+
+    def test_doubt_goes_to_rag(self):
+        self.assertEqual(self._classify(self._classifier(), [0.7, 0.3]).name, MEDICAL)  # Sous le seuil
+        self.assertEqual(self._classify(self._classifier(), [0.8, 0.78]).name, MEDICAL)  # Marge insuffisante
+
+    def test_long_message_skips_encoding(self):
+        classifier = self._classifier()
+        intent = classifier.classify("est-ce que " * 10)
+        self.assertEqual((intent.name, intent.method), (MEDICAL, 'default'))
+        self.assertTrue(Intent(MEDICAL, 0.0, 'default').needs_rag)
@@ -1,3 +1,8 @@
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
@@ -10,7 +15,9 @@ import os
 from django.conf import settings
 import sys
 sys.path.append(os.path.join(settings.BASE_DIR, 'scripts'))
-from rag.your_rag_module import VectorStoreHDF5, EmbeddingGenerator, HybridRetriever, GeminiLLM, RAG
+from rag.your_rag_module import RAG
+from rag import runtime
+from metrics.services import MetricsService, measure_stage
 
 logger = logging.getLogger(__name__)
 
@@ -37,51 +44,38 @@ class RAGQueryView(views.APIView):
             start_time = time.time()
             
             # Trouver le patient
-            patient = Patient.objects.get(phone=patient_phone, is_active=True)
+            with measure_stage('patient_lookup'):
+                patient = Patient.objects.get(phone=patient_phone, is_active=True)
             
-            # Chemins des fichiers vector store pour ce patient
-            hdf5_path = os.path.join(settings.MEDIA_ROOT, 'vectors', f'patient_{patient.id}.h5')
+            # 1. Charger le vector store du patient (cache par génération)
+            with measure_stage('store_load'):
+                vector_store = runtime.get_patient_store(patient.id)
             
             # Vérifier l'existence des fichiers
-            if not os.path.exists(hdf5_path):
+            if vector_store is None:
                 return Response(
                     {"error": "Aucun document indexé trouvé pour ce patient"},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # 1. Charger le vector store
-            vector_store = VectorStoreHDF5(hdf5_path)
-            vector_store.load_store()
-            
-            # 2. Initialiser le générateur d'embeddings
-            embedder = EmbeddingGenerator()
-            
-            # 3. Construire le retriever (hybride si BM25 disponible)
-            bm25_index_dir = os.path.join(settings.MEDIA_ROOT, 'indexes', f'patient_{patient.id}_bm25')
-            if os.path.exists(bm25_index_dir):
-                retriever = HybridRetriever(vector_store, embedder, bm25_index_dir)
-                # Activer le reranking si configuré
-                if getattr(settings, 'USE_RERANKING', True):
-                    retriever.enable_reranking('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            else:
-                # Retriever dense seulement
-                retriever = HybridRetriever(vector_store, embedder)
+            # 2-3. Construire le retriever (hybride si BM25 disponible)
+            retriever = runtime.build_retriever(patient.id, vector_store)
             
             # 4. Initialiser le LLM
-            llm = GeminiLLM()
+            llm = runtime.get_llm()
             
             # 5. Créer le pipeline RAG
-            rag = RAG(retriever, llm)
+            rag = RAG(retriever, llm, max_context_tokens=settings.RAG_SETTINGS.get('MAX_CONTEXT_TOKENS', 1500))
             
             # 6. Générer la réponse
             response_text = rag.answer(query, top_k=5)
+            MetricsService.record_stage_timings(rag.timings)
             
             # Calculer le temps de réponse
             response_time = (time.time() - start_time) * 1000  # en ms
             
             # Sauvegarder les métriques (optionnel)
             try:
-                from metrics.services import MetricsService
                 MetricsService.record_response_time(response_time, 'rag_query')
             except Exception as e:
                 logger.warning(f"Erreur lors de l'enregistrement des métriques: {e}")
@@ -131,6 +125,97 @@ class RAGQueryView(views.APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+def _record_query_metrics(timings, response_time):
+    try:
+        MetricsService.record_stage_timings(timings)
+        MetricsService.record_response_time(response_time, 'rag_query_async')
+    except Exception as e:
+        logger.warning(f"Erreur lors de l'enregistrement des métriques: {e}")
+
+
+@csrf_exempt
+@require_POST
+async def rag_query_async(request):
+    """
+    POST /api/rag/query/async/
+    Même contrat que RAGQueryView, en vue asynchrone (servie par mediServe.asgi) :
+    ORM async, recherche dans le pool borné de rag.runtime, Gemini attendu
+    sans bloquer de thread. Un processus garde ainsi de nombreuses
+    conversations en attente du LLM.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "JSON invalide"}, status=400)
+
+    patient_phone = data.get('patient_phone')
+    query = data.get('query')
+    session_id = data.get('session_id')
+
+    if not all([patient_phone, query, session_id]):
+        return JsonResponse({"error": "patient_phone, query et session_id requis"}, status=400)
+
+    try:
+        start_time = time.time()
+        timings = {}
+
+        t0 = time.perf_counter()
+        patient = await Patient.objects.aget(phone=patient_phone, is_active=True)
+        timings['patient_lookup'] = (time.perf_counter() - t0) * 1000
+
+        # Lecture disque (HDF5 + FAISS) : dans le pool
+        t0 = time.perf_counter()
+        vector_store = await runtime.run_blocking(runtime.get_patient_store, patient.id)
+        timings['store_load'] = (time.perf_counter() - t0) * 1000
+
+        if vector_store is None:
+            return JsonResponse({"error": "Aucun document indexé trouvé pour ce patient"}, status=404)
+
+        retriever = await runtime.run_blocking(runtime.build_retriever, patient.id, vector_store)
+        rag = RAG(retriever, runtime.get_llm(),
+                  max_context_tokens=settings.RAG_SETTINGS.get('MAX_CONTEXT_TOKENS', 1500))
+        response_text = await rag.aanswer(query, top_k=5, executor=runtime.get_executor())
+        timings.update(rag.timings)
+
+        response_time = (time.time() - start_time) * 1000
+        await sync_to_async(_record_query_metrics)(timings, response_time)
+
+        # Sauvegarder la conversation (optionnel)
+        try:
+            from sessions.models import WhatsAppSession, ConversationLog
+
+            session, created = await WhatsAppSession.objects.aget_or_create(
+                session_id=session_id,
+                defaults={
+                    'patient': patient,
+                    'phone_number': patient_phone,
+                    'status': 'active'
+                }
+            )
+            await ConversationLog.objects.acreate(
+                session=session,
+                user_message=query,
+                ai_response=response_text,
+                response_time_ms=response_time,
+                message_length=len(query),
+                response_length=len(response_text)
+            )
+        except Exception as e:
+            logger.warning(f"Erreur lors de l'enregistrement de la conversation: {e}")
+
+        return JsonResponse({
+            "response": response_text,
+            "patient_id": patient.id,
+            "session_id": session_id,
+            "response_time_ms": response_time
+        })
+
+    except Patient.DoesNotExist:
+        return JsonResponse({"error": "Patient non trouvé ou inactif"}, status=404)
+    except Exception as e:
+        logger.error(f"Erreur RAG query async: {e}")
+        return JsonResponse({"error": f"Erreur lors du traitement de la requête: {str(e)}"}, status=500)
+
 class DocumentIndexView(views.APIView):
     """API pour forcer l'indexation d'un document"""
     permission_classes = [AllowAny]
@@ -5,11 +5,17 @@ import logging
 from typing import List, Dict, Optional, Tuple
 
 import time
+import asyncio
+import contextvars
+import functools
 import numpy as np
 import faiss
 import h5py
 from sentence_transformers import SentenceTransformer, CrossEncoder
 import google.generativeai as genai
+from core import tracing
+from rag.context import assemble_context, format_context
+from metrics.registry import GEMINI_REQUESTS, GEMINI_SECONDS
 from dotenv import load_dotenv
 from whoosh import index as whoosh_index
 from whoosh.analysis import RegexTokenizer, LowercaseFilter
@@ -35,6 +41,7 @@ class VectorStoreHDF5:
         self.vectors: Optional[np.ndarray] = None
         self.meta: List[Dict] = []
         self.id_map: Dict[str, Dict] = {}
+        self.generation: int = 0
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def load_store(self):
@@ -43,6 +50,7 @@ class VectorStoreHDF5:
             raise FileNotFoundError(f"HDF5 file not found at {self.path}")
             
         with h5py.File(self.path, 'r') as hf:
+            self.generation = int(hf.attrs.get('generation', 0))
             self.vectors = hf['vectors'][:]
             raw = hf['metadata'][:]
             # decode byte-encoded JSON metadata
@@ -61,19 +69,30 @@ class VectorStoreHDF5:
         if os.path.exists(self.faiss_path):
             self.index = faiss.read_index(self.faiss_path)
             self.logger.info(f"Loaded FAISS index from {self.faiss_path}")
+            if self.vectors is not None and self.index.ntotal != len(self.vectors):
+                # Lu entre les deux renommages d'une bascule : l'index ne
+                # correspond pas au HDF5, on le reconstruit en mémoire.
+                self.logger.warning(
+                    f"FAISS index out of sync ({self.index.ntotal} != {len(self.vectors)}), rebuilding in memory"
+                )
+                self.index = self._build_index()
         else:
             # Si le fichier FAISS n'existe pas, le créer à partir des vecteurs HDF5
             self.logger.warning(f"FAISS index not found at {self.faiss_path}, creating from HDF5 vectors...")
-            if self.vectors is not None and len(self.vectors) > 0:
-                dim = self.vectors.shape[1]
-                self.index = faiss.IndexFlatIP(dim)
-                vectors_copy = self.vectors.copy()
-                faiss.normalize_L2(vectors_copy)
-                self.index.add(vectors_copy)
-                faiss.write_index(self.index, self.faiss_path)
-                self.logger.info(f"Created and saved FAISS index with {self.index.ntotal} vectors")
-            else:
-                raise ValueError("No vectors found in HDF5 file to create FAISS index")
+            self.index = self._build_index()
+            tmp_path = f"{self.faiss_path}.tmp.{os.getpid()}"
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, self.faiss_path)
+            self.logger.info(f"Created and saved FAISS index with {self.index.ntotal} vectors")
+
+    def _build_index(self) -> faiss.Index:
+        if self.vectors is None or len(self.vectors) == 0:
+            raise ValueError("No vectors found in HDF5 file to create FAISS index")
+        index = faiss.IndexFlatIP(self.vectors.shape[1])
+        vectors_copy = np.ascontiguousarray(self.vectors, dtype='float32').copy()
+        faiss.normalize_L2(vectors_copy)
+        index.add(vectors_copy)
+        return index
 
     def search(self, query_vec: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
         if self.index is None:
@@ -104,15 +123,12 @@ class EmbeddingGenerator:
 def init_bm25_index(index_dir: str):
     if not whoosh_index:
         raise ImportError("Whoosh required for BM25. Install via 'pip install whoosh'.")
-    if not os.path.exists(index_dir):
-        os.makedirs(index_dir)
-        
-
-        schema = Schema(id=ID(stored=True), content=TEXT(analyzer=FR_ANALYZER))
-        idx = whoosh_index.create_in(index_dir, schema)
-    else:
-        idx = whoosh_index.open_dir(index_dir)
-    return idx
+    # L'index est créé par le writer (file BM25) : côté lecture on ne crée
+    # jamais d'index vide, pour ne pas écraser un premier commit en cours.
+    if not whoosh_index.exists_in(index_dir):
+        logging.getLogger(__name__).info(f"Index BM25 pas encore construit: {index_dir}")
+        return None
+    return whoosh_index.open_dir(index_dir)
 
 # ---------------------------
 # 🔎 Simple Retriever (dense-only)
@@ -123,8 +139,12 @@ class Retriever:
         self.embedder = embedder
 
     def retrieve(self, question: str, top_k: int = 5) -> List[Dict]:
+        t0 = time.perf_counter()
         q_vec = self.embedder.embed_text(question)
+        t1 = time.perf_counter()
         hits = self.store.search(q_vec, top_k)
+        # Durées par étape (ms) de la dernière recherche
+        self.timings = {'embedding': (t1 - t0) * 1000, 'dense_search': (time.perf_counter() - t1) * 1000}
         results = []
         for idx, score in hits:
             meta = self.store.meta[idx].copy()
@@ -148,6 +168,8 @@ class HybridRetriever:
         if self.bm25_idx:
             self.qp = QueryParser("content", schema=self.bm25_idx.schema)
         self.cross_encoder: Optional[CrossEncoder] = None
+        # Durées par étape (ms) de la dernière recherche
+        self.timings: Dict[str, float] = {}
 
     def _build_query(self, question: str):
         toks = [t.text for t in FR_ANALYZER(question)]
@@ -163,18 +185,37 @@ class HybridRetriever:
                  alpha: float = 0.5,
                  dense_k: int = 10,
                  bm25_k: int = 10) -> List[Dict]:
+        with tracing.span('retriever.retrieve', top_k=top_k, alpha=alpha,
+                          dense_k=dense_k, bm25_k=bm25_k) as span:
+            results = self._retrieve(question, top_k, alpha, dense_k, bm25_k)
+            span.set_attribute('results', len(results))
+            return results
+
+    def _retrieve(self, question, top_k, alpha, dense_k, bm25_k) -> List[Dict]:
+        timings = {}
         # ↓ Dense retrieval first (works even when bm25 disabled)
-        q_vec = self.embedder.embed_text(question)
-        dense_hits = self.store.search(q_vec, dense_k)
+        t0 = time.perf_counter()
+        with tracing.span('retriever.embedding', chars=len(question)):
+            q_vec = self.embedder.embed_text(question)
+        t1 = time.perf_counter()
+        with tracing.span('retriever.dense_search', store_size=len(self.store.meta)) as span:
+            dense_hits = self.store.search(q_vec, dense_k)
+            span.set_attribute('candidates', len(dense_hits))
+        t2 = time.perf_counter()
+        timings['embedding'] = (t1 - t0) * 1000
+        timings['dense_search'] = (t2 - t1) * 1000
 
         # BM-25 retrieval (optional)
         bm25_hits = []
         if self.bm25_idx:
-            query = self._build_query(question)
-            if query is not None:
-                with self.bm25_idx.searcher(weighting=scoring.BM25F()) as searcher:
-                    res = searcher.search(query, limit=bm25_k)
-                    bm25_hits = [(hit["id"], hit.score) for hit in res]
+            with tracing.span('retriever.bm25') as span:
+                query = self._build_query(question)
+                if query is not None:
+                    with self.bm25_idx.searcher(weighting=scoring.BM25F()) as searcher:
+                        res = searcher.search(query, limit=bm25_k)
+                        bm25_hits = [(hit["id"], hit.score) for hit in res]
+                span.set_attribute('candidates', len(bm25_hits))
+            timings['bm25'] = (time.perf_counter() - t2) * 1000
                     
         # Combine
         combined = {}
@@ -205,11 +246,15 @@ class HybridRetriever:
         
         # Rerank
         if self.cross_encoder:
+            t3 = time.perf_counter()
             pairs = [(question, item['meta'].get('text','')) for item in items[:top_k*2]]
-            rerank_scores = self.cross_encoder.predict(pairs)
+            with tracing.span('retriever.rerank', pairs=len(pairs)):
+                rerank_scores = self.cross_encoder.predict(pairs)
             for item, rs in zip(items[:top_k*2], rerank_scores):
                 item['score'] = float(rs)
             items = sorted(items, key=lambda x: x['score'], reverse=True)
+            timings['rerank'] = (time.perf_counter() - t3) * 1000
+        self.timings = timings
             
         # Top-k
         results = []
@@ -240,44 +285,138 @@ class GeminiLLM:
         )
 
     def generate(self, prompt: str) -> str:
-        # Respect API rate limits
-        time.sleep(1)
-        resp = self.model.generate_content(prompt, generation_config=self.config)
+        with tracing.span('llm.generate', prompt_chars=len(prompt)) as span:
+            # Respect API rate limits
+            time.sleep(1)
+            try:
+                with GEMINI_SECONDS.time():
+                    resp = self.model.generate_content(prompt, generation_config=self.config)
+            except Exception:
+                GEMINI_REQUESTS.inc(outcome='error')
+                raise
+            return self._response_text(resp, span)
+
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Variante asynchrone (client async Gemini) : aucun thread bloqué pendant
+        l'appel. La limite de débit est un sémaphore (GEMINI_MAX_CONCURRENCY
+        appels simultanés) plutôt qu'une pause.
+        """
+        with tracing.span('llm.generate', prompt_chars=len(prompt), mode='async') as span:
+            async with self._async_semaphore():
+                try:
+                    with GEMINI_SECONDS.time():
+                        resp = await self.model.generate_content_async(prompt, generation_config=self.config)
+                except Exception:
+                    GEMINI_REQUESTS.inc(outcome='error')
+                    raise
+            return self._response_text(resp, span)
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        # Un sémaphore par boucle d'événements (créé à la première utilisation)
+        loop = asyncio.get_running_loop()
+        semaphores = self.__dict__.setdefault('_semaphores', {})
+        if loop not in semaphores:
+            semaphores[loop] = asyncio.Semaphore(int(os.getenv('GEMINI_MAX_CONCURRENCY', '32')))
+        return semaphores[loop]
+
+    @staticmethod
+    def _response_text(resp, span) -> str:
+        GEMINI_REQUESTS.inc(outcome='ok')
+        usage = getattr(resp, 'usage_metadata', None)
+        if usage is not None:
+            span.set_attributes(
+                prompt_tokens=getattr(usage, 'prompt_token_count', 0),
+                output_tokens=getattr(usage, 'candidates_token_count', 0)
+            )
         return resp.text if resp.parts else ''
 
 # ---------------------------
 # 🔁 RAG Pipeline
 # ---------------------------
+DEFAULT_INSTRUCTIONS = (
+    "Réponds de manière claire, empathique et professionnelle. "
+    "Utilise des termes simples et évite le jargon médical complexe. "
+    "Si nécessaire, suggère de consulter le médecin pour plus de précisions."
+)
+
+
 class RAG:
-    def __init__(self, retriever, llm):
+    def __init__(self, retriever, llm, instructions: Optional[str] = None, max_context_tokens: int = 1500,
+                 history: str = ''):
         self.retriever = retriever
         self.llm = llm
+        # Consignes du canal (WhatsApp, API) : placées dans le prompt, jamais
+        # dans la question envoyée à la recherche
+        self.instructions = instructions or DEFAULT_INSTRUCTIONS
+        self.max_context_tokens = max_context_tokens
+        # Historique de la conversation (résumé + derniers échanges, déjà borné)
+        self.history = history
+        # Durées par étape (ms) de la dernière réponse : recherche + LLM
+        self.timings: Dict[str, float] = {}
 
     def answer(self, question: str, top_k: int = 3) -> str:
+        with tracing.span('rag.answer', top_k=top_k) as span:
+            response = self._answer(question, top_k, span)
+            span.set_attribute('response_chars', len(response))
+            return response
+
+    async def aanswer(self, question: str, top_k: int = 3, executor=None) -> str:
+        """
+        Variante asynchrone : la recherche (embedding, FAISS, BM25, rerank,
+        liée au CPU) tourne dans `executor`, l'appel Gemini est attendu sans
+        bloquer de thread.
+        """
+        with tracing.span('rag.answer', top_k=top_k, mode='async') as span:
+            loop = asyncio.get_running_loop()
+            # Copier le contexte : les spans du retriever restent rattachés à cette trace
+            retrieve = functools.partial(
+                contextvars.copy_context().run, self.retriever.retrieve, question, top_k
+            )
+            contexts = await loop.run_in_executor(executor, retrieve)
+            self.timings = dict(getattr(self.retriever, 'timings', {}))
+            span.set_attribute('contexts', len(contexts))
+
+            t0 = time.perf_counter()
+            response = await self.llm.agenerate(self._prompt(question, contexts, span))
+            self.timings['llm'] = (time.perf_counter() - t0) * 1000
+            span.set_attribute('response_chars', len(response))
+            return response
+
+    def _answer(self, question: str, top_k: int, span) -> str:
         contexts = self.retriever.retrieve(question, top_k)
-        prompt = (
+        self.timings = dict(getattr(self.retriever, 'timings', {}))
+        span.set_attribute('contexts', len(contexts))
+        prompt = self._prompt(question, contexts, span)
+
+        # Respect API rate limits
+        time.sleep(0.5)
+        t0 = time.perf_counter()
+        response = self.llm.generate(prompt)
+        self.timings['llm'] = (time.perf_counter() - t0) * 1000
+        return response
+
+    def _prompt(self, question: str, contexts: List[Dict], span) -> str:
+        blocks = assemble_context(contexts, self.max_context_tokens)
+        span.set_attribute('context_blocks', len(blocks))
+        prompt = self.build_prompt(question, blocks, self.instructions, self.history)
+        span.set_attribute('prompt_chars', len(prompt))
+        return prompt
+
+    @staticmethod
+    def build_prompt(question: str, blocks: List[Dict], instructions: str = DEFAULT_INSTRUCTIONS,
+                     history: str = '') -> str:
+        """Prompt à partir des blocs de assemble_context (dédoublonnés, dans le budget)"""
+        conversation = f"\nConversation en cours :\n{history}\n" if history else ""
+        return (
             "Tu es un assistant médical intelligent qui aide les patients à comprendre leurs documents médicaux. "
             "Utilise les extraits suivants pour répondre à la question de manière claire et empathique.\n"
             "Important: Base-toi uniquement sur les informations fournies dans les documents.\n"
             "Si l'information n'est pas disponible, dis-le clairement.\n\n"
             "Contexte médical :\n"
+            f"{format_context(blocks)}\n"
+            f"{conversation}"
+            f"\nQuestion du patient : {question}\n"
+            f"\n{instructions}\n"
+            "\nRéponse :"
         )
-        for ctx in contexts:
-            text = ctx.get('original_text',
-                        ctx.get('text',
-                                ctx.get('text_representation','')))
-            doc_type = ctx.get('type', 'document')
-            page = ctx.get('page', '?')
-            file_name = ctx.get('file_name', 'Document')
-            
-            prompt += f"- {file_name} ({doc_type}, page {page}): {text[:500]}...\n"
-            
-        prompt += f"\nQuestion du patient : {question}\n"
-        prompt += "\nRéponds de manière claire, empathique et professionnelle. "
-        prompt += "Utilise des termes simples et évite le jargon médical complexe. "
-        prompt += "Si nécessaire, suggère de consulter le médecin pour plus de précisions.\n"
-        prompt += "\nRéponse :"
-        
-        # Respect API rate limits
-        time.sleep(0.5)
-        return self.llm.generate(prompt)
\ No newline at end of file
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# scripts/benchmark_rag.py
+"""
+Benchmark reproductible de la recherche RAG sur un corpus synthétique.
+
+Génère N patients fictifs (comptes rendus, ordonnances, bilans en français)
+avec des faits datés et chiffrés, les découpe avec le chunker de
+production, construit pour chacun un store HDF5/FAISS et un index BM25
+dans un dossier temporaire, puis mesure pour chaque configuration :
+
+- recall@k et MRR (une question par fait, le passage attendu est connu) ;
+- les percentiles de latence par étape (embedding, FAISS, BM25, rerank) ;
+- le débit de RAG.aanswer sous concurrence, Gemini remplacé par un stub
+  (aucun appel réseau).
+
+Configurations : Retriever (dense seul), HybridRetriever pour chaque alpha,
+avec et sans reranking. Le résultat est écrit en JSON (clés triées) pour
+être comparé d'un commit à l'autre :
+
+    python scripts/benchmark_rag.py --patients 20 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import django
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+django.setup()
+
+import numpy as np
+from django.conf import settings
+
+from rag import bm25_index, chunking, runtime, store_writer
+from rag.context import estimate_tokens
+from rag.your_rag_module import HybridRetriever, RAG, Retriever, VectorStoreHDF5
+
+# ---------------------------
+# Corpus synthétique
+# ---------------------------
+MEDICATIONS = [
+    ('metformine', '500 mg', 'deux fois par jour'), ('amlodipine', '5 mg', 'le matin'),
+    ('atorvastatine', '20 mg', 'le soir'), ('lévothyroxine', '75 µg', 'à jeun'),
+    ('ramipril', '10 mg', 'une fois par jour'), ('bisoprolol', '2,5 mg', 'le matin'),
+    ('oméprazole', '20 mg', 'avant le repas'), ('paracétamol', '1 g', 'trois fois par jour'),
+    ('furosémide', '40 mg', 'le matin'), ('insuline glargine', '18 unités', 'au coucher'),
+]
+ANALYTES = [
+    ('glycémie à jeun', 'g/L', (0.7, 2.4)), ('hémoglobine glyquée', '%', (5.0, 9.5)),
+    ('cholestérol LDL', 'g/L', (0.8, 2.2)), ('créatinine', 'mg/L', (6.0, 20.0)),
+    ('TSH', 'mUI/L', (0.3, 8.0)), ('hémoglobine', 'g/dL', (9.0, 16.0)),
+    ('potassium', 'mmol/L', (3.2, 5.6)), ('ferritine', 'µg/L', (10.0, 400.0)),
+]
+EXAMS = [
+    ('radiographie thoracique', ['un parenchyme pulmonaire normal', 'une opacité basale droite']),
+    ('échographie abdominale', ['un foie de taille normale', 'une lithiase vésiculaire']),
+    ('IRM lombaire', ['une discopathie L4-L5', 'une absence de conflit radiculaire']),
+    ('électrocardiogramme', ['un rythme sinusal régulier', 'un bloc de branche droit incomplet']),
+    ('mammographie', ['une classification ACR 2', 'des microcalcifications bénignes']),
+]
+SPECIALTIES = ['cardiologie', 'endocrinologie', 'néphrologie', 'pneumologie', 'rhumatologie', 'dermatologie']
+ALLERGENS = ['la pénicilline', "l'aspirine", 'les sulfamides', 'le latex', "l'iode"]
+FILLERS = [
+    "Le patient est suivi régulièrement en consultation.",
+    "L'examen clinique ne retrouve pas d'anomalie particulière.",
+    "Les constantes sont stables depuis la dernière visite.",
+    "Le patient ne signale pas de douleur thoracique.",
+    "Une bonne observance du traitement est rapportée.",
+    "Les conseils hygiéno-diététiques ont été rappelés.",
+    "Aucun effet indésirable n'a été déclaré.",
+    "Le poids est stable par rapport au précédent contrôle.",
+]
+DOC_TYPES = ['compte_rendu', 'ordonnance', 'bilan_sanguin', 'imagerie']
+
+
+def _date(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2021, 2025)}"
+
+
+def patient_facts(rng: random.Random) -> List[Tuple[str, str]]:
+    """(phrase du document, question du patient) ; chaque fait est propre au patient"""
+    facts = []
+    for name, dose, freq in rng.sample(MEDICATIONS, 3):
+        facts.append((f"Le traitement par {name} est prescrit à la dose de {dose}, {freq}.",
+                      f"Quelle est la dose de {name} que je dois prendre ?"))
+    for name, unit, (low, high) in rng.sample(ANALYTES, 3):
+        value = f"{rng.uniform(low, high):.2f}".replace('.', ',')
+        facts.append((f"Le dosage de {name} réalisé le {_date(rng)} est de {value} {unit}.",
+                      f"Quel est mon résultat de {name} ?"))
+    for name, findings in rng.sample(EXAMS, 2):
+        facts.append((f"La {name} du {_date(rng)} met en évidence {rng.choice(findings)}.",
+                      f"Que montre ma {name} ?"))
+    specialty = rng.choice(SPECIALTIES)
+    facts.append((f"Un rendez-vous de contrôle en {specialty} est programmé le {_date(rng)}.",
+                  f"Quand a lieu mon rendez-vous en {specialty} ?"))
+    facts.append((f"Le patient présente une allergie connue à {rng.choice(ALLERGENS)}.",
+                  "Ai-je une allergie médicamenteuse connue ?"))
+    return facts
+
+
+def build_patient_corpus(rng: random.Random, patient_id: int, docs_per_patient: int) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Pages des documents du patient et questions associées.
+    Retourne (pages [{'document_id', 'source', 'page', 'text', 'file_name'}],
+    questions [{'question', 'fact'}]).
+    """
+    facts = patient_facts(rng)
+    rng.shuffle(facts)
+    pages = []
+    for doc_index in range(docs_per_patient):
+        doc_type = rng.choice(DOC_TYPES)
+        for page in range(1, rng.randint(1, 3) + 1):
+            pages.append({
+                'document_id': f"{patient_id}{doc_index:02d}",
+                'source': 'pdf_page',
+                'page': page,
+                'file_name': f"{doc_type}_{doc_index + 1}.pdf",
+                'sentences': rng.sample(FILLERS, rng.randint(4, 8)),
+            })
+    # Chaque fait est inséré au hasard dans une page, au milieu du texte de remplissage
+    for sentence, _ in facts:
+        target = rng.choice(pages)['sentences']
+        target.insert(rng.randint(0, len(target)), sentence)
+    for page in pages:
+        page['text'] = ' '.join(page.pop('sentences'))
+    return pages, [{'question': question, 'fact': sentence} for sentence, question in facts]
+
+
+def index_patient(embedder, patient_id: int, pages: List[Dict], questions: List[Dict], work_dir: str,
+                  semantic: bool) -> Dict:
+    """Chunking de production, store HDF5/FAISS et index BM25 du patient"""
+    rag_settings = settings.RAG_SETTINGS
+
+    # Même chemin que DocumentVectorizer : toutes les pages en un appel, chaque chunk garde sa page
+    chunks = chunking.chunk_text_passages(
+        pages, embedder.model,
+        rag_settings.get('CHUNK_SIZE', 320), rag_settings.get('CHUNK_OVERLAP', 48),
+        semantic=semantic, threshold=rag_settings.get('SEMANTIC_THRESHOLD', 0.75)
+    )
+    metadata = [
+        {
+            'id': f"doc{chunk['document_id']}_patient{patient_id}_{chunk['source']}_p{chunk['page']}_c{i}",
+            'patient_id': str(patient_id),
+            'document_id': chunk['document_id'],
+            'source': chunk['source'],
+            'type': chunk['source'],
+            'page': chunk['page'],
+            'chunk_index': i,
+            'text': chunk['text'],
+            'file_name': chunk['file_name'],
+            'embedder': rag_settings.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'),
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+
+    vector_dir = os.path.join(work_dir, f'patient_{patient_id}')
+    bm25_dir = os.path.join(work_dir, f'patient_{patient_id}_bm25')
+    store_writer.write_store(vector_dir, chunking.passage_vectors(chunks, embedder.model), metadata)
+    bm25_index.write_documents(bm25_dir, [{'id': m['id'], 'content': m['text']} for m in metadata])
+
+    store = VectorStoreHDF5(os.path.join(vector_dir, store_writer.HDF5_NAME))
+    store.load_store()
+    for item in questions:
+        # Passages pertinents : ceux qui contiennent le fait (deux si le recouvrement le duplique)
+        item['relevant'] = [m['id'] for m in metadata if item['fact'] in m['text']]
+    return {'store': store, 'bm25_dir': bm25_dir, 'questions': questions, 'chunks': len(metadata)}
+
+
+# ---------------------------
+# Mesures
+# ---------------------------
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {name: round(float(np.percentile(values, q)), 3) for name, q in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+
+def make_retriever(embedder, cross_encoder, patient: Dict, config: Dict):
+    if config['kind'] == 'dense':
+        return Retriever(patient['store'], embedder)
+    retriever = HybridRetriever(patient['store'], embedder, patient['bm25_dir'])
+    if config['rerank']:
+        retriever.cross_encoder = cross_encoder
+    return retriever
+
+
+def evaluate_config(embedder, cross_encoder, patients: List[Dict], config: Dict, ks: List[int]) -> Dict:
+    top_k = max(ks)
+    hits = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    stages: Dict[str, List[float]] = {'total': []}
+    n = 0
+
+    for patient in patients:
+        retriever = make_retriever(embedder, cross_encoder, patient, config)
+        for item in patient['questions']:
+            if not item['relevant']:
+                continue
+            t0 = time.perf_counter()
+            if config['kind'] == 'dense':
+                results = retriever.retrieve(item['question'], top_k=top_k)
+            else:
+                results = retriever.retrieve(item['question'], top_k=top_k, alpha=config['alpha'])
+            stages['total'].append((time.perf_counter() - t0) * 1000)
+            for stage, duration_ms in getattr(retriever, 'timings', {}).items():
+                stages.setdefault(stage, []).append(duration_ms)
+
+            ranked = [result['id'] for result in results]
+            rank = next((i + 1 for i, doc_id in enumerate(ranked) if doc_id in item['relevant']), None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            for k in ks:
+                hits[k] += bool(rank and rank <= k)
+            n += 1
+
+    return {
+        'questions': n,
+        'recall': {f'@{k}': round(hits[k] / n, 4) if n else 0.0 for k in ks},
+        'mrr': round(float(np.mean(reciprocal_ranks)), 4) if n else 0.0,
+        'latency_ms': {stage: percentiles(values) for stage, values in stages.items()},
+    }
+
+
+class StubLLM:
+    """Remplace Gemini : latence fixe, aucune requête réseau, taille des prompts relevée"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.prompt_tokens: List[int] = []
+
+    def generate(self, prompt: str) -> str:
+        self.prompt_tokens.append(estimate_tokens(prompt))
+        time.sleep(self.latency)
+        return "Réponse de test."
+
+    async def agenerate(self, prompt: str) -> str:
+        self.prompt_tokens.append(estimate_tokens(prompt))
+        await asyncio.sleep(self.latency)
+        return "Réponse de test."
+
+
+async def _throughput_run(embedder, cross_encoder, patients, config, concurrency, requests, llm_latency_ms):
+    llm = StubLLM(llm_latency_ms)
+    retrievers = [make_retriever(embedder, cross_encoder, patient, config) for patient in patients]
+    workload = [(retriever, item['question']) for retriever, patient in zip(retrievers, patients)
+                for item in patient['questions']]
+    workload = (workload * (requests // max(len(workload), 1) + 1))[:requests]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    max_context_tokens = settings.RAG_SETTINGS.get('MAX_CONTEXT_TOKENS', 1500)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def one(retriever, question):
+            async with semaphore:
+                t0 = time.perf_counter()
+                rag = RAG(retriever, llm, max_context_tokens=max_context_tokens)
+                await rag.aanswer(question, top_k=5, executor=executor)
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(retriever, question) for retriever, question in workload))
+        wall = time.perf_counter() - t0
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(workload),
+        'qps': round(len(workload) / wall, 2) if wall else 0.0,
+        'latency_ms': percentiles(latencies),
+        'prompt_tokens': percentiles([float(t) for t in llm.prompt_tokens]),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=script_dir, text=True).strip()
+    except Exception:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recherche RAG (corpus synthétique, Gemini simulé).")
+    parser.add_argument("--patients", type=int, default=10, help="Nombre de patients synthétiques.")
+    parser.add_argument("--docs-per-patient", type=int, default=4, help="Documents par patient.")
+    parser.add_argument("--seed", type=int, default=42, help="Graine du générateur (corpus reproductible).")
+    parser.add_argument("--alphas", type=float, nargs='+', default=[0.3, 0.5, 0.7], help="Poids dense du mode hybride.")
+    parser.add_argument("--ks", type=int, nargs='+', default=[1, 3, 5], help="Valeurs de k pour recall@k.")
+    parser.add_argument("--no-rerank", action="store_true", help="Ne pas évaluer les configurations avec CrossEncoder.")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 4, 8], help="Niveaux de concurrence du test de débit.")
+    parser.add_argument("--requests", type=int, default=100, help="Requêtes par niveau de concurrence.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Latence simulée du stub Gemini.")
+    parser.add_argument("--output", default="benchmark_rag.json", help="Fichier JSON de résultats.")
+    parser.add_argument("--chunking", choices=['semantic', 'token'], default=None,
+                        help="Chunker (défaut : celui de la production, USE_SEMANTIC_CHUNKING).")
+    parser.add_argument("--work-dir", default=None, help="Dossier des stores (temporaire par défaut).")
+    parser.add_argument("--keep", action="store_true", help="Conserver les stores générés.")
+    args = parser.parse_args()
+
+    rag_settings = settings.RAG_SETTINGS
+    chunking_mode = args.chunking or ('semantic' if rag_settings.get('USE_SEMANTIC_CHUNKING', False) else 'token')
+    embedder = runtime.get_embedder()
+    cross_encoder = None if args.no_rerank else runtime.get_cross_encoder()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='rag_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        # 1. Corpus et index
+        rng = random.Random(args.seed)
+        t0 = time.perf_counter()
+        patients = []
+        for patient_id in range(1, args.patients + 1):
+            pages, questions = build_patient_corpus(rng, patient_id, args.docs_per_patient)
+            patients.append(index_patient(embedder, patient_id, pages, questions, work_dir,
+                                          semantic=chunking_mode == 'semantic'))
+        indexing_seconds = time.perf_counter() - t0
+        print(f"📚 {len(patients)} patients indexés en {indexing_seconds:.1f}s "
+              f"({sum(p['chunks'] for p in patients)} chunks)")
+
+        # 2. Qualité et latence par configuration
+        configs = [{'name': 'dense', 'kind': 'dense', 'alpha': 1.0, 'rerank': False}]
+        for alpha in args.alphas:
+            configs.append({'name': f'hybrid_a{alpha}', 'kind': 'hybrid', 'alpha': alpha, 'rerank': False})
+            if cross_encoder is not None:
+                configs.append({'name': f'hybrid_a{alpha}_rerank', 'kind': 'hybrid', 'alpha': alpha, 'rerank': True})
+
+        results = {}
+        for config in configs:
+            results[config['name']] = evaluate_config(embedder, cross_encoder, patients, config, args.ks)
+            summary = results[config['name']]
+            print(f"🔎 {config['name']:<22} recall@{max(args.ks)}={summary['recall'][f'@{max(args.ks)}']:.3f} "
+                  f"MRR={summary['mrr']:.3f} p95={summary['latency_ms']['total'].get('p95', 0):.1f}ms")
+
+        # 3. Débit de RAG.aanswer (alpha par défaut, reranking si disponible)
+        throughput_config = {'kind': 'hybrid', 'alpha': 0.5, 'rerank': cross_encoder is not None}
+        throughput = []
+        for concurrency in args.concurrency:
+            run = asyncio.run(_throughput_run(embedder, cross_encoder, patients, throughput_config,
+                                              concurrency, args.requests, args.llm_latency_ms))
+            throughput.append(run)
+            print(f"⚡ concurrence {concurrency}: {run['qps']} req/s, p95={run['latency_ms'].get('p95', 0)}ms")
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'seed': args.seed,
+                'patients': args.patients,
+                'docs_per_patient': args.docs_per_patient,
+                'questions': sum(len(p['questions']) for p in patients),
+                'chunks': sum(p['chunks'] for p in patients),
+                'embedder': rag_settings.get('EMBEDDING_MODEL'),
+                'reranker': None if args.no_rerank else rag_settings.get('RERANKER_MODEL'),
+                'chunking': chunking_mode,
+                'chunk_size': rag_settings.get('CHUNK_SIZE'),
+                'chunk_overlap': rag_settings.get('CHUNK_OVERLAP'),
+                'max_context_tokens': rag_settings.get('MAX_CONTEXT_TOKENS'),
+                'llm_latency_ms': args.llm_latency_ms,
+                'indexing_seconds': round(indexing_seconds, 2),
+            },
+            'retrieval': results,
+            'throughput': throughput,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"✅ Résultats écrits dans {args.output}")
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,7 +46,7 @@ def check_redis_connection():
                         print(f"     - {key}")
                 
                 # Vérifier les tâches en attente
-                queues = ['celery', 'default', 'high_priority', 'messaging', 'maintenance']
+                queues = ['celery', 'default', 'cpu', 'io', 'realtime', 'maintenance']
                 for queue in queues:
                     queue_key = f"celery:queue:{queue}"
                     queue_length = r.llen(queue_key)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Faux serveur Twilio pour les tests de charge des diffusions.
+
+Répond à POST /2010-04-01/Accounts/<sid>/Messages.json comme Twilio
+(201 + sid), avec latence et taux de 429 configurables.
+
+Usage:
+    python scripts/fake_twilio_server.py --port 8765 --latency-ms 150 --throttle-rate 0.05
+    TWILIO_FAKE_SERVER=1 celery -A mediServe worker ...
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.throttled = 0
+        self.started_at = time.monotonic()
+
+    def report(self) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return f"envoyés={self.sent} 429={self.throttled} débit={self.sent / elapsed:.1f} msg/s"
+
+
+def make_handler(options, stats):
+    class FakeTwilioHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, comme l'API réelle
+
+        def _reply(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+
+            if not self.path.endswith('/Messages.json'):
+                self._reply(404, {'code': 20404, 'message': 'Not found'})
+                return
+
+            if options.latency_ms:
+                time.sleep(random.uniform(0.5, 1.5) * options.latency_ms / 1000)
+
+            if random.random() < options.throttle_rate:
+                with stats.lock:
+                    stats.throttled += 1
+                self._reply(429, {'code': 20429, 'message': 'Too Many Requests'},
+                            headers={'Retry-After': '1'})
+                return
+
+            with stats.lock:
+                stats.sent += 1
+            self._reply(201, {
+                'sid': 'SM' + uuid.uuid4().hex,
+                'status': 'queued',
+                'to': form.get('To', [''])[0],
+                'from': form.get('From', [''])[0],
+            })
+
+        def log_message(self, format, *args):
+            if options.verbose:
+                super().log_message(format, *args)
+
+    return FakeTwilioHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur Twilio")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Proportion de réponses 429 (0-1)")
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args()
+
+    stats = Stats()
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(options, stats))
+    print(f"Faux Twilio sur http://{options.host}:{options.port} "
+          f"(latence {options.latency_ms} ms, 429 {options.throttle_rate:.0%})")
+
+    def report_loop():
+        while True:
+            time.sleep(10)
+            print(stats.report())
+
+    threading.Thread(target=report_loop, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(stats.report())
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,9 +25,11 @@ from PIL import Image
 import pytesseract
 from sentence_transformers import SentenceTransformer
 
-# Pour chunking sémantique
+# Pour chunking sémantique (rag.chunking, à la racine du projet)
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rag.chunking import passage_vectors, semantic_chunk_passages
 import nltk
-from nltk.tokenize import sent_tokenize
 # Télécharger les modèles Punkt pour le français
 nltk.download('punkt', quiet=True)
 nltk.download('punkt_tab', quiet=True)
@@ -64,42 +66,17 @@ def extract_text_chunks_lexical(pdf_path: str, chunk_size: int, overlap: int) ->
 
 
 def extract_text_chunks_semantic(pdf_path: str, embedder: SentenceTransformer, threshold: float) -> List[Dict]:
-    passages = []
+    """
+    Chunking sémantique (rag.chunking) : phrases de toutes les pages encodées
+    en un lot, centroïde courant par chunk. Chaque chunk porte son embedding.
+    """
+    pages = []
     with pdfplumber.open(pdf_path) as pdf:
         for page_idx, page in enumerate(pdf.pages):
             text = page.extract_text() or ""
-            # Tokenisation en phrases en français
-            sentences = sent_tokenize(text, language='french')
-            if not sentences:
-                continue
-            # Encoder et normaliser chaque phrase
-            emb = embedder.encode(sentences, convert_to_numpy=True)
-            faiss.normalize_L2(emb)
-            # Segmenter par similarité
-            chunk_sents: List[str] = []
-            chunk_embs: List[np.ndarray] = []
-            for sent, vec in zip(sentences, emb):
-                if not chunk_embs:
-                    chunk_sents = [sent]
-                    chunk_embs = [vec]
-                else:
-                    mean_emb = np.mean(chunk_embs, axis=0)
-                    faiss.normalize_L2(mean_emb.reshape(1, -1))
-                    sim = float(np.dot(vec, mean_emb))
-                    if sim >= threshold:
-                        chunk_sents.append(sent)
-                        chunk_embs.append(vec)
-                    else:
-                        passages.append({
-                            "source": "text", "page": page_idx,
-                            "text": " ".join(chunk_sents)
-                        })
-                        chunk_sents = [sent]
-                        chunk_embs = [vec]
-            # Ajouter le dernier chunk s'il existe
-            if chunk_sents:
-                passages.append({"source": "text", "page": page_idx, "text": " ".join(chunk_sents)})
-    return passages
+            if text.strip():
+                pages.append({"source": "text", "page": page_idx, "text": text})
+    return semantic_chunk_passages(pages, embedder, threshold=threshold)
 
 
 def extract_tables(pdf_path: str) -> List[Dict]:
@@ -192,10 +169,10 @@ def main():
                     extract_text_chunks_lexical(path, args.chunk_size, args.overlap))
         passages.extend(extract_tables(path))
         passages.extend(extract_images_ocr(path))
-        for p_i, passage in enumerate(passages):
+        # Un seul encodage par fichier ; les embeddings des chunks sémantiques sont réutilisés
+        file_vectors = passage_vectors(passages, embedder)
+        for p_i, (passage, vec) in enumerate(zip(passages, file_vectors)):
             pid = f"{os.path.splitext(fname)[0]}_{passage['source']}_p{passage['page']}_c{p_i}"
-            vec = embedder.encode(passage['text'], convert_to_numpy=True)
-            faiss.normalize_L2(vec.reshape(1, -1))
             vectors.resize((count+1, dim))
             vectors[count] = vec
             metas.resize((count+1,))
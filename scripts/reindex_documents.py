@@ -2,6 +2,10 @@
 """
 Script pour ré-indexer les documents d'un patient
 Usage: python reindex_documents.py
+
+Supprime puis reconstruit le store : le patient n'a plus de réponses pendant
+l'opération. Pour tous les patients ou un changement de modèle d'embedding,
+utiliser `python manage.py reindex` (blue/green, reprise, parallèle).
 """
 import os
 import sys
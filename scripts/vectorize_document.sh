@@ -1,6 +1,6 @@
 #!/bin/bash
 # Script de vectorisation pour un document
-# Usage: ./vectorize_document.sh <document_upload_id>
+# Usage: ./vectorize_document.sh <document_upload_id> [<document_upload_id> ...]
 
 # Configuration avec logs détaillés
 set -e  # Arrêter en cas d'erreur
@@ -21,12 +21,12 @@ echo "📁 PROJECT_ROOT: $PROJECT_ROOT"
 
 # Vérifier les arguments
 if [ $# -eq 0 ]; then
-    echo "❌ Usage: $0 <document_upload_id>"
+    echo "❌ Usage: $0 <document_upload_id> [<document_upload_id> ...]"
     exit 1
 fi
 
-DOCUMENT_ID=$1
-echo "📄 Document ID: $DOCUMENT_ID"
+DOCUMENT_ID="$*"
+echo "📄 Document ID(s): $DOCUMENT_ID"
 
 # Déterminer le chemin Python
 if [ -f "$PROJECT_ROOT/venv/bin/python" ]; then
@@ -80,7 +80,7 @@ echo "📁 Changement vers: $(pwd)"
 echo "🚀 Exécution du script Python..."
 echo "🔧 Commande: $PYTHON_PATH $VECTORIZE_SCRIPT $DOCUMENT_ID"
 
-$PYTHON_PATH "$VECTORIZE_SCRIPT" $DOCUMENT_ID
+$PYTHON_PATH "$VECTORIZE_SCRIPT" "$@"
 
 # Capturer le code de retour
 EXIT_CODE=$?
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
-Script pour vectoriser un seul document uploadé
+Script pour vectoriser un document uploadé, ou un lot de documents
+(une seule écriture du store par patient, voir DocumentVectorizer.index_patient_batch)
 """
 import os
 import sys
@@ -14,20 +15,18 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
 django.setup()
 
 from django.conf import settings
+from django.utils import timezone
 from documents.models import DocumentUpload
 from patients.models import Patient
 import numpy as np
-import h5py
-import faiss
 import pdfplumber
 import camelot
 from PIL import Image
 import pytesseract
 from sentence_transformers import SentenceTransformer
-from whoosh import index as whoosh_index
-from whoosh.fields import Schema, TEXT, ID
-from whoosh.analysis import RegexTokenizer, LowercaseFilter
 import nltk
+from rag import bm25_index, chunking, store_writer
+from core import tracing
 
 # Configuration logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -40,10 +39,14 @@ try:
 except Exception: # noqa
     pass
 
-# Analyseur pour le français
-FR_ANALYZER = RegexTokenizer(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+") | LowercaseFilter()
+class StoreEmbedderChanged(Exception):
+    """Le store a été basculé sur un autre modèle pendant l'encodage du lot"""
+
 
 class DocumentVectorizer:
+    # Vectoriseurs d'autres modèles (stores réindexés), chargés une fois par processus
+    _instances = {}
+
     def __init__(self, embedder_name=None):
         if embedder_name is None:
             embedder_name = settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
@@ -53,124 +56,214 @@ class DocumentVectorizer:
         self.embedder_name = embedder_name # Sauvegarder pour les métadonnées
         
     def process_document(self, document_upload_id: int):
-        """Traite et vectorise un document"""
-        doc_upload = None # Définir au cas où le premier try échoue
+        """Traite et vectorise un document (lot d'un seul document)"""
         try:
-            # 1. Récupérer le document
-            doc_upload = DocumentUpload.objects.get(id=document_upload_id)
-            patient = doc_upload.patient
-            
-            logger.info(f"Traitement du document {doc_upload.original_filename} pour {patient.full_name()}")
-            
-            # 2. Vérifier que le fichier existe
-            if not doc_upload.file or not os.path.exists(doc_upload.file.path):
-                raise FileNotFoundError(f"Fichier physique introuvable: {doc_upload.file.path}")
-            
-            # 3. Extraire le texte selon le type
-            file_path = doc_upload.file.path
-            file_ext = doc_upload.file_type.lower()
-            
+            doc_upload = DocumentUpload.objects.only('id', 'patient_id').get(id=document_upload_id)
+        except DocumentUpload.DoesNotExist:
+            logger.error(f"❌ Document {document_upload_id} introuvable")
+            return False
+        result = self.index_patient_batch(doc_upload.patient_id, [document_upload_id])
+        return document_upload_id in result['indexed']
+
+    def for_embedder(self, embedder_name: str) -> 'DocumentVectorizer':
+        if embedder_name == self.embedder_name:
+            return self
+        if embedder_name not in DocumentVectorizer._instances:
+            DocumentVectorizer._instances[embedder_name] = DocumentVectorizer(embedder_name)
+        return DocumentVectorizer._instances[embedder_name]
+
+    @staticmethod
+    def _store_embedders(metadata: list) -> set:
+        return {meta['embedder'] for meta in metadata if meta.get('embedder')}
+
+    def index_patient_batch(self, patient_id, document_ids: list) -> dict:
+        """
+        Vectorise plusieurs documents d'un patient avec une seule écriture
+        du store : extraction de chaque document, un seul encodage, une
+        fusion HDF5/FAISS sous le verrou du patient, un seul commit BM25.
+        Chaque DocumentUpload reçoit son propre statut (un document illisible
+        n'empêche pas l'indexation des autres).
+        Retourne {'indexed': [ids], 'failed': {id: erreur}}.
+        """
+        documents = list(
+            DocumentUpload.objects.filter(id__in=document_ids, patient_id=patient_id).order_by('id')
+        )
+        failed = {doc_id: "Document introuvable" for doc_id in set(document_ids) - {d.id for d in documents}}
+
+        # 0. Les vecteurs ajoutés doivent venir du modèle qui a construit le store
+        #    (après une réindexation, il peut différer de EMBEDDING_MODEL)
+        patient_vector_dir = store_writer.patient_vector_dir(patient_id)
+        store_embedders = self._store_embedders(store_writer.load_metadata(patient_vector_dir))
+        if store_embedders and store_embedders != {self.embedder_name}:
+            if len(store_embedders) > 1:
+                return self._refuse_append(patient_id, documents, failed,
+                                           f"modèles mélangés: {', '.join(sorted(store_embedders))}")
+            store_embedder = next(iter(store_embedders))
+            try:
+                vectorizer = self.for_embedder(store_embedder)
+            except Exception as e:
+                return self._refuse_append(patient_id, documents, failed,
+                                           f"modèle du store {store_embedder} indisponible ({e})")
+            logger.info(f"Store du patient {patient_id} encodé avec {store_embedder} : lot vectorisé avec ce modèle")
+            return vectorizer.index_patient_batch(patient_id, document_ids)
+
+        # 1. Extraction, document par document
+        extracted = []  # (doc_upload, passages)
+        for doc_upload in documents:
+            try:
+                extracted.append((doc_upload, self._extract_passages(doc_upload)))
+            except Exception as e:
+                logger.error(f"❌ Extraction impossible pour le document {doc_upload.id}: {e}", exc_info=True)
+                failed[doc_upload.id] = str(e)
+        logger.debug(f"Extraction terminée: {len(extracted)}/{len(documents)} documents")
+
+        if not extracted:
+            self._mark_failed(documents, failed)
+            return {'indexed': [], 'failed': failed}
+
+        # 2. Métadonnées et encodage de tous les passages en un seul batch (hors verrou)
+        new_metadata, all_passages = [], []
+        for doc_upload, passages in extracted:
+            new_metadata.extend(self._passage_metadata(doc_upload, patient_id, passages))
+            all_passages.extend(passages)
+
+        try:
+            with tracing.span('vectorize.embedding', passages=len(new_metadata), documents=len(extracted)):
+                vectors_array = self.encode_passages(all_passages)
+
+            # 3. Une seule fusion avec le store existant, puis bascule atomique HDF5/FAISS
+            with tracing.span('vectorize.store_write', patient_id=patient_id, documents=len(extracted)), \
+                    store_writer.PatientStoreLock(patient_id):
+                vectors, metadata = store_writer.load_store(patient_vector_dir)
+                if self._store_embedders(metadata) - {self.embedder_name}:
+                    raise StoreEmbedderChanged()
+                if len(vectors):
+                    logger.info(f"Store existant: {len(vectors)} vecteurs ({patient_vector_dir})")
+                    all_vectors = np.vstack([vectors, vectors_array])
+                else:
+                    logger.info(f"Création d'un nouveau vector store: {patient_vector_dir}")
+                    all_vectors = vectors_array
+                generation = store_writer.write_store(patient_vector_dir, all_vectors, metadata + new_metadata)
+            logger.info(f"Store patient {patient_id} en génération {generation} (+{len(extracted)} documents)")
+        except StoreEmbedderChanged:
+            # Réindexation basculée entre la lecture du modèle et l'écriture : on recommence
+            logger.info(f"Store du patient {patient_id} réindexé pendant le lot, nouvel essai")
+            return self.index_patient_batch(patient_id, document_ids)
+        except Exception as e:
+            logger.error(f"❌ Écriture du store du patient {patient_id} échouée: {e}", exc_info=True)
+            for doc_upload, _ in extracted:
+                failed[doc_upload.id] = str(e)
+            self._mark_failed(documents, failed)
+            return {'indexed': [], 'failed': failed}
+
+        # 4. Index BM25 : le lot entier en un commit
+        if settings.RAG_SETTINGS.get('USE_BM25', True):
+            self.write_bm25_batch(patient_id, new_metadata)
+
+        # 5. Statuts individuels
+        indexed = [doc_upload for doc_upload, _ in extracted]
+        now = timezone.now()
+        for doc_upload in indexed:
+            doc_upload.upload_status = 'indexed'
+            doc_upload.processed_at = now
+            doc_upload.error_message = ''  # Effacer les erreurs précédentes
+        DocumentUpload.objects.bulk_update(indexed, ['upload_status', 'processed_at', 'error_message'])
+        self._mark_failed(documents, failed)
+
+        logger.info(f"✅ {len(indexed)} documents vectorisés pour patient {patient_id} ({len(failed)} en échec)")
+        return {'indexed': [doc_upload.id for doc_upload in indexed], 'failed': failed}
+
+    def _extract_passages(self, doc_upload) -> list:
+        if not doc_upload.file or not os.path.exists(doc_upload.file.path):
+            raise FileNotFoundError(f"Fichier physique introuvable: {doc_upload.file.path}")
+
+        file_path = doc_upload.file.path
+        file_ext = doc_upload.file_type.lower()
+
+        with tracing.span('vectorize.extract', file_type=file_ext, document_id=doc_upload.id) as span:
             if file_ext == 'pdf':
                 passages = self.extract_text_from_pdf(file_path)
             elif file_ext in ['jpg', 'jpeg', 'png', 'tiff', 'bmp']:
                 passages = self.extract_text_from_image(file_path)
             else:
                 raise ValueError(f"Type de fichier non supporté: {file_ext}")
-            
-            if not passages:
-                raise ValueError("Aucun texte extrait du document")
-            
-            logger.info(f"Extrait {len(passages)} passages du document")
-            
-            # 4. Préparer les chemins de stockage pour ce patient
-            # Utiliser RAG_SETTINGS pour la robustesse
-            vector_dir = settings.RAG_SETTINGS['VECTOR_STORE_DIR']
-            index_dir = settings.RAG_SETTINGS['BM25_INDEX_DIR']
-            
-            # Créer les dossiers de base s'ils n'existent pas (déjà fait dans settings.py mais redondance ok)
-            os.makedirs(vector_dir, exist_ok=True)
-            os.makedirs(index_dir, exist_ok=True)
-            
-            patient_vector_dir = os.path.join(vector_dir, f'patient_{patient.id}')
-            patient_bm25_dir = os.path.join(index_dir, f'patient_{patient.id}_bm25')
-            
-            os.makedirs(patient_vector_dir, exist_ok=True)
-            os.makedirs(patient_bm25_dir, exist_ok=True)
+            span.set_attribute('passages', len(passages))
 
-            hdf5_path = os.path.join(patient_vector_dir, 'vector_store.h5')
-            faiss_path = os.path.join(patient_vector_dir, 'vector_store.faiss')
-            
-            # 5. Charger ou créer les stores existants
-            if os.path.exists(hdf5_path):
-                logger.info(f"Chargement du vector store existant: {hdf5_path}")
-                vectors, metadata = self.load_existing_store(hdf5_path)
-            else:
-                logger.info(f"Création d'un nouveau vector store: {hdf5_path}")
-                vectors = []
-                metadata = []
-            
-            # 6. Vectoriser les nouveaux passages
-            new_vectors = []
-            new_metadata = []
-            
-            for i, passage in enumerate(passages):
-                # Créer l'embedding
-                vec = self.embedder.encode(passage['text'], convert_to_numpy=True)
-                # S'assurer que vec est un array 1D avant reshape
-                if vec.ndim == 1:
-                    vec_norm = vec.reshape(1, -1)
-                else:
-                    vec_norm = vec
-                faiss.normalize_L2(vec_norm)
-                
-                # Créer les métadonnées
-                meta = {
-                    'id': f"doc{doc_upload.id}_patient{patient.id}_{passage['source']}_p{passage['page']}_c{i}",
-                    'patient_id': str(patient.id),
-                    'document_id': str(doc_upload.id),
-                    'source': passage['source'],
-                    'type': passage['source'], # 'type' est souvent utilisé, 'source' peut être plus spécifique
-                    'page': passage['page'],
-                    'text': passage['text'],
-                    'file_name': doc_upload.original_filename,
-                    'embedder': self.embedder_name # Utiliser la variable d'instance
-                }
-                
-                new_vectors.append(vec_norm[0]) # Stocker le vecteur 1D
-                new_metadata.append(meta)
-            
-            # 7. Combiner avec les vecteurs existants
-            all_vectors = vectors + new_vectors
-            all_metadata = metadata + new_metadata
-            
-            # 8. Sauvegarder dans HDF5
-            self.save_to_hdf5(hdf5_path, all_vectors, all_metadata)
-            
-            # 9. Créer/Mettre à jour l'index FAISS
-            self.update_faiss_index(faiss_path, all_vectors)
-            
-            # 10. Mettre à jour l'index BM25
-            if settings.RAG_SETTINGS.get('USE_BM25', True):
-                self.update_bm25_index(patient_bm25_dir, new_metadata) # Utiliser patient_bm25_dir
-            
-            # 11. Mettre à jour le statut du document
-            doc_upload.upload_status = 'indexed'
-            doc_upload.processed_at = django.utils.timezone.now()
-            doc_upload.error_message = '' # Effacer les erreurs précédentes
-            doc_upload.save()
-            
-            logger.info(f"✅ Document {document_upload_id} vectorisé avec succès pour patient {patient.id}")
-            return True
-            
+        if not passages:
+            raise ValueError("Aucun texte extrait du document")
+        logger.info(f"Extrait {len(passages)} passages de {doc_upload.original_filename}")
+        return self._chunk_passages(passages)
+
+    def _chunk_passages(self, passages: list) -> list:
+        """
+        Découpe les passages texte (pages PDF, OCR) en chunks d'au plus
+        CHUNK_SIZE tokens ; les tables restent entières. En chunking
+        sémantique, chaque chunk porte l'embedding dérivé de ses phrases,
+        réutilisé par encode_passages.
+        """
+        text_passages = [p for p in passages if p['source'] in ('pdf_page', 'image_ocr')]
+        if not text_passages:
+            return passages
+        rag_settings = settings.RAG_SETTINGS
+        semantic = rag_settings.get('USE_SEMANTIC_CHUNKING', False)
+        with tracing.span('vectorize.chunking', passages=len(text_passages), semantic=semantic) as span:
+            chunks = chunking.chunk_text_passages(
+                text_passages, self.embedder,
+                rag_settings.get('CHUNK_SIZE', 320), rag_settings.get('CHUNK_OVERLAP', 48),
+                semantic=semantic, threshold=rag_settings.get('SEMANTIC_THRESHOLD', 0.75)
+            )
+            span.set_attribute('chunks', len(chunks))
+        return chunks + [p for p in passages if p['source'] not in ('pdf_page', 'image_ocr')]
+
+    def encode_passages(self, passages: list) -> np.ndarray:
+        """Vecteurs normalisés (float32) ; les embeddings du chunking ne sont pas recalculés"""
+        return chunking.passage_vectors(passages, self.embedder, batch_size=32)
+
+    def _passage_metadata(self, doc_upload, patient_id, passages: list) -> list:
+        return [
+            {
+                'id': f"doc{doc_upload.id}_patient{patient_id}_{passage['source']}_p{passage['page']}_c{i}",
+                'patient_id': str(patient_id),
+                'document_id': str(doc_upload.id),
+                'source': passage['source'],
+                'type': passage['source'], # 'type' est souvent utilisé, 'source' peut être plus spécifique
+                'page': passage['page'],
+                'chunk_index': i,
+                'text': passage['text'],
+                'file_name': doc_upload.original_filename,
+                'embedder': self.embedder_name # Utiliser la variable d'instance
+            }
+            for i, passage in enumerate(passages)
+        ]
+
+    def _refuse_append(self, patient_id, documents: list, failed: dict, reason: str) -> dict:
+        """
+        Pas d'ajout dans un store dont on ne peut pas reproduire l'espace
+        vectoriel : les documents sont en échec et le patient est envoyé en
+        réindexation avec EMBEDDING_MODEL (à relancer ensuite pour ces documents).
+        """
+        logger.error(f"❌ Store du patient {patient_id} à réindexer ({reason}) : lot refusé")
+        for doc_upload in documents:
+            failed[doc_upload.id] = f"Store à réindexer ({reason}), relancer l'indexation ensuite"
+        self._mark_failed(documents, failed)
+        try:
+            from rag.tasks import reindex_patient_task
+            reindex_patient_task.delay(
+                patient_id, f"auto_{patient_id}_{timezone.now():%Y%m%d%H%M%S}",
+                settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
+            )
         except Exception as e:
-            logger.error(f"❌ Erreur lors de la vectorisation du document {document_upload_id}: {str(e)}", exc_info=True)
-            
-            if doc_upload:
-                doc_upload.upload_status = 'failed'
-                doc_upload.error_message = str(e)
-                doc_upload.save()
-            
-            return False
+            logger.error(f"Réindexation du patient {patient_id} non planifiée: {e}")
+        return {'indexed': [], 'failed': failed}
+
+    @staticmethod
+    def _mark_failed(documents: list, failed: dict):
+        to_update = [doc_upload for doc_upload in documents if doc_upload.id in failed]
+        for doc_upload in to_update:
+            doc_upload.upload_status = 'failed'
+            doc_upload.error_message = failed[doc_upload.id]
+        if to_update:
+            DocumentUpload.objects.bulk_update(to_update, ['upload_status', 'error_message'])
     
     def extract_text_from_pdf(self, pdf_path: str) -> list:
         """Extrait le texte d'un PDF page par page"""
@@ -224,133 +317,58 @@ class DocumentVectorizer:
         
         return passages
     
-    def load_existing_store(self, hdf5_path: str) -> tuple:
-        """Charge un store HDF5 existant"""
-        vectors = []
-        metadata = []
-        
-        try:
-            with h5py.File(hdf5_path, 'r') as hf:
-                if 'vectors' in hf:
-                    vectors = list(hf['vectors'][:])
-                if 'metadata' in hf:
-                    # Gérer le cas où metadata est vide ou n'est pas un tableau de bytes encodés
-                    raw_meta = hf['metadata'][:]
-                    for item in raw_meta:
-                        if isinstance(item, bytes):
-                            metadata.append(json.loads(item.decode('utf-8')))
-                        elif isinstance(item, str): # Au cas où ce serait déjà des strings JSON
-                             metadata.append(json.loads(item))
-                        # Si c'est autre chose, on pourrait logger une erreur ou l'ignorer
-        except FileNotFoundError:
-            logger.info(f"Fichier HDF5 non trouvé ({hdf5_path}), nouveau store sera créé.")
-        except Exception as e:
-            logger.error(f"Erreur chargement store HDF5 ({hdf5_path}): {e}", exc_info=True)
-        return vectors, metadata
-    
-    def save_to_hdf5(self, hdf5_path: str, vectors: list, metadata: list):
-        """Sauvegarde les vecteurs et métadonnées dans HDF5"""
-        try:
-            with h5py.File(hdf5_path, 'w') as hf:
-                if vectors:
-                    vectors_array = np.array(vectors, dtype='float32')
-                    if vectors_array.ndim == 1: # S'il n'y a qu'un seul vecteur
-                        vectors_array = vectors_array.reshape(1, -1)
-                    hf.create_dataset('vectors', data=vectors_array)
-                
-                if metadata:
-                    dt = h5py.special_dtype(vlen=bytes)
-                    meta_dataset = hf.create_dataset('metadata', (len(metadata),), dtype=dt)
-                    for i, meta_item in enumerate(metadata):
-                        meta_dataset[i] = json.dumps(meta_item).encode('utf-8')
-            logger.info(f"Store HDF5 sauvegardé: {hdf5_path}")
-        except Exception as e:
-            logger.error(f"Erreur sauvegarde HDF5 ({hdf5_path}): {e}", exc_info=True)
-    
-    def update_faiss_index(self, faiss_path: str, vectors: list):
-        """Met à jour l'index FAISS"""
-        if not vectors:
-            logger.info("Aucun vecteur à ajouter à l'index FAISS.")
-            # Supprimer l'ancien index s'il n'y a plus de vecteurs ? Ou le laisser vide ?
-            # Pour l'instant, on ne fait rien si vectors est vide.
-            # Si un index vide doit être créé, cela doit être géré explicitement.
-            if os.path.exists(faiss_path): # Si pas de vecteurs mais un vieil index existe
-                try:
-                    os.remove(faiss_path)
-                    logger.info(f"Ancien index FAISS supprimé car plus de vecteurs: {faiss_path}")
-                except OSError as e:
-                    logger.error(f"Impossible de supprimer l'ancien index FAISS {faiss_path}: {e}", exc_info=True)
+    def update_bm25_index(self, patient_id, new_metadata: list):
+        """Met à jour l'index BM25. Les passages passent par la file du patient
+        et sont écrits en un seul commit par la tâche flush_bm25_queue."""
+        if not new_metadata: # Seulement traiter s'il y a de nouvelles métadonnées à ajouter
+            logger.info("Aucune nouvelle métadonnée pour l'index BM25.")
             return
 
         try:
-            vectors_array = np.array(vectors, dtype='float32')
-            if vectors_array.ndim == 1: # S'il n'y a qu'un seul vecteur
-                vectors_array = vectors_array.reshape(1, -1)
-
-            faiss.normalize_L2(vectors_array) # Normaliser avant d'ajouter
-            
-            index = faiss.IndexFlatIP(self.dim) # Utiliser IndexFlatIP pour similarité cosinus après normalisation L2
-            index.add(vectors_array)
-            
-            faiss.write_index(index, faiss_path)
-            logger.info(f"Index FAISS mis à jour/créé: {faiss_path} avec {index.ntotal} vecteurs")
+            bm25_index.update_index(patient_id, new_metadata)
         except Exception as e:
-            logger.error(f"Erreur mise à jour FAISS ({faiss_path}): {e}", exc_info=True)
-    
-    def update_bm25_index(self, bm25_dir: str, new_metadata: list):
-        """Met à jour l'index BM25. Ajoute seulement les nouveaux documents."""
-        if not new_metadata: # Seulement traiter s'il y a de nouvelles métadonnées à ajouter
-            logger.info("Aucune nouvelle métadonnée pour l'index BM25.")
-            return
+            logger.warning(f"Erreur mise à jour BM25 (patient {patient_id}): {e}", exc_info=True)
 
+    def write_bm25_batch(self, patient_id, new_metadata: list):
+        """Lot complet : un commit Whoosh direct ; la file Redis en cas d'échec"""
         try:
-            if not os.path.exists(bm25_dir):
-                os.makedirs(bm25_dir)
-                schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
-                idx = whoosh_index.create_in(bm25_dir, schema)
-                logger.info(f"Index BM25 créé: {bm25_dir}")
-            else:
-                try:
-                    idx = whoosh_index.open_dir(bm25_dir)
-                    logger.info(f"Index BM25 ouvert: {bm25_dir}")
-                except whoosh_index.EmptyIndexError: # Si le dossier existe mais est vide/corrompu
-                    logger.warning(f"Index BM25 existant à {bm25_dir} est vide ou corrompu. Recréation.")
-                    schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
-                    idx = whoosh_index.create_in(bm25_dir, schema)
-
-
-            # Utiliser un writer avec modification pour ajouter ou mettre à jour
-            writer = idx.writer()
-            for meta in new_metadata:
-                # id est unique, donc update=True va remplacer si l'id existe déjà.
-                # C'est utile si on re-vectorise un document.
-                writer.update_document(
-                    id=meta['id'], 
-                    content=meta['text']
-                )
-            writer.commit()
-            
-            logger.info(f"Index BM25 mis à jour: {len(new_metadata)} documents traités dans {bm25_dir}")
-            
+            with tracing.span('vectorize.bm25_write', patient_id=patient_id, passages=len(new_metadata)):
+                bm25_index.write_documents(bm25_index.patient_bm25_dir(patient_id), [
+                    {'id': m['id'], 'content': m['text']} for m in new_metadata
+                ])
         except Exception as e:
-            logger.warning(f"Erreur mise à jour BM25 ({bm25_dir}): {e}", exc_info=True)
+            logger.warning(f"Écriture BM25 directe échouée (patient {patient_id}): {e}, passage par la file")
+            self.update_bm25_index(patient_id, new_metadata)
 
 def main():
     """Point d'entrée principal"""
-    if len(sys.argv) != 2:
-        print("Usage: python vectorize_single_document.py <document_upload_id>")
+    if len(sys.argv) < 2:
+        print("Usage: python vectorize_single_document.py <document_upload_id> [<document_upload_id> ...]")
         sys.exit(1)
     
     try:
-        document_id = int(sys.argv[1])
+        document_ids = [int(arg) for arg in sys.argv[1:]]
     except ValueError:
         print("L'ID du document doit être un nombre entier.")
         sys.exit(1)
     
+    # Un seul chargement du modèle, une seule écriture de store par patient
     vectorizer = DocumentVectorizer()
-    success = vectorizer.process_document(document_id)
+    by_patient = {}
+    for doc_id, patient_id in DocumentUpload.objects.filter(id__in=document_ids).values_list('id', 'patient_id'):
+        by_patient.setdefault(patient_id, []).append(doc_id)
+    
+    indexed = []
+    parent = tracing.parent_from_traceparent(None)
+    for patient_id, patient_document_ids in by_patient.items():
+        # Poursuit la trace de la tâche Celery appelante (variable TRACEPARENT)
+        with tracing.span('vectorize.index_patient_batch', parent=parent, patient_id=patient_id,
+                          documents=len(patient_document_ids)) as span:
+            result = vectorizer.index_patient_batch(patient_id, patient_document_ids)
+            span.set_attribute('indexed', len(result['indexed']))
+        indexed.extend(result['indexed'])
     
-    sys.exit(0 if success else 1)
+    sys.exit(0 if len(indexed) == len(document_ids) else 1)
 
 if __name__ == "__main__":
     # S'assurer que le script est exécuté dans le contexte du projet Django
@@ -0,0 +1,224 @@
+# sessions/memory.py
+"""
+Mémoire de conversation par session WhatsApp.
+
+Les derniers échanges sont gardés dans Redis (liste `conversation:<session>:turns`).
+Au-delà de MAX_TURNS, la tâche compact_conversation_memory résume les plus
+anciens dans un résumé glissant (`conversation:<session>:summary`, borné à
+SUMMARY_MAX_TOKENS) puis les retire de la liste : le prompt garde une
+taille constante quelle que soit la longueur de la conversation.
+
+Avant la recherche, une question de suivi ("et la dose ?", "c'est grave ?")
+est reformulée en question autonome à partir de cet historique. L'appel LLM
+n'a lieu que s'il existe un échange précédent et que la question, courte ou
+anaphorique, ne nomme elle-même aucun sujet précis (nombre, nom propre,
+examen, pathologie, médicament) : la plupart des questions vont directement
+à la recherche.
+"""
+import re
+import json
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TURNS_KEY = "conversation:{session_id}:turns"
+SUMMARY_KEY = "conversation:{session_id}:summary"
+COMPACT_LOCK_KEY = "conversation:{session_id}:compacting"
+
+# Marqueurs d'une question qui dépend de l'échange précédent
+_FOLLOW_UP_RE = re.compile(
+    r"^(et|mais|alors|donc|aussi|sinon|ok|d'accord)\b"
+    r"|\b(il|elle|ils|elles|lui|leur|ça|cela|cet|cette|ces|celui|celle|ceux|celui-ci|celle-ci|même|autre|précédent|précédente)\b",
+    re.IGNORECASE
+)
+_FOLLOW_UP_MAX_WORDS = 12
+# Sujet explicite : la question se comprend sans l'historique
+_SUBJECT_RE = re.compile(
+    r"\d"
+    r"|\b(analyses?|bilans?|examens?|radios?|radiographies?|scanners?|irm|échographies?|prises? de sang"
+    r"|ordonnances?|comptes? rendus?|rapports?|résultats?|diagnostics?|consultations?|rendez-vous"
+    r"|cholestérol|glycémie|diabète|tension|hypertension|hémoglobine|créatinine|thyroïde|tsh|vitamine"
+    r"|asthme|infection|allergies?|anémie|cancer|grossesse"
+    r"|médicaments?|traitements?|antibiotiques?|vaccins?|paracétamol|doliprane|ibuprofène|insuline)\b",
+    re.IGNORECASE
+)
+# Mots pouvant porter une majuscule sans être un nom propre
+_COMMON_CAPITALIZED = {'et', 'mais', 'alors', 'donc', 'ok', 'est', 'c', 'je', 'il', 'elle', 'quel', 'quelle',
+                       'quand', 'comment', 'pourquoi', 'combien', 'que', 'qu', 'ça', 'ca', 'dois', 'puis'}
+
+
+def memory_settings() -> Dict:
+    defaults = {
+        'MAX_TURNS': 4,
+        'SUMMARY_MAX_TOKENS': 200,
+        'TURN_MAX_CHARS': 400,
+        'TTL': 24 * 3600,
+        'REWRITE_FOLLOW_UPS': True,
+    }
+    return {**defaults, **getattr(settings, 'CONVERSATION_MEMORY', {})}
+
+
+class ConversationMemory:
+    """Derniers échanges et résumé glissant d'une session (Redis)"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns_key = TURNS_KEY.format(session_id=session_id)
+        self.summary_key = SUMMARY_KEY.format(session_id=session_id)
+        self.config = memory_settings()
+
+    def load(self) -> Tuple[str, List[Dict]]:
+        """(résumé, derniers échanges [{'q', 'a', 'ts'}]) en un aller-retour"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.get(self.summary_key)
+            pipe.lrange(self.turns_key, -self.config['MAX_TURNS'], -1)
+            summary, raw_turns = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Mémoire de conversation indisponible ({self.session_id}): {e}")
+            return '', []
+        return (summary or b'').decode('utf-8'), [json.loads(raw) for raw in raw_turns]
+
+    def append(self, question: str, answer: str):
+        """Ajoute un échange ; déclenche la compaction quand la liste dépasse MAX_TURNS"""
+        limit = self.config['TURN_MAX_CHARS']
+        turn = json.dumps({'q': question[:limit], 'a': answer[:limit], 'ts': time.time()}, ensure_ascii=False)
+        try:
+            client = get_redis()
+            pipe = client.pipeline(transaction=False)
+            pipe.rpush(self.turns_key, turn)
+            pipe.expire(self.turns_key, self.config['TTL'])
+            pipe.expire(self.summary_key, self.config['TTL'])
+            length = pipe.execute()[0]
+            if length > self.config['MAX_TURNS'] and client.set(
+                COMPACT_LOCK_KEY.format(session_id=self.session_id), 1, nx=True, ex=300
+            ):
+                from .tasks import compact_conversation_memory
+                compact_conversation_memory.delay(self.session_id)
+        except Exception as e:
+            logger.warning(f"Échange non mémorisé ({self.session_id}): {e}")
+
+    def compact(self, llm) -> int:
+        """
+        Résume les échanges au-delà des MAX_TURNS derniers dans le résumé
+        glissant. Retourne le nombre d'échanges compactés.
+        """
+        client = get_redis()
+        try:
+            summary = (client.get(self.summary_key) or b'').decode('utf-8')
+            raw_turns = client.lrange(self.turns_key, 0, -1)
+            overflow = len(raw_turns) - self.config['MAX_TURNS']
+            if overflow <= 0:
+                return 0
+            old_turns = [json.loads(raw) for raw in raw_turns[:overflow]]
+            new_summary = summarize(llm, summary, old_turns, self.config['SUMMARY_MAX_TOKENS'])
+
+            # Les échanges ajoutés entre-temps sont en fin de liste : on ne retire que les compactés
+            pipe = client.pipeline(transaction=True)
+            pipe.set(self.summary_key, new_summary, ex=self.config['TTL'])
+            pipe.ltrim(self.turns_key, overflow, -1)
+            pipe.execute()
+            return overflow
+        finally:
+            client.delete(COMPACT_LOCK_KEY.format(session_id=self.session_id))
+
+    @staticmethod
+    def render(summary: str, turns: List[Dict]) -> str:
+        """Historique pour le prompt : résumé puis derniers échanges"""
+        lines = []
+        if summary:
+            lines.append(f"Résumé des échanges précédents : {summary}")
+        for turn in turns:
+            lines.append(f"Patient : {turn['q']}")
+            lines.append(f"Assistant : {turn['a']}")
+        return "\n".join(lines)
+
+
+def summarize(llm, summary: str, turns: List[Dict], max_tokens: int) -> str:
+    """Fusionne le résumé existant et les échanges donnés en un résumé borné"""
+    from rag.context import CHARS_PER_TOKEN, truncate_to_tokens
+
+    exchanges = "\n".join(f"Patient : {t['q']}\nAssistant : {t['a']}" for t in turns)
+    max_words = max_tokens * CHARS_PER_TOKEN // 6
+    prompt = (
+        "Résume cette conversation entre un patient et un assistant médical, "
+        f"en français, en {max_words} mots maximum. Garde uniquement les faits utiles "
+        "pour la suite : sujets abordés, médicaments, examens, dates, valeurs, questions en suspens.\n\n"
+        f"Résumé précédent : {summary or '(aucun)'}\n\n"
+        f"Nouveaux échanges :\n{exchanges}\n\n"
+        "Résumé :"
+    )
+    try:
+        new_summary = llm.generate(prompt).strip()
+    except Exception as e:
+        # Sans LLM : on garde les dernières questions, le résumé reste borné
+        logger.warning(f"Résumé de conversation par LLM impossible: {e}")
+        new_summary = " ".join(filter(None, [summary] + [t['q'] for t in turns]))
+        return truncate_to_tokens(new_summary[-max_tokens * CHARS_PER_TOKEN:], max_tokens)
+    return truncate_to_tokens(new_summary, max_tokens)
+
+
+def names_subject(question: str) -> bool:
+    """La question nomme un sujet précis (nombre, examen, pathologie, médicament, nom propre)"""
+    if _SUBJECT_RE.search(question):
+        return True
+    words = re.findall(r"[A-Za-zÀ-ÖØ-öø-ÿ]+", question)
+    return any(word[0].isupper() and word.lower() not in _COMMON_CAPITALIZED for word in words[1:])
+
+
+def is_follow_up(question: str) -> bool:
+    """Question courte ou anaphorique, sans sujet propre : ne se comprend pas seule"""
+    words = question.split()
+    if len(words) > _FOLLOW_UP_MAX_WORDS or names_subject(question):
+        return False
+    return len(words) <= 3 or bool(_FOLLOW_UP_RE.search(question))
+
+
+def rewrite_query(llm, question: str, summary: str, turns: List[Dict]) -> str:
+    """
+    Reformule une question de suivi en question autonome pour la recherche.
+    Sans échange précédent, ou si la question se suffit à elle-même, elle
+    est retournée telle quelle (pas d'appel LLM).
+    """
+    if not turns or not is_follow_up(question):
+        return question
+    history = ConversationMemory.render(summary, turns[-2:])
+    prompt = (
+        "Reformule la dernière question du patient en une question autonome et complète, "
+        "compréhensible sans l'historique. Ne réponds pas à la question. "
+        "Retourne uniquement la question reformulée.\n\n"
+        f"Historique :\n{history}\n\n"
+        f"Dernière question : {question}\n\n"
+        "Question autonome :"
+    )
+    try:
+        rewritten = llm.generate(prompt).strip().strip('"« »')
+    except Exception as e:
+        logger.warning(f"Reformulation de la question impossible: {e}")
+        return question
+    if not rewritten or len(rewritten) > 4 * max(len(question), 80):
+        return question
+    return rewritten
+
+
+def prepare_history(session_id: Optional[str], question: str, llm) -> Tuple[str, str]:
+    """
+    Pour une question entrante : (question pour la recherche, historique
+    pour le prompt). Sans session, ('question', '').
+    """
+    if not session_id:
+        return question, ''
+    memory = ConversationMemory(session_id)
+    summary, turns = memory.load()
+    if not (summary or turns):
+        return question, ''
+    search_query = question
+    if memory.config['REWRITE_FOLLOW_UPS']:
+        search_query = rewrite_query(llm, question, summary, turns)
+    return search_query, memory.render(summary, turns)
@@ -50,3 +50,13 @@ def archive_old_conversations():
     except Exception as e:
         logger.error(f"Erreur archivage conversations: {e}")
         return {"error": str(e)}
+
+@shared_task(name='sessions.tasks.compact_conversation_memory')
+def compact_conversation_memory(session_id):
+    """Résume les échanges les plus anciens d'une session dans son résumé glissant"""
+    from rag import runtime
+    from .memory import ConversationMemory
+
+    compacted = ConversationMemory(session_id).compact(runtime.get_llm())
+    logger.info(f"Mémoire de la session {session_id}: {compacted} échanges résumés")
+    return {"compacted": compacted}